@@ -294,7 +294,8 @@ sudo mkdir -p \
   /var/lib/aiinabox/search_eng_data \
   /var/lib/aiinabox/index_dir \
   /var/lib/aiinabox/title_index_dir \
-  /var/lib/aiinabox/front_end
+  /var/lib/aiinabox/front_end \
+  /var/lib/aiinabox/front_end_data
 
 sudo chown -R "$(whoami)":"$(whoami)" /var/lib/aiinabox
 
@@ -312,7 +313,7 @@ if [[ "$populate_frontend" =~ ^[Yy]$ ]]; then
     sudo cp "$REPO_DIR/src/ai_pipeline/template_generator.py" "$PERSISTENT_FRONTEND/" || true
     sudo cp "$REPO_DIR/src/ai_pipeline/templates/"sick_visit_*_template_p{0,1,2,3}.txt "$PERSISTENT_FRONTEND/" || true
     sudo cp "$REPO_DIR/src/search_engine/data/stopwords.txt" "$PERSISTENT_FRONTEND/" || true
-    sudo cp "$REPO_DIR/src/search_engine/"{document_preprocessor.py,indexing.py,l2r.py,misc_tools.py,network_features.py,ranker.py,relevance.py} \
+    sudo cp "$REPO_DIR/src/search_engine/"{document_preprocessor.py,indexing.py,l2r.py,misc_tools.py,network_features.py,postings_codecs.py,ranker.py,relevance.py} \
        "$PERSISTENT_FRONTEND/" || true
 else
     echo "Skipping front_end directory population."
@@ -1,13 +1,87 @@
 import os
+import threading
 import time
 from ollama import Client
 from personalities import *
 
+# Seconds to wait for ollama's response in each stage of the pipeline, after which the stage gives up.
+# The clients' timeout applies to each read; ollama sends a non-streamed response all at once when it is
+# done, so for those stages it bounds the whole request. A streamed response keeps sending chunks, so its
+# deadline is checked as they arrive (see stream_filled_template)
+DEFAULT_STAGE_TIMEOUTS = {
+    'generate': 180.0,
+    'check': 180.0,
+    'extract': 60.0,
+}
 
-class TemplateGenerator:
+# The model of every stage
+MODEL = 'phi3:14b'
+
+# How long ollama keeps each model loaded after a request (negative: until ollama stops), so that no
+# transcript waits for the model to load. Unloading a model also drops its cache of evaluated prompts
+DEFAULT_KEEP_ALIVE = {
+    MODEL: -1,
+}
+
+
+class TokenUsage:
+    """
+    Running totals of the tokens ollama evaluated in each stage. prompt_eval_count only counts the prompt
+    tokens ollama had to process: the prefix it had cached from an earlier request with the same start is
+    not evaluated again. eval_count counts the generated tokens.
+    """
     def __init__(self):
-        # Initialize the Ollama client
-        self.client = Client(host='http://ollama:11434')
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    def record(self, stage, response):
+        """
+        Add the counts and durations (nanoseconds) of an ollama response (the last chunk, if streamed).
+        """
+        with self.lock:
+            totals = self.totals.setdefault(stage, {
+                'calls': 0,
+                'prompt_eval_count': 0,
+                'prompt_eval_duration': 0,
+                'eval_count': 0,
+                'eval_duration': 0,
+            })
+            totals['calls'] += 1
+            for key in ('prompt_eval_count', 'prompt_eval_duration', 'eval_count', 'eval_duration'):
+                totals[key] += response.get(key) or 0
+
+    def stats(self):
+        """
+        The totals of each stage, with the mean tokens and seconds of prompt evaluation and generation per call.
+        """
+        with self.lock:
+            totals = {stage: dict(stage_totals) for stage, stage_totals in self.totals.items()}
+        stats = {}
+        for stage, stage_totals in totals.items():
+            calls = stage_totals['calls']
+            stats[stage] = {
+                'calls': calls,
+                'prompt_eval_count': stage_totals['prompt_eval_count'],
+                'eval_count': stage_totals['eval_count'],
+                'prompt_eval_seconds': stage_totals['prompt_eval_duration'] / 1e9,
+                'eval_seconds': stage_totals['eval_duration'] / 1e9,
+                'mean_prompt_eval_count': stage_totals['prompt_eval_count'] / calls,
+                'mean_eval_count': stage_totals['eval_count'] / calls,
+                'mean_prompt_eval_seconds': stage_totals['prompt_eval_duration'] / 1e9 / calls,
+                'mean_eval_seconds': stage_totals['eval_duration'] / 1e9 / calls,
+            }
+        return stats
+
+
+class TemplateGenerator:
+    def __init__(self, stage_timeouts=None, keep_alive=None):
+        # Initialize an Ollama client per stage, each with the stage's timeout
+        self.stage_timeouts = dict(DEFAULT_STAGE_TIMEOUTS, **(stage_timeouts or {}))
+        self.clients = {stage: Client(host='http://ollama:11434', timeout=timeout)
+                        for stage, timeout in self.stage_timeouts.items()}
+        self.client = self.clients['generate']
+        self.keep_alive = dict(DEFAULT_KEEP_ALIVE, **(keep_alive or {}))
+        self.token_usage = TokenUsage()
         
         # Load templates and personalities
         self.load_templates()
@@ -26,60 +100,31 @@ class TemplateGenerator:
         self.personas = [personality0, personality1, personality2, personality3]
         self.check_personas = [check_persona0, check_persona1, check_persona2, check_persona3]
 
-    def generate_filled_template(self, personality_index, user_input, temperature=0.1):
-        personality = self.personas[personality_index]
-        template_empty = self.templates_empty[personality_index]
-        template_filled = self.templates_filled[personality_index]
-
+    def generate_filled_template(self, personality_index, user_input, temperature=0.1, on_token=None,
+                                 deadline=None):
+        """
+        Fills out the personality's template from the transcript. With on_token, the response is streamed
+        and on_token is called with each piece of text as ollama generates it, until the deadline (a
+        time.monotonic() time), if given, or the stage's timeout.
+        """
         try:
-            # Define the system message
-            system_message = {
-                'role': 'system',
-                'content': personality
-            }
-
-            # Define the user messages in a logical sequence
-            user_messages = [
-                {
-                    'role': 'user',
-                    'content': "Here is an empty medical visit template that needs to be filled out based on patient information:\n\n" + template_empty
-                },
-                {
-                    'role': 'user',
-                    'content': "Here is the transcript of the medical professional and patient interaction. You will need to look at this and find the answers to the questions:\n\n" + user_input
-                },
-                {
-                    'role': 'user',
-                    'content': "Here is an example of a filled out template. THIS IS ONLY AN EXAMPLE. Do not input the data from this filled out example into the final output:\n\n" + template_filled
-                },
-                {
-                    'role': 'user',
-                    'content': "Read the transcript while looking at the empty medical template. Use the information in the transcript to fill out the template. Do not use the example filled out template directly to fill out the form."
-                },
-                {
-                    'role': 'user',
-                    'content': "Only fill out the information that is required in the empty template based on the patient's responses in the transcript. Do not add extra fields."
-                },
-            ]
-
-            # Combine all messages
-            messages = [system_message] + user_messages
-
-            # Send the messages to the model
-            response = self.client.chat(
-                model='phi3:14b',
-                messages=messages,
-                options={
-                    "temperature": temperature,
-                    "repeat_last_n": 200,
-                    "repetition_penalty": 1.3,
-                    "num_predict": -2,
-                    "stop": ["Extra Field:"]
-                }
-            )
+            if on_token is None:
+                # Send the messages to the model
+                response = self._chat(
+                    'generate',
+                    messages=self._filled_template_messages(personality_index, user_input),
+                    options=self._filled_template_options(temperature)
+                )
+                filled_template = response['message']["content"]
+            else:
+                pieces = []
+                for text in self.stream_filled_template(personality_index, user_input, temperature, deadline):
+                    pieces.append(text)
+                    on_token(text)
+                filled_template = ''.join(pieces)
 
             # Extract the filled template from the response
-            filled_template = response['message']["content"].strip()
+            filled_template = filled_template.strip()
             print(f"Filled template for personality {personality_index}:\n{filled_template}")
             return filled_template
 
@@ -87,6 +132,99 @@ class TemplateGenerator:
             print(f"Error generating filled template: {e}")
             return None
 
+    def stream_filled_template(self, personality_index, user_input, temperature=0.1, deadline=None):
+        """
+        Generates the filled template like generate_filled_template, yielding its text piece by piece
+        as ollama streams it. Raises TimeoutError once the generate stage's timeout or the given deadline
+        (a time.monotonic() time) has passed, closing the stream so that ollama stops generating.
+        """
+        stage_deadline = time.monotonic() + self.stage_timeouts['generate']
+        if deadline is not None:
+            stage_deadline = min(stage_deadline, deadline)
+        stream = self._chat(
+            'generate',
+            messages=self._filled_template_messages(personality_index, user_input),
+            options=self._filled_template_options(temperature),
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                if time.monotonic() > stage_deadline:
+                    raise TimeoutError(f"Generating template {personality_index} ran out of time")
+                yield chunk['message']['content']
+        finally:
+            stream.close()
+
+    def _filled_template_messages(self, personality_index, user_input):
+        personality = self.personas[personality_index]
+        template_empty = self.templates_empty[personality_index]
+        template_filled = self.templates_filled[personality_index]
+
+        # Define the system message
+        system_message = {
+            'role': 'system',
+            'content': personality
+        }
+
+        # Define the user messages in a logical sequence
+        user_messages = [
+            {
+                'role': 'user',
+                'content': "Here is an empty medical visit template that needs to be filled out based on patient information:\n\n" + template_empty
+            },
+            {
+                'role': 'user',
+                'content': "Here is the transcript of the medical professional and patient interaction. You will need to look at this and find the answers to the questions:\n\n" + user_input
+            },
+            {
+                'role': 'user',
+                'content': "Here is an example of a filled out template. THIS IS ONLY AN EXAMPLE. Do not input the data from this filled out example into the final output:\n\n" + template_filled
+            },
+            {
+                'role': 'user',
+                'content': "Read the transcript while looking at the empty medical template. Use the information in the transcript to fill out the template. Do not use the example filled out template directly to fill out the form."
+            },
+            {
+                'role': 'user',
+                'content': "Only fill out the information that is required in the empty template based on the patient's responses in the transcript. Do not add extra fields."
+            },
+        ]
+
+        # Combine all messages
+        return [system_message] + user_messages
+
+    def _chat(self, stage, messages, options, stream=False):
+        """
+        Send a conversation to the model with the stage's client, keeping the model loaded, and record its
+        token counts (see TokenUsage). With stream, yields the response's chunks.
+        """
+        response = self.clients[stage].chat(
+            model=MODEL,
+            messages=messages,
+            options=options,
+            keep_alive=self.keep_alive.get(MODEL),
+            stream=stream
+        )
+        if not stream:
+            self.token_usage.record(stage, response)
+            return response
+        return self._record_stream(stage, response)
+
+    def _record_stream(self, stage, stream):
+        for chunk in stream:
+            if chunk['done']:
+                self.token_usage.record(stage, chunk)
+            yield chunk
+
+    def _filled_template_options(self, temperature):
+        return {
+            "temperature": temperature,
+            "repeat_last_n": 200,
+            "repetition_penalty": 1.3,
+            "num_predict": -2,
+            "stop": ["Extra Field:"]
+        }
+
     def check_outputs(self, response, personality_index, user_input, attempt=1, max_attempts=5):
         personality = self.check_personas[personality_index]
         template_empty = self.templates_empty[personality_index]
@@ -129,8 +267,8 @@ class TemplateGenerator:
             messages = [system_message] + user_messages
 
             # Send messages to the model
-            verification_response = self.client.chat(
-                model='phi3:14b',
+            verification_response = self._chat(
+                'check',
                 messages=messages,
                 options={
                     "temperature": 0.0,
@@ -190,8 +328,8 @@ class TemplateGenerator:
             messages = [system_message, user_message]
 
             # Send messages to the model
-            response = self.client.chat(
-                model='phi3:14b',
+            response = self._chat(
+                'extract',
                 messages=messages,
                 options={
                     "temperature": 0.0,
@@ -1,19 +1,37 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
+import json
+import math
 import os
-from document_preprocessor import RegexTokenizer
-from indexing import Indexer
-from ranker import Ranker, BM25
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from document_preprocessor import RegexTokenizer, TokenNormalizer
+from indexing import Indexer, SegmentedIndex
+from ranker import Ranker, BM25, QueryResultCache
 from l2r import L2RFeatureExtractor, L2RRanker, MiscFunctionsL2R
 from template_generator import TemplateGenerator
+from transcript_jobs import TranscriptJobQueue
+from transcript_store import TranscriptStore
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
 app.config["TEMPLATES_AUTO_RELOAD"] = True
 
 # -------------------------------------------------------
-# 1) In-memory store of transcripts & pipeline results
-#    (In production, you'd use a real DB.)
+# 1) Persistent store of transcripts & pipeline results
 # -------------------------------------------------------
-TRANSCRIPTS_STORE = []  # each item: { 'timestamp', 'filename', 'transcript', 'verified_templates', 'results', 'error' }
+# Writable directory of the front end's own data (/app/front_end is mounted read-only)
+FRONT_END_DATA_DIR = os.environ.get("FRONT_END_DATA_DIR", "/app/front_end_data")
+os.makedirs(FRONT_END_DATA_DIR, exist_ok=True)
+TRANSCRIPTS_DB_PATH = os.path.join(FRONT_END_DATA_DIR, "transcripts.db")
+
+# Records of the most recent transcripts kept in memory, and records per page of the transcript history
+TRANSCRIPT_CACHE_SIZE = int(os.environ.get("TRANSCRIPT_CACHE_SIZE", "50"))
+TRANSCRIPTS_PER_PAGE = int(os.environ.get("TRANSCRIPTS_PER_PAGE", "20"))
+
+# Each record: { 'id', 'run_id', 'timestamp', 'filename', 'transcript', 'verified_templates', 'results', 'error' }
+transcript_store = TranscriptStore(TRANSCRIPTS_DB_PATH, cache_size=TRANSCRIPT_CACHE_SIZE)
 
 # -------------------------------------------------------
 # 2) Setup & initialization
@@ -21,103 +39,307 @@ TRANSCRIPTS_STORE = []  # each item: { 'timestamp', 'filename', 'transcript', 'v
 with open('/app/front_end/stopwords.txt', 'r', encoding='utf-8') as f:
     stop_words = set(f.read().splitlines())
 
-tokenizer = RegexTokenizer(stopwords=stop_words)
-
 index_directory = '/app/icd_10_index_dir'
 title_index_directory = '/app/icd_10_title_index_dir'
 
-print("Loading main index...")
-index = Indexer.load_index(index_directory)
-print("Main index loaded.")
-
-print("Loading title index...")
-title_index = Indexer.load_index(title_index_directory)
-print("Title index loaded.")
-
-bm25_scorer = BM25(index)
-base_ranker = Ranker(
-    index=index,
-    document_preprocessor=tokenizer,
-    stopwords=stop_words,
-    scorer=bm25_scorer
-)
-
-feature_extractor = L2RFeatureExtractor(
-    document_index=index,
-    title_index=title_index,
-    document_preprocessor=tokenizer,
-    stopwords=stop_words,
-    docid_to_network_features=MiscFunctionsL2R().load_network_features("/app/icd_10_search_eng_data/network_statistics.csv")
-)
-
-l2r_ranker = L2RRanker(
-    document_index=index,
-    title_index=title_index,
-    document_preprocessor=tokenizer,
-    stopwords=stop_words,
-    ranker=base_ranker,
-    feature_extractor=feature_extractor
-)
-
-try:
-    l2r_ranker.load_model('/app/icd_10_search_eng_data/l2r_model.txt')
-    print("Trained model loaded successfully.")
-except Exception as e:
-    print(f"Error loading trained model: {e}")
-
-template_generator = TemplateGenerator()
+# Seconds between checks for a new index generation (incremental updates, see SegmentedIndex)
+INDEX_RELOAD_INTERVAL = float(os.environ.get("INDEX_RELOAD_INTERVAL", "30"))
+
+# Caches of query results, shared by the index generations: the same symptom combinations recur across visits.
+# Loading a new index generation or model invalidates them.
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "3600"))
+base_ranker_cache = QueryResultCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+l2r_ranker_cache = QueryResultCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+docid_to_network_features = MiscFunctionsL2R().load_network_features("/app/icd_10_search_eng_data/network_statistics.csv")
+
+
+class SearchGeneration:
+    """
+    The indexes and rankers of one index generation. Requests take a reference to the current
+    generation when they start, so swapping in a new one never affects requests in flight.
+    """
+    def __init__(self):
+        self.generation = current_index_generation()
+
+        print(f"Loading main index (generation {self.generation[0]})...")
+        self.index = Indexer.load_index(index_directory)
+        print("Main index loaded.")
+
+        print(f"Loading title index (generation {self.generation[1]})...")
+        self.title_index = Indexer.load_index(title_index_directory)
+        print("Title index loaded.")
+
+        # Tokenize and normalize queries (stemming, synonyms) the way the index was built
+        tokenizer = RegexTokenizer.from_config(self.index.tokenizer_config, stopwords=stop_words,
+                                               normalizer=TokenNormalizer.from_config(self.index.normalizer_config))
+
+        bm25_scorer = BM25(self.index)
+        base_ranker = Ranker(
+            index=self.index,
+            document_preprocessor=tokenizer,
+            stopwords=stop_words,
+            scorer=bm25_scorer,
+            cache=base_ranker_cache
+        )
+
+        feature_extractor = L2RFeatureExtractor(
+            document_index=self.index,
+            title_index=self.title_index,
+            document_preprocessor=tokenizer,
+            stopwords=stop_words,
+            docid_to_network_features=docid_to_network_features
+        )
+
+        self.l2r_ranker = L2RRanker(
+            document_index=self.index,
+            title_index=self.title_index,
+            document_preprocessor=tokenizer,
+            stopwords=stop_words,
+            ranker=base_ranker,
+            feature_extractor=feature_extractor,
+            cache=l2r_ranker_cache
+        )
+
+        try:
+            self.l2r_ranker.load_model('/app/icd_10_search_eng_data/l2r_model.txt')
+            print("Trained model loaded successfully.")
+        except Exception as e:
+            print(f"Error loading trained model: {e}")
+        # Build the static features with the model's hierarchy vocabulary before serving queries
+        feature_extractor.build_static_features()
+
+
+def current_index_generation():
+    return (SegmentedIndex(index_directory).current_generation(),
+            SegmentedIndex(title_index_directory).current_generation())
+
+
+def watch_index_generations():
+    """
+    Load each new index generation in the background and swap it in atomically. A generation of several
+    segments is queried in place, so loading it only opens the segments (see SegmentedIndex).
+    """
+    global search_generation
+    while True:
+        time.sleep(INDEX_RELOAD_INTERVAL)
+        try:
+            if current_index_generation() != search_generation.generation:
+                new_generation = SearchGeneration()
+                search_generation = new_generation
+                print(f"Switched to index generation {new_generation.generation}.")
+        except Exception as e:
+            print(f"Error reloading the index: {e}")
+
+
+search_generation = SearchGeneration()
+threading.Thread(target=watch_index_generations, daemon=True).start()
+
+# The four persona chains of a transcript run concurrently, at most OLLAMA_CONCURRENCY at a time across
+# all requests: one per GPU reserved for the ollama service in docker-compose.yml (see OLLAMA_NUM_PARALLEL)
+OLLAMA_CONCURRENCY = int(os.environ.get("OLLAMA_CONCURRENCY", "2"))
+persona_executor = ThreadPoolExecutor(max_workers=OLLAMA_CONCURRENCY, thread_name_prefix="persona")
+
+# Seconds each ollama stage may take before it gives up (the template is then skipped, left unverified
+# or has no terms)
+template_generator = TemplateGenerator(stage_timeouts={
+    'generate': float(os.environ.get("OLLAMA_GENERATE_TIMEOUT", "180")),
+    'check': float(os.environ.get("OLLAMA_CHECK_TIMEOUT", "180")),
+    'extract': float(os.environ.get("OLLAMA_EXTRACT_TIMEOUT", "60")),
+})
+
+# Seconds a persona chain may run in all (by default, the sum of its stages' timeouts) before the transcript
+# goes on without it, as if it had failed. Time spent waiting for a free OLLAMA_CONCURRENCY slot does not count
+PERSONA_CHAIN_TIMEOUT = float(os.environ.get("PERSONA_CHAIN_TIMEOUT",
+                                             str(sum(template_generator.stage_timeouts.values()))))
+# Seconds all the persona chains of a transcript may take from when it starts, waiting for slots included
+# (by default, enough for the four chains to run in turns of OLLAMA_CONCURRENCY); chains that are still
+# running or waiting then are given up
+TRANSCRIPT_TIMEOUT = float(os.environ.get("TRANSCRIPT_TIMEOUT",
+                                          str(PERSONA_CHAIN_TIMEOUT * math.ceil(4 / OLLAMA_CONCURRENCY))))
+# Seconds between checks whether a queued persona chain has started
+PERSONA_CHAIN_POLL_INTERVAL = 1.0
+
+# Seconds between keep-alive comments on idle server-sent event streams
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", "15"))
+
+# Transcripts processed at once; further transcripts wait in the job queue
+TRANSCRIPT_WORKERS = int(os.environ.get("TRANSCRIPT_WORKERS", "2"))
+
+
+class PipelineEvents:
+    """
+    Fans the events of running pipelines (template tokens as they are generated, verified templates,
+    search results) out to the connected browsers. Each subscriber has a bounded queue: a subscriber
+    that falls behind misses events instead of holding up the pipeline.
+    """
+    def __init__(self, max_queued_events=1000):
+        self.max_queued_events = max_queued_events
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_queued_events)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                pass
+
+
+pipeline_events = PipelineEvents()
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """
+    A streaming response of server-sent events, without buffering by proxies.
+    """
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # -------------------------------------------------------
 # 3) Pipeline helper
 # -------------------------------------------------------
-def run_pipeline(user_input):
+def run_persona_chain(personality_index, user_input, emit, deadline=None):
+    """
+    Generate, verify and extract the terms of one personality's template, streaming the template's
+    tokens as 'template_token' events. Returns the verified template entry (None if generation failed)
+    and the extracted terms. Once the deadline (a time.monotonic() time), if given, has passed, the chain
+    stops streaming and does not start its next stage, as if it had failed, so that it frees its slot.
+    """
+    def out_of_time(stage):
+        if deadline is not None and time.monotonic() >= deadline:
+            print(f"[Pipeline] Template {personality_index} ran out of time before {stage}")
+            return True
+        return False
+
+    if out_of_time("generation"):
+        return None, []
+    filled_template = template_generator.generate_filled_template(
+        personality_index=personality_index,
+        user_input=user_input,
+        temperature=0.1,
+        on_token=lambda text: emit('template_token', {'personality_index': personality_index, 'text': text}),
+        deadline=deadline
+    )
+    if not filled_template:
+        print(f"[Pipeline] Failed to generate template {personality_index}")
+        return None, []
+
+    if out_of_time("verification"):
+        return None, []
+
+    verified_template = template_generator.check_outputs(
+        response=filled_template,
+        personality_index=personality_index,
+        user_input=user_input,
+        attempt=1,
+        max_attempts=1
+    )
+
+    if out_of_time("term extraction"):
+        return None, []
+    verified_template_entry = {'personality_index': personality_index, 'template': verified_template}
+    emit('template', verified_template_entry)
+
+    # Extract terms
+    terms = template_generator.extract_terms(verified_template)
+    return verified_template_entry, terms
+
+
+def run_pipeline(user_input, on_event=None):
+    """
+    Run the template and search pipeline on a transcript. on_event, if given, is called with the name and
+    data of each event as the pipeline progresses (see PipelineEvents), possibly from other threads.
+    """
+    emit = on_event or (lambda event, data: None)
     if not user_input:
+        emit('error', {"error": "No input provided to pipeline."})
         return {"error": "No input provided to pipeline."}
 
     verified_templates = []
     all_extracted_terms = []
 
-    for personality_index in range(4):
-        filled_template = template_generator.generate_filled_template(
-            personality_index=personality_index,
-            user_input=user_input,
-            temperature=0.1
-        )
-        if not filled_template:
-            print(f"[Pipeline] Failed to generate template {personality_index}")
-            continue
-
-        verified_template = template_generator.check_outputs(
-            response=filled_template,
-            personality_index=personality_index,
-            user_input=user_input,
-            attempt=1,
-            max_attempts=1
-        )
-        verified_templates.append({
-            'personality_index': personality_index,
-            'template': verified_template
-        })
-
-        # Extract terms
-        terms = template_generator.extract_terms(verified_template)
+    # Run the persona chains concurrently and collect them in personality order. Each chain has until
+    # PERSONA_CHAIN_TIMEOUT after it starts, and all of them until TRANSCRIPT_TIMEOUT after the transcript starts
+    transcript_deadline = time.monotonic() + TRANSCRIPT_TIMEOUT
+    deadlines = {}
+    expired = set()
+
+    def run_chain(personality_index):
+        deadline = min(time.monotonic() + PERSONA_CHAIN_TIMEOUT, transcript_deadline)
+        deadlines[personality_index] = deadline
+
+        def chain_emit(event, data):
+            # An expired chain's late events would mix into the transcript's finished output
+            if personality_index not in expired:
+                emit(event, data)
+
+        return run_persona_chain(personality_index, user_input, chain_emit, deadline)
+
+    def chain_result(personality_index, future):
+        """
+        The chain's result, or that of a failed chain (no template, no terms) once its deadline has passed.
+        A chain that is still waiting for a slot then is cancelled; a running one stops at the same deadline.
+        """
+        while True:
+            deadline = deadlines.get(personality_index)
+            if deadline is None:
+                # Not started yet: check again shortly, until the transcript's deadline
+                timeout = min(PERSONA_CHAIN_POLL_INTERVAL, max(transcript_deadline - time.monotonic(), 0))
+            else:
+                timeout = max(deadline - time.monotonic(), 0)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeoutError:
+                if deadline is not None or time.monotonic() >= transcript_deadline:
+                    expired.add(personality_index)
+                    future.cancel()
+                    print(f"[Pipeline] Template {personality_index} timed out")
+                    return None, []
+
+    futures = [persona_executor.submit(run_chain, personality_index) for personality_index in range(4)]
+    for personality_index, future in enumerate(futures):
+        verified_template, terms = chain_result(personality_index, future)
+        if verified_template is not None:
+            verified_templates.append(verified_template)
         all_extracted_terms.extend(terms)
 
     if not all_extracted_terms:
+        emit('error', {"error": "No relevant terms found in the templates."})
         return {
             "error": "No relevant terms found in the templates.",
             "verified_templates": verified_templates
         }
 
     new_query = ' '.join(set(all_extracted_terms))
+    # Use one index generation for the whole query, even if a new one is swapped in meanwhile
+    search = search_generation
     try:
-        ranked_docs = l2r_ranker.query(new_query, k=15)
+        ranked_docs = search.l2r_ranker.query(new_query, k=15)
     except Exception as e:
+        emit('error', {"error": f"Ranking error: {e}"})
         return {"error": f"Ranking error: {e}"}
 
     results = []
     for docid, score in ranked_docs:
-        doc_metadata = index.document_metadata.get(docid, {})
+        doc_metadata = search.index.document_metadata.get(docid, {})
         title = doc_metadata.get('title', 'No Title')
         snippet = doc_metadata.get('text', '')[:400] + '...'
         url = doc_metadata.get('url', '#')
@@ -126,93 +348,253 @@ def run_pipeline(user_input):
             'title': title,
             'snippet': snippet,
             'url': "https://www.icd10data.com" + url,
-            'score': round(score, 2)
+            'score': round(float(score), 2)
         })
+    emit('results', {'results': results})
 
     return {
         "verified_templates": verified_templates,
         "results": results
     }
 
+
+def process_transcript_job(job_id, payload):
+    # A job requeued at startup may have stored its record before the restart: don't run the pipeline again
+    record = transcript_store.get_by_run_id(job_id)
+    if record is not None:
+        return record
+    return process_transcript(payload["transcript"], payload.get("timestamp"), payload.get("filename"),
+                              run_id=job_id)
+
+
+# Queued transcripts, processed in the background so that /api/transcript answers immediately
+transcript_jobs = TranscriptJobQueue(TRANSCRIPTS_DB_PATH, process_transcript_job, num_workers=TRANSCRIPT_WORKERS)
+
 # -------------------------------------------------------
 # 4) Routes
 # -------------------------------------------------------
 @app.route('/')
 def home():
     """
-    Displays the *most recent* transcript's pipeline results
+    Displays the *most recent* transcript's pipeline results (or those of the ?record=<id> transcript)
     in the same two-column layout (RAG on the left, results on the right)
-    but no search bar.
-    """
-    if TRANSCRIPTS_STORE:
-        last_transcript = TRANSCRIPTS_STORE[-1]
-        print(last_transcript)
-        error = last_transcript.get("error")
-        verified_templates = last_transcript.get("verified_templates")
-        results = last_transcript.get("results")
+    but no search bar, above a page (?page=<n>) of the transcript history.
+    """
+    record_id = request.args.get('record', type=int)
+    if record_id is not None:
+        record = transcript_store.get(record_id)
     else:
-        error = None
-        verified_templates = None
-        results = None
+        record = transcript_store.latest()
+    record = record or {}
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    history, total = transcript_store.page(page, TRANSCRIPTS_PER_PAGE)
 
     return render_template(
         'index.html',
-        error=error,
-        verified_templates=verified_templates,
-        results=results
+        error=record.get("error"),
+        verified_templates=record.get("verified_templates"),
+        results=record.get("results"),
+        record_id=record.get("id"),
+        history=history,
+        page=page,
+        has_newer=page > 1,
+        has_older=page * TRANSCRIPTS_PER_PAGE < total
     )
 
-@app.route('/api/transcript', methods=['POST'])
-def handle_transcript():
-    try:
-        data = request.get_json(force=True)
-        if not data:
-            return jsonify({"error": "No JSON payload"}), 400
-
-        txt = data.get("transcript", "").strip()
-        if not txt:
-            return jsonify({"error": "No 'transcript' field"}), 400
+def process_transcript(txt, timestamp, filename, on_event=None, run_id=None):
+    """
+    Run the pipeline on a transcript, publishing its events to the connected browsers (and to on_event,
+    if given), and store the record of the result. run_id identifies the run in the events (a new id by
+    default).
+    """
+    run_id = run_id or uuid.uuid4().hex
+
+    def emit(event, data):
+        data = dict(data, run_id=run_id)
+        pipeline_events.publish(event, data)
+        if on_event is not None:
+            on_event(event, data)
+
+    emit('pipeline_started', {"timestamp": timestamp, "filename": filename})
+    pipeline_result = run_pipeline(txt, emit)
+
+    record = {
+        "timestamp": timestamp,
+        "filename": filename,
+        "transcript": txt,
+        "verified_templates": pipeline_result.get("verified_templates"),
+        "results": pipeline_result.get("results"),
+    }
 
-        timestamp = data.get("timestamp")
-        filename = data.get("filename")
+    if "error" in pipeline_result:
+        record["error"] = pipeline_result["error"]
 
-        pipeline_result = run_pipeline(txt)
+    # Store in the transcripts
+    record = transcript_store.add(record, run_id=run_id)
+    print(f"[Pipeline] Stored transcript {record['id']} ({filename}).")
 
-        print(pipeline_result)
+    emit('done', {"error": record.get("error")})
+    return record
 
-        record = {
-            "timestamp": timestamp,
-            "filename": filename,
-            "transcript": txt,
-            "verified_templates": pipeline_result.get("verified_templates"),
-            "results": pipeline_result.get("results"),
-        }
 
-        print(record)
+def read_transcript_payload():
+    """
+    The transcript, timestamp and filename of a transcript request, or an error response.
+    """
+    data = request.get_json(force=True)
+    if not data:
+        return None, (jsonify({"error": "No JSON payload"}), 400)
 
-        if "error" in pipeline_result:
-            record["error"] = pipeline_result["error"]
+    txt = data.get("transcript", "").strip()
+    if not txt:
+        return None, (jsonify({"error": "No 'transcript' field"}), 400)
 
-        # Store in the transcripts
-        TRANSCRIPTS_STORE.append(record)
+    return (txt, data.get("timestamp"), data.get("filename")), None
 
-        print(TRANSCRIPTS_STORE)
 
-        # Render the updated page directly:
-        return render_template(
-            'index.html',
-            error=record.get("error"),
-            verified_templates=record.get("verified_templates"),
-            results=record.get("results")
-        )
+@app.route('/api/transcript', methods=['POST'])
+def handle_transcript():
+    """
+    Queue a transcript for the pipeline and return its job id at once; poll /api/jobs/<job_id> for the result.
+    """
+    try:
+        payload, error_response = read_transcript_payload()
+        if error_response:
+            return error_response
+
+        txt, timestamp, filename = payload
+        job_id = transcript_jobs.enqueue({"transcript": txt, "timestamp": timestamp, "filename": filename})
+        return jsonify({
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/api/jobs/{job_id}"
+        }), 202
 
     except Exception as e:
         print(f"Error in /api/transcript: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def transcript_job(job_id):
+    """
+    The status of a queued transcript, with its record (templates and results) once it is done.
+    """
+    job = transcript_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"No job {job_id}"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs', methods=['GET'])
+def transcript_job_stats():
+    """
+    The number of queued, running, done and failed transcript jobs.
+    """
+    return jsonify(transcript_jobs.stats())
+
+@app.route('/api/transcript/stream', methods=['POST'])
+def stream_transcript():
+    """
+    Like /api/transcript, but runs the pipeline within the request and streams its events (template tokens, verified templates,
+    search results) back as server-sent events while it runs.
+    """
+    payload, error_response = read_transcript_payload()
+    if error_response:
+        return error_response
+
+    events = queue.Queue()
+
+    def run():
+        try:
+            process_transcript(*payload, on_event=lambda event, data: events.put((event, data)))
+        except Exception as e:
+            print(f"Error in /api/transcript/stream: {e}")
+            events.put(('error', {"error": str(e)}))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def stream():
+        while True:
+            try:
+                item = events.get(timeout=SSE_HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            if item is None:
+                return
+            yield format_sse(*item)
+
+    return sse_response(stream())
+
+@app.route('/api/events', methods=['GET'])
+def pipeline_event_stream():
+    """
+    Server-sent events of every pipeline run, for the page to show templates as they are generated.
+    """
+    subscriber = pipeline_events.subscribe()
+
+    def stream():
+        try:
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=SSE_HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_sse(event, data)
+        finally:
+            pipeline_events.unsubscribe(subscriber)
+
+    return sse_response(stream())
+
+@app.route('/api/transcripts', methods=['GET'])
+def list_transcripts():
+    """
+    A page of the transcript records, newest first: ?page=, ?per_page=, and optionally ?filename= or a
+    range of timestamps (?since=, ?until=).
+    """
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', TRANSCRIPTS_PER_PAGE, type=int), 1), 100)
+    records, total = transcript_store.page(page, per_page,
+                                           filename=request.args.get('filename'),
+                                           since=request.args.get('since'),
+                                           until=request.args.get('until'))
+    return jsonify({"page": page, "per_page": per_page, "total": total, "transcripts": records})
+
+@app.route('/api/transcripts/<int:record_id>', methods=['GET'])
+def get_transcript(record_id):
+    record = transcript_store.get(record_id)
+    if record is None:
+        return jsonify({"error": f"No transcript {record_id}"}), 404
+    return jsonify(record)
+
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    """
+    Hit/miss metrics of the query result caches.
+    """
+    return jsonify({
+        "base_ranker": base_ranker_cache.stats(),
+        "l2r_ranker": l2r_ranker_cache.stats()
+    })
+
+@app.route('/api/llm_stats', methods=['GET'])
+def llm_stats():
+    """
+    Tokens ollama evaluated per stage: a low prompt_eval_count relative to the prompt's length shows that
+    the start of the prompts came from ollama's cache (see OLLAMA_NUM_PARALLEL in docker-compose.yml).
+    """
+    return jsonify(template_generator.token_usage.stats())
+
 
 # -------------------------------------------------------
 # Main
 # -------------------------------------------------------
+# The debug reloader runs this module in a watcher process as well: only the serving process takes jobs
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    transcript_jobs.start()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,200 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Attempts at recording a job's outcome while the database is locked
+FINISH_ATTEMPTS = 3
+
+# Job statuses: queued jobs wait for a worker, running jobs are being processed, and done or failed jobs
+# hold their result or error
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class TranscriptJobQueue:
+    """
+    Durable queue of transcript jobs, stored in SQLite so that a restart does not drop pending transcripts,
+    and processed by a fixed number of background worker threads.
+    """
+    def __init__(self, db_path, process_job, num_workers=2, poll_interval=5.0):
+        """
+        Args:
+            db_path: The SQLite database file
+            process_job: Function called with a job's id and payload; its return value (JSON-serializable)
+                is stored as the job's result, and an exception it raises fails the job
+            num_workers: The number of jobs processed at once
+            poll_interval: Seconds between checks for jobs when the queue looks empty
+        """
+        self.db_path = db_path
+        self.process_job = process_job
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.jobs_available = threading.Event()
+        self.workers = []
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS transcript_jobs ("
+                " id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " payload TEXT NOT NULL,"
+                " result TEXT,"
+                " error TEXT,"
+                " created_at REAL NOT NULL,"
+                " started_at REAL,"
+                " finished_at REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS transcript_jobs_status"
+                               " ON transcript_jobs (status, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        """
+        A connection for one transaction, committed (or rolled back on error) and closed afterwards.
+        Connections are not shared, since they cannot be used from several threads.
+        """
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def start(self):
+        """
+        Requeue the jobs that were running when the process last stopped and start the workers.
+        """
+        with self._connect() as connection:
+            requeued = connection.execute("UPDATE transcript_jobs SET status = ?, started_at = NULL WHERE status = ?",
+                                          (QUEUED, RUNNING)).rowcount
+        if requeued:
+            print(f"[Jobs] Requeued {requeued} interrupted transcript jobs.")
+        for worker_number in range(self.num_workers):
+            worker = threading.Thread(target=self._work, name=f"transcript-job-{worker_number}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        self.jobs_available.set()
+
+    def enqueue(self, payload):
+        """
+        Add a job and return its id.
+        """
+        job_id = uuid.uuid4().hex
+        with self._connect() as connection:
+            connection.execute("INSERT INTO transcript_jobs (id, status, payload, created_at) VALUES (?, ?, ?, ?)",
+                               (job_id, QUEUED, json.dumps(payload), time.time()))
+        self.jobs_available.set()
+        return job_id
+
+    def get(self, job_id):
+        """
+        The status of a job, with its result or error once it has finished, or None if there is no such job.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT id, status, result, error, created_at, started_at, finished_at,"
+                " (SELECT COUNT(*) FROM transcript_jobs AS earlier"
+                "  WHERE earlier.status = ? AND earlier.created_at < transcript_jobs.created_at)"
+                " FROM transcript_jobs WHERE id = ?", (QUEUED, job_id)).fetchone()
+        if row is None:
+            return None
+        job_id, status, result, error, created_at, started_at, finished_at, jobs_ahead = row
+        job = {
+            'job_id': job_id,
+            'status': status,
+            'created_at': created_at,
+            'started_at': started_at,
+            'finished_at': finished_at,
+        }
+        if status == QUEUED:
+            job['jobs_ahead'] = jobs_ahead
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def stats(self):
+        """
+        The number of jobs in each status.
+        """
+        with self._connect() as connection:
+            counts = dict(connection.execute("SELECT status, COUNT(*) FROM transcript_jobs GROUP BY status"))
+        return {status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)}
+
+    def _claim(self):
+        """
+        Mark the oldest queued job as running and return its id and payload, or None if there is none.
+        """
+        with self._connect() as connection:
+            # Take the write lock before reading, so that two workers never claim the same job
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT id, payload FROM transcript_jobs WHERE status = ?"
+                                     " ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+            if row is not None:
+                connection.execute("UPDATE transcript_jobs SET status = ?, started_at = ? WHERE id = ?",
+                                   (RUNNING, time.time(), row[0]))
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._connect() as connection:
+            connection.execute("UPDATE transcript_jobs SET status = ?, result = ?, error = ?, finished_at = ?"
+                               " WHERE id = ?",
+                               (status, None if result is None else json.dumps(result), error, time.time(), job_id))
+
+    def _run(self, job_id, payload):
+        """
+        Process a claimed job and record its outcome. If the outcome cannot be recorded (e.g. the database
+        stays locked), the job stays running until the next start requeues it, so process_job must be
+        idempotent per job id.
+        """
+        try:
+            result = self.process_job(job_id, payload)
+        except Exception as e:
+            print(f"[Jobs] Transcript job {job_id} failed: {e}")
+            self._finish_retrying(job_id, FAILED, error=str(e))
+            return
+        try:
+            self._finish_retrying(job_id, DONE, result=result)
+        except (TypeError, ValueError) as e:
+            # A result that is not JSON-serializable: fail the job rather than leave it running
+            print(f"[Jobs] Could not store the result of transcript job {job_id}: {e}")
+            self._finish_retrying(job_id, FAILED, error=f"Could not store the result: {e}")
+
+    def _finish_retrying(self, job_id, status, result=None, error=None):
+        for attempt in range(1, FINISH_ATTEMPTS + 1):
+            try:
+                self._finish(job_id, status, result=result, error=error)
+                return
+            except sqlite3.OperationalError as e:
+                # E.g. the database is locked by a long write of the transcript store sharing it
+                if attempt == FINISH_ATTEMPTS:
+                    raise
+                print(f"[Jobs] Retrying to record transcript job {job_id} as {status}: {e}")
+                time.sleep(self.poll_interval)
+
+    def _work(self):
+        while True:
+            # Clear before claiming, so that a job enqueued after the claim found none still wakes this worker
+            self.jobs_available.clear()
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"[Jobs] Error claiming a transcript job: {e}")
+                job = None
+            if job is None:
+                # Wait for an enqueue (or poll, in case another process added jobs)
+                self.jobs_available.wait(self.poll_interval)
+                continue
+
+            try:
+                self._run(*job)
+            except Exception as e:
+                # Keep the worker alive; the job is requeued at the next start
+                print(f"[Jobs] Error finishing transcript job {job[0]}: {e}")
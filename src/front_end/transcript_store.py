@@ -0,0 +1,190 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Columns of the records, in the order they are selected
+RECORD_COLUMNS = ('id', 'run_id', 'timestamp', 'filename', 'transcript', 'verified_templates', 'results',
+                  'error', 'created_at')
+
+
+def iso_timestamp(timestamp):
+    """
+    The ISO 8601 string of a transcript's timestamp (a datetime, seconds since the epoch or a string), so that
+    records and range filters compare the same way in memory and in the database. Strings that are not ISO
+    dates are kept as they are; None stays None.
+    """
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, datetime):
+        return timestamp.isoformat()
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+    try:
+        return datetime.fromisoformat(str(timestamp)).isoformat()
+    except ValueError:
+        return str(timestamp)
+
+
+class TranscriptStore:
+    """
+    The records of processed transcripts (templates, search results, error), stored in SQLite, newest first.
+    Only the most recent records are kept in memory, for the home page.
+    """
+    def __init__(self, db_path, cache_size=50):
+        """
+        Args:
+            db_path: The SQLite database file (may be shared with the job queue)
+            cache_size: The number of most recent records kept in memory
+        """
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " run_id TEXT,"
+                " timestamp TEXT,"
+                " filename TEXT,"
+                " transcript TEXT NOT NULL,"
+                " verified_templates TEXT,"
+                " results TEXT,"
+                " error TEXT,"
+                " created_at REAL NOT NULL)")
+            # Databases created before records had a run id
+            if 'run_id' not in {column[1] for column in connection.execute("PRAGMA table_info(transcripts)")}:
+                connection.execute("ALTER TABLE transcripts ADD COLUMN run_id TEXT")
+            connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS transcripts_run_id ON transcripts (run_id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS transcripts_timestamp ON transcripts (timestamp)")
+            connection.execute("CREATE INDEX IF NOT EXISTS transcripts_filename ON transcripts (filename)")
+            rows = connection.execute(f"SELECT {', '.join(RECORD_COLUMNS)} FROM transcripts"
+                                      " ORDER BY id DESC LIMIT ?", (cache_size,)).fetchall()
+        # Most recent first: it holds the newest records in the database, since every record is added through it
+        self.recent_records = deque((self._to_record(row) for row in rows), maxlen=cache_size)
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _to_record(row):
+        record = dict(zip(RECORD_COLUMNS, row))
+        for column in ('verified_templates', 'results'):
+            if record[column] is not None:
+                record[column] = json.loads(record[column])
+        if record['error'] is None:
+            del record['error']
+        return record
+
+    def add(self, record, run_id=None):
+        """
+        Store a transcript's record and return it with its id. A record is stored once per run id: adding
+        another one for the same run (e.g. a job that was processed again after a restart) returns the
+        stored record instead.
+        """
+        # The same timestamp string in the cache as in the database
+        record = dict(record, run_id=run_id, timestamp=iso_timestamp(record.get('timestamp')), created_at=time.time())
+        with self.lock:
+            if run_id is not None:
+                existing = self.get_by_run_id(run_id)
+                if existing is not None:
+                    return existing
+            with self._connect() as connection:
+                record['id'] = connection.execute(
+                    "INSERT INTO transcripts (run_id, timestamp, filename, transcript, verified_templates, results,"
+                    " error, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (run_id, record['timestamp'], record.get('filename'),
+                     record['transcript'], json.dumps(record.get('verified_templates')),
+                     json.dumps(record.get('results')), record.get('error'), record['created_at'])).lastrowid
+            self.recent_records.appendleft(record)
+        return record
+
+    def get(self, record_id):
+        """
+        The record with the given id, or None.
+        """
+        with self.lock:
+            for record in self.recent_records:
+                if record['id'] == record_id:
+                    return record
+        with self._connect() as connection:
+            row = connection.execute(f"SELECT {', '.join(RECORD_COLUMNS)} FROM transcripts WHERE id = ?",
+                                     (record_id,)).fetchone()
+        return None if row is None else self._to_record(row)
+
+    def get_by_run_id(self, run_id):
+        """
+        The record of a run, or None if the run has not stored one.
+        """
+        with self._connect() as connection:
+            row = connection.execute(f"SELECT {', '.join(RECORD_COLUMNS)} FROM transcripts WHERE run_id = ?",
+                                     (run_id,)).fetchone()
+        return None if row is None else self._to_record(row)
+
+    def latest(self):
+        """
+        The most recent record, or None if no transcript has been processed.
+        """
+        with self.lock:
+            return self.recent_records[0] if self.recent_records else None
+
+    def page(self, page=1, per_page=20, filename=None, since=None, until=None):
+        """
+        One page of the records, newest first, optionally only those of a file or within a range of
+        timestamps.
+
+        Args:
+            page: The page number, from 1
+            per_page: The number of records in a page
+            filename: Only the records of this file
+            since: Only the records with this timestamp or a later one
+            until: Only the records with a timestamp before this one
+
+        Returns:
+            The records of the page and the total number of matching records
+        """
+        offset = (page - 1) * per_page
+        unfiltered = filename is None and since is None and until is None
+        if unfiltered:
+            with self.lock:
+                cached = offset + per_page <= len(self.recent_records)
+                records = list(self.recent_records)[offset:offset + per_page]
+            if cached:
+                return records, self.count()
+
+        conditions = []
+        parameters = []
+        if filename is not None:
+            conditions.append("filename = ?")
+            parameters.append(filename)
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(iso_timestamp(since))
+        if until is not None:
+            conditions.append("timestamp < ?")
+            parameters.append(iso_timestamp(until))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        # Within a range of timestamps, the timestamp index orders the page
+        order = "timestamp DESC, id DESC" if since is not None or until is not None else "id DESC"
+        with self._connect() as connection:
+            rows = connection.execute(f"SELECT {', '.join(RECORD_COLUMNS)} FROM transcripts{where}"
+                                      f" ORDER BY {order} LIMIT ? OFFSET ?",
+                                      parameters + [per_page, offset]).fetchall()
+            total = connection.execute(f"SELECT COUNT(*) FROM transcripts{where}", parameters).fetchone()[0]
+        return [self._to_record(row) for row in rows], total
+
+    def count(self):
+        """
+        The number of stored records.
+        """
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
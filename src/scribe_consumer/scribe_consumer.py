@@ -24,9 +24,12 @@ def on_message(client, userdata, msg):
         payload = json.loads(msg.payload.decode("utf-8"))
         print(f"Received message: {payload}")
 
-        # Example: forward this transcript to the Flask front_end’s new endpoint
+        # Forward this transcript to the front_end, which queues it and answers with a job id at once
         resp = requests.post(FRONTEND_URL, json=payload, timeout=5)
-        print(f"POSTed transcript to front_end. Status code: {resp.status_code}")
+        if resp.status_code == 202:
+            print(f"Queued transcript on front_end as job {resp.json().get('job_id')}")
+        else:
+            print(f"POSTed transcript to front_end. Status code: {resp.status_code}")
 
     except Exception as e:
         print(f"Error handling message: {e}")
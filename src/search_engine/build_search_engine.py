@@ -15,8 +15,9 @@ from document_preprocessor import Tokenizer
 from indexing import InvertedIndex
 from misc_tools import MiscTools
 from network_features import NetworkFeatures
-from document_preprocessor import RegexTokenizer
+from document_preprocessor import RegexTokenizer, TokenNormalizer
 from indexing import Indexer, IndexType
+from postings_codecs import PostingsCodec
 from ranker import Ranker, BM25, TF_IDF, WordCountCosineSimilarity, DirichletLM, PivotedNormalization
 from l2r import L2RFeatureExtractor, L2RRanker, MiscFunctionsL2R
 
@@ -243,8 +244,22 @@ with open('/app/stopwords.txt', 'r', encoding='utf-8') as f:
     stop_words = f.read().splitlines()
 stop_words = set(stop_words)
 
-# Initialize the tokenizer
-tokenizer = RegexTokenizer(stopwords=stop_words)
+# Tokens are not normalized unless a stemmer (SEARCH_STEMMER=porter, snowball or wordnet) or a synonyms file
+# (SEARCH_SYNONYMS_FILE, e.g. /app/search_engine/data/medical_synonyms.txt) is given.
+# The indexes record the normalizer, and the front end normalizes queries the same way.
+stemmer = os.environ.get('SEARCH_STEMMER') or None
+synonyms_path = os.environ.get('SEARCH_SYNONYMS_FILE') or None
+normalizer = None
+if stemmer is not None or synonyms_path is not None:
+    normalizer = TokenNormalizer(
+        stemmer=stemmer,
+        synonyms=TokenNormalizer.load_synonyms(synonyms_path) if synonyms_path is not None else None
+    )
+
+# Initialize the tokenizer; SEARCH_TOKENIZER=fast opts into the fast mode. The indexes record the mode,
+# and the front end tokenizes queries the same way
+tokenizer = RegexTokenizer(stopwords=stop_words, fast=os.environ.get('SEARCH_TOKENIZER') == 'fast',
+                           normalizer=normalizer)
 
 # Paths to the index directories
 index_directory = '/app/icd_10_index_dir'
@@ -253,24 +268,27 @@ title_index_directory = '/app/icd_10_title_index_dir'
 # Path to the dataset
 dataset_path = '/app/icd_10_search_eng_data/output.jsonl'
 
-index = Indexer.create_index(
+# The postings are compressed with SEARCH_POSTINGS_CODEC (pfor by default; raw, varbyte or elias_fano),
+# in memory while the indexes are built and in the saved indexes
+postings_codec = PostingsCodec(os.environ.get('SEARCH_POSTINGS_CODEC') or PostingsCodec.PFOR.value)
+
+# Build the main and title indexes in one pass over the dataset, tokenizing in parallel
+indexes = Indexer.create_indexes(
     index_type=IndexType.BASIC,
     dataset_path=dataset_path,
     tokenizer=tokenizer,
-    text_keys=['text'],
-    id_key='docid'
+    fields={'text': ['text'], 'title': ['title']},  # Indexing the 'text' and 'title' fields
+    id_key='docid',
+    num_workers=os.cpu_count() or 1,
+    postings_codec=postings_codec
 )
+index = indexes['text']
+title_index = indexes['title']
+
 # Save the newly created index
 index.save(index_directory)
 print("New main index created and saved.")
 
-title_index = Indexer.create_index(
-    index_type=IndexType.BASIC,
-    dataset_path=dataset_path,
-    tokenizer=tokenizer,
-    text_keys=['title'],  # Indexing the 'title' field
-    id_key='docid'
-)
 # Save the newly created title index
 title_index.save(title_index_directory)
 print("New title index created and saved.")
@@ -323,9 +341,13 @@ with open(training_data_path, 'r', encoding='utf-8') as csvfile:
             query_to_document_relevance_scores[query] = []
         query_to_document_relevance_scores[query].append((docid, relevance))
 
-# Train the model
+# Train the model, featurizing the queries in parallel and caching the featurized training set,
+# so that rebuilding with unchanged indexes and training data skips featurization
+training_workers = int(os.environ.get('L2R_TRAINING_WORKERS', os.cpu_count() or 1))
+training_cache_directory = os.environ.get('L2R_TRAINING_CACHE_DIR', '/app/icd_10_search_eng_data/l2r_training_cache')
 print("Training the L2R model...")
-l2r_ranker.train(query_to_document_relevance_scores)
+l2r_ranker.train(query_to_document_relevance_scores, num_workers=training_workers,
+                 cache_directory=training_cache_directory)
 print("Model trained successfully.")
 
 # Save the trained model
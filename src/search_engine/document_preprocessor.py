@@ -1,17 +1,297 @@
+import json
+import re
 import string
-import nltk
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+import numpy as np
+
+# Flags nltk's RegexpTokenizer compiles its pattern with
+TOKEN_REGEX_FLAGS = re.UNICODE | re.MULTILINE | re.DOTALL
+
+# Number of distinct tokens whose normalization a TokenNormalizer keeps cached
+DEFAULT_NORMALIZER_CACHE_SIZE = 100_000
+
+class Vocabulary:
+    """
+    Shared mapping between terms and dense int term ids, e.g. the term dictionary of an index
+    """
+    # Term id of the tokens that are not in the vocabulary
+    UNKNOWN_TERM_ID = -1
+
+    def __init__(self, terms: list[str] = None) -> None:
+        """
+        Make vocabulary, with the given terms at term ids 0, 1, ...
+        """
+        self.terms = list(terms) if terms is not None else []  # term id -> term
+        self.term_ids = {term: term_id for term_id, term in enumerate(self.terms)}  # term -> term id
+
+    def add(self, term: str) -> int:
+        """
+        DESC: get the term id of a term, assigning the next free one if it is new
+
+        PARAM: term: the term
+
+        RETURN: the term id
+        """
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+        return term_id
+
+    def add_many(self, tokens: list[str]) -> np.ndarray:
+        """
+        DESC: get the term ids of tokens, assigning the next free ones to new terms in order of first occurrence
+
+        PARAM: tokens: list of tokens
+
+        RETURN: array of term ids, one per token
+        """
+        term_ids = self.term_ids
+        number_of_terms = len(self.terms)
+        token_ids = [term_ids.setdefault(token, len(term_ids)) for token in tokens]
+        if len(term_ids) > number_of_terms:
+            self.terms.extend(dict.fromkeys(
+                token for token, term_id in zip(tokens, token_ids) if term_id >= number_of_terms))
+        return np.array(token_ids, dtype=np.int64)
+
+    def lookup(self, tokens: list[str]) -> np.ndarray:
+        """
+        DESC: get the term ids of tokens without adding new terms
+
+        PARAM: tokens: list of tokens
+
+        RETURN: array of term ids, one per token (UNKNOWN_TERM_ID for tokens that are not in the vocabulary)
+        """
+        get = self.term_ids.get
+        return np.array([get(token, self.UNKNOWN_TERM_ID) for token in tokens], dtype=np.int64)
+
+    def get(self, term: str, default=None):
+        """
+        DESC: get the term id of a term
+
+        PARAM: term: the term
+               default: value to return if the term is not in the vocabulary
+
+        RETURN: the term id, or default
+        """
+        return self.term_ids.get(term, default)
+
+    def __contains__(self, term) -> bool:
+        return term in self.term_ids
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def save(self, file_path: str) -> None:
+        """
+        DESC: save the vocabulary as a JSON list of terms in term id order
+
+        PARAM: file_path: path of the JSON file
+        """
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.terms, f)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'Vocabulary':
+        """
+        DESC: load a vocabulary saved with save
+
+        PARAM: file_path: path of the JSON file
+
+        RETURN: the vocabulary
+        """
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+
+class TokenNormalizer:
+    """
+    Optional normalization stage of a tokenizer: maps synonyms and abbreviations (e.g. "vommitting", "emesis")
+    to a canonical term (e.g. "vomiting"), then stems or lemmatizes it. Results are memoized in a bounded
+    LRU cache keyed by the raw token, so repeated tokens cost a dictionary lookup.
+    """
+    STEMMERS = ('porter', 'snowball', 'wordnet')
+
+    def __init__(self, stemmer: str = None, synonyms: dict[str, str] = None,
+                 cache_size: int = DEFAULT_NORMALIZER_CACHE_SIZE) -> None:
+        """
+        Make normalizer
+
+        PARAM: stemmer: 'porter' or 'snowball' (nltk stemmers), 'wordnet' (nltk lemmatizer, needs the wordnet
+                        corpus), or None to only map synonyms
+               synonyms: map of variant tokens to their canonical term, which may be several words
+                         (see load_synonyms)
+               cache_size: number of distinct tokens to keep cached
+        """
+        if stemmer is not None and stemmer not in self.STEMMERS:
+            raise ValueError(f"Unsupported stemmer: {stemmer}")
+        self.stemmer = stemmer
+        self.synonyms = dict(synonyms) if synonyms else {}
+        self.cache_size = cache_size
+        self._build()
+
+    def _build(self):
+        """
+        DESC: build the stemmer and an empty cache
+        """
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.stem = None
+        if self.stemmer is not None:
+            # nltk is only used on cache misses
+            import nltk
+            if self.stemmer == 'porter':
+                self.stem = nltk.stem.PorterStemmer().stem
+            elif self.stemmer == 'snowball':
+                self.stem = nltk.stem.SnowballStemmer('english').stem
+            else:
+                self.stem = nltk.stem.WordNetLemmatizer().lemmatize
+                self.stem('test')  # raises LookupError now if the wordnet corpus is missing
+
+    def __getstate__(self):
+        """
+        DESC: pickle the normalizer without its cache, lock and stemmer
+
+        RETURN: the normalizer state
+        """
+        return {'stemmer': self.stemmer, 'synonyms': self.synonyms, 'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        """
+        DESC: restore a pickled normalizer
+
+        PARAM: state: the normalizer state
+        """
+        self.__dict__.update(state)
+        self._build()
+
+    @staticmethod
+    def load_synonyms(file_path: str) -> dict[str, str]:
+        """
+        DESC: load a synonym/abbreviation file: one group per line, comma separated, canonical term first,
+              e.g. "vomiting, vommitting, emesis". Lines starting with # are comments. Variants must be
+              single tokens; the canonical term may be several words (e.g. "uti" -> "urinary tract infection").
+
+        PARAM: file_path: path of the file
+
+        RETURN: map of variant tokens to their canonical term
+        """
+        synonyms = {}
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line_num, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                canonical, *variants = [entry.strip().lower() for entry in line.split(',') if entry.strip()]
+                for variant in variants:
+                    if len(variant.split()) != 1:
+                        print(f"Skipping multi-word variant '{variant}' on line {line_num} of {file_path}.")
+                        continue
+                    synonyms[variant] = canonical
+        return synonyms
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'TokenNormalizer':
+        """
+        DESC: make a normalizer from the configuration of another one, e.g. the one recorded with an index
+
+        PARAM: config: the configuration returned by get_config, or None
+
+        RETURN: the normalizer, or None if config is None
+        """
+        if config is None:
+            return None
+        return cls(stemmer=config.get('stemmer'), synonyms=config.get('synonyms'))
+
+    def get_config(self) -> dict:
+        """
+        DESC: get the configuration that determines the normalized tokens (everything but the cache size)
+
+        RETURN: the configuration, as a JSON-serializable dictionary
+        """
+        return {'stemmer': self.stemmer, 'synonyms': self.synonyms}
+
+    def normalize(self, token: str) -> tuple[str, ...]:
+        """
+        DESC: normalize a token without the cache
+
+        PARAM: token: the token
+
+        RETURN: the normalized tokens (several if the token is an abbreviation of a multi-word term)
+        """
+        canonical = self.synonyms.get(token)
+        forms = canonical.split() if canonical is not None else [token]
+        if self.stem is not None:
+            forms = [self.stem(form) for form in forms]
+        return tuple(forms)
+
+    def normalize_tokens(self, tokens: list[str]) -> list[str]:
+        """
+        DESC: normalize tokens through the LRU cache
+
+        PARAM: tokens: list of tokens
+
+        RETURN: list of normalized tokens
+        """
+        normalized = []
+        cache = self.cache
+        cache_get = cache.get
+        move_to_end = cache.move_to_end
+        acquire = self.lock.acquire
+        release = self.lock.release
+        for token in tokens:
+            # Hold the lock per lookup or insert only, so that threads normalizing concurrently interleave;
+            # a miss is normalized outside it (two threads may both normalize the same new token).
+            # Neither the lookup nor moving the key it found can raise, hence no with block (it costs
+            # more than the lookup)
+            acquire()
+            forms = cache_get(token)
+            if forms is not None:
+                move_to_end(token)
+            release()
+            if forms is None:
+                forms = self.normalize(token)
+                with self.lock:
+                    cache[token] = forms
+                    if len(cache) > self.cache_size:
+                        cache.popitem(last=False)
+            normalized.extend(forms)
+        return normalized
+
 
 class Tokenizer:
     """
     Base tokenizer class
     """
 
-    def __init__(self, lowercase: bool = True, stopwords: set[str] = None) -> None:
+    def __init__(self, lowercase: bool = True, stopwords: set[str] = None,
+                 normalizer: TokenNormalizer = None) -> None:
         """
         Make tokenizer
+
+        The optional normalizer is applied to the tokens last, after stopword removal.
         """
         self.lowercase = lowercase
         self.stopwords = stopwords if stopwords is not None else set()
+        self.normalizer = normalizer
+
+    @property
+    def normalizer_config(self) -> dict:
+        """
+        The configuration of the normalizer (see TokenNormalizer.get_config), or None without one.
+        Indexes record it, so that queries can be normalized the same way.
+        """
+        return self.normalizer.get_config() if self.normalizer is not None else None
+
+    @property
+    def tokenizer_config(self) -> dict:
+        """
+        The settings that determine the tokens besides the stopwords and the normalizer, e.g. the mode.
+        Indexes record them, so that queries can be tokenized the same way.
+        """
+        return {'tokenizer': type(self).__name__, 'lowercase': self.lowercase}
 
     def process_token(self, token):
         """
@@ -26,18 +306,123 @@ class Tokenizer:
             token = token.lower()
         return token
 
+    def tokenize(self, text: str) -> list[str]:
+        """
+        DESC: tokenize the text
+
+        PARAM: text: text
+
+        RETURN: tokens
+        """
+        raise NotImplementedError
+
+    def tokenize_many(self, texts: Iterable[str]) -> list[list[str]]:
+        """
+        DESC: tokenize a batch of texts, e.g. the documents of a chunk during ingestion
+
+        PARAM: texts: texts
+
+        RETURN: the tokens of each text
+        """
+        return [self.tokenize(text) for text in texts]
+
+    def tokenize_ids(self, text: str, vocabulary: Vocabulary, add: bool = False) -> np.ndarray:
+        """
+        DESC: tokenize the text into term ids
+
+        PARAM: text: text
+               vocabulary: vocabulary mapping the tokens to term ids, e.g. an index's vocabulary
+               add: whether to add new terms to the vocabulary (when indexing) instead of mapping
+                    them to Vocabulary.UNKNOWN_TERM_ID (when querying)
+
+        RETURN: array of term ids, one per token
+        """
+        tokens = self.tokenize(text)
+        return vocabulary.add_many(tokens) if add else vocabulary.lookup(tokens)
+
 
 class RegexTokenizer(Tokenizer):
     """
     tokenizer that uses a regular expression for tokenization
     """
 
-    def __init__(self, token_regex: str = r'\w+', lowercase: bool = True, stopwords: set[str] = None):
+    def __init__(self, token_regex: str = r'\w+', lowercase: bool = True, stopwords: set[str] = None,
+                 fast: bool = False, normalizer: TokenNormalizer = None):
         """
         Make tokenizer with a regular expression
+
+        In fast mode, the text is lowercased once and split with a precompiled pattern, and stopwords are
+        removed after normalization (so capitalized stopwords are removed too). Otherwise, the nltk
+        tokenizer is used and stopwords are removed before normalization, as in earlier indexes.
+        """
+        super().__init__(lowercase, stopwords, normalizer)
+        self.token_regex = token_regex
+        self.fast = fast
+        self._build_tokenizer()
+
+    @classmethod
+    def from_config(cls, config: dict, stopwords: set[str] = None,
+                    normalizer: TokenNormalizer = None) -> 'RegexTokenizer':
+        """
+        DESC: make a tokenizer with the settings of another one, e.g. the ones recorded with an index
+
+        PARAM: config: the settings returned by tokenizer_config, or None for indexes built before they were
+                       recorded (which were tokenized with the nltk tokenizer)
+               stopwords: set of stopwords
+               normalizer: the normalizer, e.g. TokenNormalizer.from_config(index.normalizer_config)
+
+        RETURN: the tokenizer
+        """
+        if config is None:
+            return cls(stopwords=stopwords, normalizer=normalizer)
+        if config['tokenizer'] != cls.__name__:
+            raise ValueError(f"Settings of a {config['tokenizer']}, not of a {cls.__name__}")
+        return cls(token_regex=config['token_regex'], lowercase=config['lowercase'], stopwords=stopwords,
+                   fast=config['fast'], normalizer=normalizer)
+
+    @property
+    def tokenizer_config(self) -> dict:
+        """
+        The settings that determine the tokens besides the stopwords and the normalizer: the pattern,
+        lowercasing and whether the fast mode is used (see Tokenizer.tokenizer_config).
+        """
+        return dict(super().tokenizer_config, token_regex=self.token_regex, fast=self.fast)
+
+    def _build_tokenizer(self):
+        """
+        DESC: compile the pattern (fast mode) or build the nltk tokenizer
+        """
+        if self.fast:
+            self.pattern = re.compile(self.token_regex, TOKEN_REGEX_FLAGS)
+            self.normalized_stopwords = frozenset(
+                self.process_token(stopword) for stopword in self.stopwords)
+            self.tokenizer = None
+        else:
+            import nltk
+            self.tokenizer = nltk.tokenize.RegexpTokenizer(self.token_regex)
+
+    def __getstate__(self):
+        """
+        DESC: pickle the tokenizer without the nltk tokenizer (e.g. to send it to worker processes),
+              since its compiled pattern does not survive pickling
+
+        RETURN: the tokenizer state
+        """
+        state = self.__dict__.copy()
+        for attribute in ('tokenizer', 'pattern', 'normalized_stopwords'):
+            state.pop(attribute, None)
+        return state
+
+    def __setstate__(self, state):
+        """
+        DESC: restore a pickled tokenizer, rebuilding the nltk tokenizer or the pattern
+
+        PARAM: state: the tokenizer state
         """
-        super().__init__(lowercase, stopwords)
-        self.tokenizer = nltk.tokenize.RegexpTokenizer(token_regex)
+        state.setdefault('fast', False)
+        state.setdefault('normalizer', None)
+        self.__dict__.update(state)
+        self._build_tokenizer()
 
     def remove_stopwords(self, tokens: list[str], stopwords: set[str]) -> list[str]:
         """
@@ -58,8 +443,44 @@ class RegexTokenizer(Tokenizer):
 
         RETURN: tokens
         """
+        if self.fast:
+            return self._tokenize_fast(text, string.punctuation, self.normalized_stopwords)
         tokens = self.tokenizer.tokenize(text)
         tokens = [token for token in tokens if token not in self.stopwords]
-        return [self.process_token(token) for token in tokens]
+        tokens = [self.process_token(token) for token in tokens]
+        if self.normalizer is not None:
+            tokens = self.normalizer.normalize_tokens(tokens)
+        return tokens
+
+    def tokenize_many(self, texts: Iterable[str]) -> list[list[str]]:
+        """
+        DESC: tokenize a batch of texts, e.g. the documents of a chunk during ingestion
+
+        PARAM: texts: texts
+
+        RETURN: the tokens of each text
+        """
+        if not self.fast:
+            return super().tokenize_many(texts)
+        punctuation, stopwords = string.punctuation, self.normalized_stopwords
+        return [self._tokenize_fast(text, punctuation, stopwords) for text in texts]
+
+    def _tokenize_fast(self, text: str, punctuation: str, stopwords: frozenset[str]) -> list[str]:
+        """
+        DESC: tokenize the text in fast mode, dropping tokens that are empty after stripping punctuation
+
+        PARAM: text: text
+               punctuation: characters to strip from the tokens
+               stopwords: normalized stopwords
+
+        RETURN: tokens
+        """
+        if self.lowercase:
+            text = text.lower()
+        tokens = (token.strip(punctuation) for token in self.pattern.findall(text))
+        tokens = [token for token in tokens if token and token not in stopwords]
+        if self.normalizer is not None:
+            tokens = self.normalizer.normalize_tokens(tokens)
+        return tokens
     
 
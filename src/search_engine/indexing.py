@@ -1,11 +1,25 @@
 # indexing.py
 
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-from collections import Counter, defaultdict
+from collections import Counter, deque
+from collections.abc import Mapping
+from itertools import count, groupby
+import fcntl
+import hashlib
+import heapq
 import json
+import math
+import mmap
 import os
+import shutil
 import string
-from document_preprocessor import Tokenizer
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from document_preprocessor import Tokenizer, Vocabulary
+from postings_codecs import BLOCK_SIZE, PostingsCodec, decode_postings, encode_block, encode_postings
 import chardet
 
 
@@ -16,183 +30,2636 @@ class IndexType(Enum):
     BASIC = 'BasicInvertedIndex'
 
 
+class IndexFormat(Enum):
+    """
+    On-disk index format
+    """
+    JSON = 'json'
+    BINARY = 'binary'
+
+
+# Version of the binary on-disk layout written by InvertedIndex.save_binary
+# (version 2 added the per-term score upper bound statistics, version 3 the collection statistics,
+# version 4 the compressed postings codecs, version 5 the per-block score upper bound statistics)
+BINARY_FORMAT_VERSION = 5
+BINARY_META_FILE = 'index_meta.json'
+# The index's vocabulary (see Vocabulary.save), saved with both formats
+VOCABULARY_FILE = 'terms.json'
+# The configuration of the token normalizer the index was built with (see Tokenizer.normalizer_config),
+# saved with both formats
+NORMALIZER_FILE = 'normalizer.json'
+# The settings of the tokenizer the index was built with, e.g. its mode (see Tokenizer.tokenizer_config),
+# saved with both formats
+TOKENIZER_FILE = 'tokenizer.json'
+# Shortest document length of a term that has no postings yet
+NO_DOC_LENGTH = 0xFFFFFFFF
+
+# Files of a SegmentedIndex, relative to its index directory
+SEGMENTS_DIRECTORY = 'segments'
+GENERATIONS_DIRECTORY = 'generations'
+CURRENT_GENERATION_FILE = 'CURRENT'
+
+
+# Default memory budget of Indexer.create_indexes, and the assumed size of a partial index
+# relative to the raw text it was built from (used to size the chunks sent to workers)
+DEFAULT_MEMORY_BUDGET_MB = 512
+PARTIAL_INDEX_SIZE_FACTOR = 4
+
+# Estimated memory of an in-memory InvertedIndex per posting (postings and forward index columns)
+# and per term, used by SpimiIndexWriter to flush segments within its memory budget. Postings compressed
+# in blocks (see BlockPostingsList) take about 2 bytes instead of 8
+BYTES_PER_POSTING = 16
+BYTES_PER_COMPRESSED_POSTING = 10
+BYTES_PER_TERM = 200
+
+_ARRAY_DTYPES = {'I': np.uint32, 'Q': np.uint64}
+
+# Source of InvertedIndex.version numbers, unique within the process
+_INDEX_VERSIONS = count()
+
+
+def _to_array(values, typecode: str = 'I') -> array:
+    """
+    DESC: copy a sequence of non-negative integers into a growable array column
+
+    PARAM: values: list, array or NumPy array of integers
+           typecode: 'I' for 32-bit values, 'Q' for 64-bit offsets
+
+    RETURN: the array column
+    """
+    return array(typecode, np.ascontiguousarray(values, dtype=_ARRAY_DTYPES[typecode]).tobytes())
+
+
+def _as_numpy(column) -> np.ndarray:
+    """
+    DESC: get an index column as a NumPy array. Memory-mapped columns are returned as they are;
+          array('I') columns are copied, since they may still grow while the index is built
+
+    PARAM: column: array('I') or NumPy column
+
+    RETURN: the NumPy array
+    """
+    if isinstance(column, np.ndarray):
+        return column
+    return np.array(column, dtype=np.uint32)
+
+
+class PostingsList:
+    """
+    Lightweight view of the postings of one term, stored as two paired columns:
+    the int doc ids (sorted) and the term frequencies. Columns are array('I') while the
+    index is built in memory and NumPy arrays when it is memory-mapped.
+    """
+    __slots__ = ('doc_ids', 'tfs', 'external_ids')
+
+    def __init__(self, doc_ids, tfs, external_ids: list) -> None:
+        """
+        Args:
+            doc_ids: Column of int doc ids.
+            tfs: Column of term frequencies, aligned with doc_ids.
+            external_ids: The index's list mapping int doc ids to external doc ids.
+        """
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.external_ids = external_ids
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        """
+        Iterate over (int doc id, tf) pairs.
+        """
+        return zip(self.doc_ids.tolist(), self.tfs.tolist())
+
+    def arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get the doc id and tf columns as NumPy arrays, for vectorised scoring.
+        """
+        return _as_numpy(self.doc_ids), _as_numpy(self.tfs)
+
+    def append(self, doc_id: int, tf: int) -> None:
+        """
+        Append a posting. Only valid for in-memory (array('I') backed) postings.
+        """
+        self.doc_ids.append(doc_id)
+        self.tfs.append(tf)
+
+    def extend(self, doc_ids: np.ndarray, tfs: np.ndarray) -> None:
+        """
+        Append postings with larger int doc ids. Only valid for in-memory postings.
+        """
+        self.doc_ids.extend(np.asarray(doc_ids).tolist())
+        self.tfs.extend(np.asarray(tfs).tolist())
+
+    def lookup(self, doc_ids: np.ndarray) -> np.ndarray:
+        """
+        Look up the term frequencies of some documents, e.g. the candidates of a query.
+
+        Args:
+            doc_ids: Increasing int doc ids.
+
+        Returns:
+            NumPy array of their term frequencies, 0 for the documents without the term.
+        """
+        postings_doc_ids, tfs = self.arrays()
+        return _lookup_tfs(postings_doc_ids, tfs, doc_ids)
+
+    def block_bounds(self, doc_ids: np.ndarray):
+        """
+        Get, for each of some documents, the largest tf and the shortest document length of the block of
+        postings that can hold it, to bound the term's score contribution to it more tightly than the
+        term's own statistics do. Only compressed postings have blocks (see BlockPostingsList).
+
+        Args:
+            doc_ids: Increasing int doc ids.
+
+        Returns:
+            NumPy arrays of the largest tfs (0 for documents that no block can hold) and the shortest
+            document lengths, or None if the postings have no per-block statistics.
+        """
+        return None
+
+    def as_dicts(self) -> list[dict]:
+        """
+        Compatibility accessor: the postings as dictionaries with keys 'doc_id' (external) and 'tf'.
+        """
+        return [{'doc_id': self.external_ids[doc_id], 'tf': tf} for doc_id, tf in self]
+
+
+class BlockPostingsList(PostingsList):
+    """
+    Postings of a term compressed with a PostingsCodec in blocks of BLOCK_SIZE postings, which are only decoded
+    when they are read. Each block can be decoded on its own from its skip pointer, so lookups only decode
+    the blocks that can hold the documents they look for.
+
+    While an index is built in memory, a block is encoded as soon as it is full: only the postings of the last,
+    partial block are kept uncompressed, in the array('I') columns. A memory-mapped index has all of its
+    blocks encoded, and its lists are views of the index's arrays.
+    """
+    __slots__ = ('codec', 'buffer', 'block_offsets', 'block_last_doc_ids', 'block_postings',
+                 'block_max_tfs', 'block_min_doc_lengths')
+
+    def __init__(self, codec: PostingsCodec, external_ids: list, buffer=None, block_offsets=None,
+                 block_last_doc_ids=None, block_postings: int = 0, block_max_tfs=None,
+                 block_min_doc_lengths=None) -> None:
+        """
+        Args:
+            codec: The codec of the blocks (not RAW).
+            external_ids: The index's list mapping int doc ids to external doc ids.
+            buffer: The encoded blocks, or None for an empty in-memory list (blocks are appended to a bytearray).
+            block_offsets: Start of each block in the buffer, and end of the last one.
+            block_last_doc_ids: The last int doc id of each block (its skip pointer).
+            block_postings: The number of postings in the blocks.
+            block_max_tfs: The largest tf of each block, if recorded.
+            block_min_doc_lengths: The shortest document length of each block, if recorded.
+        """
+        super().__init__(array('I'), array('I'), external_ids)
+        self.codec = codec
+        self.buffer = buffer
+        self.block_offsets = block_offsets
+        self.block_last_doc_ids = block_last_doc_ids
+        self.block_postings = block_postings
+        self.block_max_tfs = block_max_tfs
+        self.block_min_doc_lengths = block_min_doc_lengths
+
+    def __len__(self) -> int:
+        return self.block_postings + len(self.doc_ids)
+
+    def __iter__(self):
+        doc_ids, tfs = self.arrays()
+        return zip(doc_ids.tolist(), tfs.tolist())
+
+    @property
+    def number_of_blocks(self) -> int:
+        """
+        The number of encoded blocks.
+        """
+        return 0 if self.block_last_doc_ids is None else len(self.block_last_doc_ids)
+
+    def arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        doc_ids, tfs = self._decode_blocks(0, self.number_of_blocks)
+        if len(self.doc_ids) == 0:
+            return doc_ids, tfs
+        return np.concatenate((doc_ids, _as_numpy(self.doc_ids))), np.concatenate((tfs, _as_numpy(self.tfs)))
+
+    def append(self, doc_id: int, tf: int) -> None:
+        super().append(doc_id, tf)
+        if len(self.doc_ids) == BLOCK_SIZE:
+            self._encode_full_blocks()
+
+    def extend(self, doc_ids: np.ndarray, tfs: np.ndarray) -> None:
+        super().extend(doc_ids, tfs)
+        self._encode_full_blocks()
+
+    def lookup(self, doc_ids: np.ndarray) -> np.ndarray:
+        """
+        Look up the term frequencies of some documents (see PostingsList.lookup), decoding only the blocks
+        that can hold them: the block of a document is the first one whose skip pointer is not smaller.
+        """
+        doc_ids = np.asarray(doc_ids)
+        blocks = np.zeros(len(doc_ids), dtype=np.int64)
+        if self.number_of_blocks > 0:
+            blocks = np.searchsorted(np.asarray(self.block_last_doc_ids), doc_ids)
+        needed = np.unique(blocks[blocks < self.number_of_blocks])
+        # Runs of consecutive blocks are decoded together
+        runs = np.split(needed, np.flatnonzero(np.diff(needed) != 1) + 1) if len(needed) else []
+        doc_id_parts, tf_parts = [], []
+        for run in runs:
+            run_doc_ids, run_tfs = self._decode_blocks(int(run[0]), int(run[-1]) + 1)
+            doc_id_parts.append(run_doc_ids)
+            tf_parts.append(run_tfs)
+        # Documents past the last block can only be in the uncompressed postings
+        if len(self.doc_ids) > 0 and len(doc_ids) > 0 and blocks[-1] == self.number_of_blocks:
+            doc_id_parts.append(_as_numpy(self.doc_ids))
+            tf_parts.append(_as_numpy(self.tfs))
+        if not doc_id_parts:
+            return np.zeros(len(doc_ids), dtype=np.uint32)
+        return _lookup_tfs(np.concatenate(doc_id_parts), np.concatenate(tf_parts), doc_ids)
+
+    def block_bounds(self, doc_ids: np.ndarray):
+        # The statistics are saved with binary indexes, whose lists have no uncompressed postings
+        if self.block_max_tfs is None or len(self.doc_ids) > 0:
+            return None
+        doc_ids = np.asarray(doc_ids)
+        max_tfs = np.zeros(len(doc_ids), dtype=np.uint32)
+        min_doc_lengths = np.zeros(len(doc_ids), dtype=np.uint32)
+        if self.number_of_blocks > 0:
+            blocks = np.searchsorted(np.asarray(self.block_last_doc_ids), doc_ids)
+            in_blocks = blocks < self.number_of_blocks
+            max_tfs[in_blocks] = np.asarray(self.block_max_tfs)[blocks[in_blocks]]
+            min_doc_lengths[in_blocks] = np.asarray(self.block_min_doc_lengths)[blocks[in_blocks]]
+        return max_tfs, min_doc_lengths
+
+    def _decode_blocks(self, first_block: int, end_block: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Decode the consecutive blocks from first_block up to end_block (excluded).
+        """
+        if first_block >= end_block:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+        count = min(self.block_postings, BLOCK_SIZE * end_block) - BLOCK_SIZE * first_block
+        bases = [int(self.block_last_doc_ids[first_block - 1]) if first_block > 0 else 0] \
+            + np.asarray(self.block_last_doc_ids[first_block:end_block - 1]).tolist()
+        buffer = np.frombuffer(self.buffer, dtype=np.uint8) if isinstance(self.buffer, bytearray) else self.buffer
+        return decode_postings(self.codec, buffer, self.block_offsets[first_block:end_block + 1], bases, count)
+
+    def _encode_full_blocks(self) -> None:
+        """
+        Encode the full blocks of the uncompressed postings, keeping the rest uncompressed.
+        """
+        encoded = len(self.doc_ids) // BLOCK_SIZE * BLOCK_SIZE
+        if encoded == 0:
+            return
+        if self.buffer is None:
+            self.buffer, self.block_offsets, self.block_last_doc_ids = bytearray(), array('Q', [0]), array('I')
+        doc_ids, tfs = _as_numpy(self.doc_ids), _as_numpy(self.tfs)
+        for start in range(0, encoded, BLOCK_SIZE):
+            base = self.block_last_doc_ids[-1] if self.block_last_doc_ids else 0
+            block = encode_block(self.codec, doc_ids[start:start + BLOCK_SIZE], tfs[start:start + BLOCK_SIZE], base)
+            self.buffer.extend(block.tobytes())
+            self.block_offsets.append(len(self.buffer))
+            self.block_last_doc_ids.append(int(doc_ids[start + BLOCK_SIZE - 1]))
+        self.block_postings += encoded
+        self.doc_ids, self.tfs = _to_array(doc_ids[encoded:]), _to_array(tfs[encoded:])
+
+
+def _lookup_tfs(postings_doc_ids: np.ndarray, postings_tfs: np.ndarray, doc_ids: np.ndarray) -> np.ndarray:
+    """
+    DESC: look up the term frequencies of some documents in a term's postings by binary search
+
+    PARAM: postings_doc_ids: the postings' int doc ids, in increasing order
+           postings_tfs: the matching term frequencies
+           doc_ids: the int doc ids to look up, in increasing order
+
+    RETURN: NumPy array of their term frequencies, 0 for the documents without the term
+    """
+    doc_ids = np.asarray(doc_ids)
+    slots = np.searchsorted(postings_doc_ids, doc_ids)
+    found = slots < len(postings_doc_ids)
+    found[found] = postings_doc_ids[slots[found]] == doc_ids[found]
+    tfs = np.zeros(len(doc_ids), dtype=np.uint32)
+    tfs[found] = postings_tfs[slots[found]]
+    return tfs
+
+
+def _save_config(index_directory: str, file_name: str, config: dict) -> None:
+    """
+    Save a configuration recorded with an index, e.g. its normalizer's (null without a normalizer).
+    """
+    with open(os.path.join(index_directory, file_name), 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+
+
+def _load_config(index_directory: str, file_name: str) -> dict:
+    """
+    Load a configuration recorded with an index, or None for indexes saved before it was recorded.
+    """
+    path = os.path.join(index_directory, file_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _load_array(index_directory: str, name: str) -> np.ndarray:
+    """
+    DESC: open a .npy array of a binary index read-only through mmap
+
+    PARAM: index_directory: directory of the index
+           name: name of the array file without the extension
+
+    RETURN: the memory-mapped array
+    """
+    return np.load(os.path.join(index_directory, name + '.npy'), mmap_mode='r')
+
+
+def _save_postings_blocks(index_directory: str, codec: PostingsCodec, term_postings, number_of_terms: int,
+                          doc_lengths: np.ndarray) -> None:
+    """
+    DESC: encode the postings of each term in blocks of BLOCK_SIZE and save the block arrays of a binary
+          index (see InvertedIndex.save_binary). The encoded blocks are streamed to disk as they are encoded
+
+    PARAM: index_directory: directory of the index
+           codec: the codec to encode the blocks with (not RAW)
+           term_postings: iterable of the (int doc ids, tfs) NumPy arrays of each term, in term id order
+           number_of_terms: the number of terms
+           doc_lengths: document lengths indexed by int doc id, for the per-block statistics
+    """
+    term_block_offsets = np.zeros(number_of_terms + 1, dtype=np.int64)
+    block_offsets = array('Q', [0])
+    block_last_doc_ids = array('I')
+    block_max_tfs = array('I')
+    block_min_doc_lengths = array('I')
+    postings_path = os.path.join(index_directory, 'postings.npy')
+    with open(postings_path + '.tmp', 'wb') as f:
+        for term_id, (doc_ids, tfs) in enumerate(term_postings):
+            blocks, block_lengths, last_doc_ids = encode_postings(codec, doc_ids, tfs)
+            for block, block_length in zip(blocks, block_lengths):
+                f.write(block.tobytes())
+                block_offsets.append(block_offsets[-1] + block_length)
+            block_last_doc_ids.extend(last_doc_ids)
+            if len(doc_ids) > 0:
+                block_starts = np.arange(0, len(doc_ids), BLOCK_SIZE)
+                block_max_tfs.extend(np.maximum.reduceat(tfs, block_starts).tolist())
+                block_min_doc_lengths.extend(np.minimum.reduceat(doc_lengths[doc_ids], block_starts).tolist())
+            term_block_offsets[term_id + 1] = term_block_offsets[term_id] + len(blocks)
+
+    # Copy the encoded blocks into a .npy array
+    if block_offsets[-1] == 0:
+        np.save(postings_path, np.zeros(0, dtype=np.uint8))
+    else:
+        postings = np.lib.format.open_memmap(postings_path, mode='w+', dtype=np.uint8, shape=(block_offsets[-1],))
+        with open(postings_path + '.tmp', 'rb') as f:
+            f.readinto(postings)
+        postings.flush()
+        del postings
+    os.remove(postings_path + '.tmp')
+    np.save(os.path.join(index_directory, 'block_offsets.npy'), np.asarray(block_offsets, dtype=np.int64))
+    np.save(os.path.join(index_directory, 'block_last_doc_ids.npy'), np.asarray(block_last_doc_ids, dtype=np.uint32))
+    np.save(os.path.join(index_directory, 'block_max_tf.npy'), np.asarray(block_max_tfs, dtype=np.uint32))
+    np.save(os.path.join(index_directory, 'block_min_doc_length.npy'), np.asarray(block_min_doc_lengths, dtype=np.uint32))
+    np.save(os.path.join(index_directory, 'term_block_offsets.npy'), term_block_offsets)
+
+
+class MetadataStore(Mapping):
+    """
+    Read-only document metadata store backed by a memory-mapped JSON lines file.
+    Each record is only decoded when it is accessed.
+    """
+    def __init__(self, file_path: str, offsets: np.ndarray, internal_ids: dict) -> None:
+        """
+        Open the metadata store.
+
+        Args:
+            file_path: Path to the JSON lines file with one metadata record per document.
+            offsets: Byte offsets of the records (one more entry than there are documents).
+            internal_ids: Mapping of external doc ids to their int doc id (record number).
+        """
+        self.offsets = offsets
+        self.internal_ids = internal_ids
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.buffer = b''
+
+    def __getitem__(self, doc_id):
+        internal_id = self.internal_ids[doc_id]
+        start, end = int(self.offsets[internal_id]), int(self.offsets[internal_id + 1])
+        return json.loads(self.buffer[start:end])
+
+    def __iter__(self):
+        return iter(self.internal_ids)
+
+    def __len__(self):
+        return len(self.internal_ids)
+
+
+class _DocumentArrayMapping(Mapping):
+    """
+    Maps external doc ids to the values of a per-document column indexed by int doc id.
+    """
+    def __init__(self, internal_ids: dict, values: np.ndarray) -> None:
+        self.internal_ids = internal_ids
+        self.values_array = values
+
+    def __getitem__(self, doc_id):
+        return int(self.values_array[self.internal_ids[doc_id]])
+
+    def __iter__(self):
+        return iter(self.internal_ids)
+
+    def __len__(self):
+        return len(self.internal_ids)
+
+
+class _BinaryPostings(Mapping):
+    """
+    Maps terms to postings lists decoded on demand from the delta-encoded postings arrays.
+    """
+    def __init__(self, term_ids: dict, term_offsets: np.ndarray, doc_gaps: np.ndarray,
+                 tfs: np.ndarray, external_ids: list) -> None:
+        self.term_ids = term_ids
+        self.term_offsets = term_offsets
+        self.doc_gaps = doc_gaps
+        self.tfs = tfs
+        self.external_ids = external_ids
+
+    def __getitem__(self, term):
+        term_id = self.term_ids[term]
+        start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+        doc_ids = np.cumsum(self.doc_gaps[start:end], dtype=np.uint32)
+        return PostingsList(doc_ids, self.tfs[start:end], self.external_ids)
+
+    def __iter__(self):
+        return iter(self.term_ids)
+
+    def __len__(self):
+        return len(self.term_ids)
+
+
+class _CompressedPostings(Mapping):
+    """
+    Maps terms to views of their postings in the blocks compressed with a PostingsCodec (see BlockPostingsList).
+    """
+    def __init__(self, term_ids: dict, codec: PostingsCodec, buffer: np.ndarray, term_offsets: np.ndarray,
+                 term_block_offsets: np.ndarray, block_offsets: np.ndarray, block_last_doc_ids: np.ndarray,
+                 external_ids: list, block_max_tfs: np.ndarray = None,
+                 block_min_doc_lengths: np.ndarray = None) -> None:
+        """
+        Args:
+            term_ids: The index's mapping of terms to term ids.
+            codec: The codec the blocks are encoded with.
+            buffer: The encoded blocks of all the terms.
+            term_offsets: Start of each term's postings, counted in postings (num_terms + 1 entries).
+            term_block_offsets: Index of each term's first block (num_terms + 1 entries).
+            block_offsets: Start of each block in the buffer (num_blocks + 1 entries).
+            block_last_doc_ids: The last int doc id of each block (the skip pointers).
+            external_ids: The index's list mapping int doc ids to external doc ids.
+            block_max_tfs: The largest tf of each block (not recorded before version 5).
+            block_min_doc_lengths: The shortest document length of each block (not recorded before version 5).
+        """
+        self.term_ids = term_ids
+        self.codec = codec
+        self.buffer = buffer
+        self.term_offsets = term_offsets
+        self.term_block_offsets = term_block_offsets
+        self.block_offsets = block_offsets
+        self.block_last_doc_ids = block_last_doc_ids
+        self.external_ids = external_ids
+        self.block_max_tfs = block_max_tfs
+        self.block_min_doc_lengths = block_min_doc_lengths
+
+    def __getitem__(self, term):
+        term_id = self.term_ids[term]
+        first_block, end_block = int(self.term_block_offsets[term_id]), int(self.term_block_offsets[term_id + 1])
+        blocks = slice(first_block, end_block)
+        return BlockPostingsList(
+            self.codec, self.external_ids, self.buffer, self.block_offsets[first_block:end_block + 1],
+            self.block_last_doc_ids[blocks], int(self.term_offsets[term_id + 1]) - int(self.term_offsets[term_id]),
+            None if self.block_max_tfs is None else self.block_max_tfs[blocks],
+            None if self.block_min_doc_lengths is None else self.block_min_doc_lengths[blocks])
+
+    def __iter__(self):
+        return iter(self.term_ids)
+
+    def __len__(self):
+        return len(self.term_ids)
+
+
+class DocumentTermCounts(Mapping):
+    """
+    Read-only view of one document's term frequencies: one row of the ForwardIndex.
+    Lookups binary-search the row's sorted term ids, so they cost O(log n) in the document's distinct terms.
+    """
+    __slots__ = ('forward_index', 'start', 'end')
+
+    def __init__(self, forward_index: 'ForwardIndex', start: int, end: int) -> None:
+        self.forward_index = forward_index
+        self.start = start
+        self.end = end
+
+    def get(self, term, default=None):
+        term_id = self.forward_index.term_ids.get(term)
+        if term_id is None:
+            return default
+        return self.get_by_id(term_id, default)
+
+    def get_by_id(self, term_id: int, default=None):
+        """
+        Get the frequency of a term in the document by its term id.
+        """
+        column = self.forward_index.doc_term_ids
+        position = bisect_left(column, term_id, self.start, self.end)
+        if position < self.end and column[position] == term_id:
+            return int(self.forward_index.tfs[position])
+        return default
+
+    def __getitem__(self, term):
+        tf = self.get(term)
+        if tf is None:
+            raise KeyError(term)
+        return tf
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def term_ids(self) -> np.ndarray:
+        """
+        Get the term ids of the document, in increasing order.
+        """
+        return _as_numpy(self.forward_index.doc_term_ids)[self.start:self.end]
+
+    def __iter__(self):
+        terms = self.forward_index.terms
+        return (terms[term_id] for term_id in self.term_ids().tolist())
+
+    def __len__(self):
+        return self.end - self.start
+
+
+class ForwardIndex(Mapping):
+    """
+    Compact forward index: the term ids (sorted) and term frequencies of every document,
+    stored as one CSR matrix with a row per int doc id. Maps external doc ids to DocumentTermCounts rows.
+    """
+    def __init__(self, internal_ids: dict, terms: list, term_ids: dict,
+                 indptr=None, doc_term_ids=None, tfs=None) -> None:
+        """
+        Args:
+            internal_ids: The index's mapping of external doc ids to int doc ids.
+            terms: The index's list mapping term ids to terms.
+            term_ids: The index's mapping of terms to term ids.
+            indptr: Start of each row in the columns (one more entry than there are rows).
+            doc_term_ids: Column of term ids, sorted within each row.
+            tfs: Column of term frequencies, aligned with doc_term_ids.
+        """
+        self.internal_ids = internal_ids
+        self.terms = terms
+        self.term_ids = term_ids
+        self.indptr = indptr if indptr is not None else array('Q', [0])
+        self.doc_term_ids = doc_term_ids if doc_term_ids is not None else array('I')
+        self.tfs = tfs if tfs is not None else array('I')
+
+    def append(self, term_ids: list[int], tfs: list[int]) -> None:
+        """
+        Append the row of the next int doc id. Only valid for in-memory (array backed) forward indexes.
+
+        Args:
+            term_ids: The document's term ids in increasing order.
+            tfs: The matching term frequencies.
+        """
+        self.doc_term_ids.extend(term_ids)
+        self.tfs.extend(tfs)
+        self.indptr.append(len(self.doc_term_ids))
+
+    def row(self, internal_id: int) -> DocumentTermCounts:
+        """
+        Get the term frequencies of a document by its int doc id.
+        """
+        return DocumentTermCounts(self, int(self.indptr[internal_id]), int(self.indptr[internal_id + 1]))
+
+    def document_norms(self) -> np.ndarray:
+        """
+        Compute the L2 norm of every document's term frequency vector, indexed by int doc id.
+        """
+        indptr = _as_numpy(self.indptr).astype(np.int64)
+        tfs = _as_numpy(self.tfs).astype(np.float64)
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        return np.sqrt(np.bincount(rows, weights=tfs ** 2, minlength=len(indptr) - 1))
+
+    def __getitem__(self, doc_id):
+        return self.row(self.internal_ids[doc_id])
+
+    def __iter__(self):
+        return iter(self.internal_ids)
+
+    def __len__(self):
+        return len(self.internal_ids)
+
+
 class InvertedIndex:
     """
     Implement the inverted index.
     """
-    def __init__(self) -> None:
+    def __init__(self, postings_codec: PostingsCodec = PostingsCodec.RAW) -> None:
         """
         Initialize the inverted index.
+
+        Args:
+            postings_codec: The codec of the postings. With a codec other than RAW, the postings are compressed
+                in memory as they are added (see BlockPostingsList), and save_binary writes them with it.
         """
-        # Change defaultdict from set to list to store postings with term frequencies
-        self.index = defaultdict(list)  # Each term maps to a list of postings
-        self.document_lengths = {}
+        self.postings_codec = postings_codec
+        self.index = {}  # Each term maps to a PostingsList
+        # External doc ids (e.g. ICD-10 codes) are interned once to dense int ids
+        self.external_ids = []  # int doc id -> external doc id
+        self.internal_ids = {}  # external doc id -> int doc id
+        # Term dictionary: terms are interned to dense int term ids (see the terms and term_ids properties)
+        self.vocabulary = Vocabulary()
+        # Per-term statistics for score upper bounds (dynamic pruning), indexed by term id:
+        # the largest tf and the shortest document length in the term's postings
+        self.term_max_tfs = array('I')
+        self.term_min_doc_lengths = array('I')
+        # Collection statistics maintained as documents are added, so that scorers never rescan the index:
+        # the document frequency and collection term frequency of each term id, the L2 norm of each
+        # document's term frequency vector (indexed by int doc id) and the total number of tokens
+        self.term_doc_freqs = array('I')
+        self.term_collection_freqs = array('Q')
+        self.document_norms = array('d')
+        self.total_token_count = 0
+        self.document_lengths = _DocumentArrayMapping(self.internal_ids, array('I'))
         self.total_documents = 0
-        self.doc_term_freqs = {}
+        # Forward index: term frequencies of each document, one CSR row per int doc id
+        self.doc_term_freqs = ForwardIndex(self.internal_ids, self.terms, self.term_ids)
         self.document_metadata = {}
+        # Configuration of the token normalizer the documents were tokenized with, if any; queries must be
+        # tokenized the same way (see Tokenizer.normalizer_config)
+        self.normalizer_config = None
+        # Settings of the tokenizer the documents were tokenized with, e.g. its mode, or None if they were
+        # not recorded (see Tokenizer.tokenizer_config)
+        self.tokenizer_config = None
+        # True while the index is backed by read-only memory-mapped files
+        self.is_memory_mapped = False
+        # Changes whenever documents are added or the index is loaded, so that caches of query results
+        # can tell when they are stale (see QueryResultCache)
+        self.version = next(_INDEX_VERSIONS)
+
+    @property
+    def terms(self) -> list:
+        """
+        The terms of the index's vocabulary, indexed by term id.
+        """
+        return self.vocabulary.terms
+
+    @property
+    def term_ids(self) -> dict:
+        """
+        The term ids of the index's vocabulary, keyed by term.
+        """
+        return self.vocabulary.term_ids
 
     def add_document(self, doc_id: str, tokens: list[str], metadata: dict) -> None:
         """
         Add a document to the index with term frequencies.
         """
-        if doc_id in self.document_lengths:
+        self._ensure_writable()
+        if doc_id in self.internal_ids:
+            print(f"Document with doc_id {doc_id} is already indexed.")
+            return
+        self.add_document_ids(doc_id, self.vocabulary.add_many(tokens), metadata)
+
+    def add_document_ids(self, doc_id: str, token_ids: np.ndarray, metadata: dict) -> None:
+        """
+        Add a document given as the term ids of its tokens in the index's vocabulary,
+        e.g. from Tokenizer.tokenize_ids(text, index.vocabulary, add=True).
+        """
+        self._ensure_writable()
+        if doc_id in self.internal_ids:
             print(f"Document with doc_id {doc_id} is already indexed.")
             return
 
-        # Calculate term frequencies in the document
-        term_freqs = Counter(tokens)
-        self.doc_term_freqs[doc_id] = term_freqs  # Store term frequencies for the document
+        # Calculate term frequencies in the document: its distinct term ids, in increasing order
+        doc_term_ids, freqs = np.unique(np.asarray(token_ids, dtype=np.int64), return_counts=True)
+        if len(doc_term_ids) > 0 and (doc_term_ids[0] < 0 or doc_term_ids[-1] >= len(self.vocabulary)):
+            raise ValueError("Token ids must be term ids of the index's vocabulary.")
+        doc_term_ids, freqs = doc_term_ids.tolist(), freqs.tolist()
+        self._extend_term_statistics()
+        internal_id = self._intern_doc_id(doc_id)
 
         # Update the inverted index with term frequencies
-        for term, freq in term_freqs.items():
-            self.index[term].append({'doc_id': doc_id, 'tf': freq})
+        doc_length = len(token_ids)
+        terms = self.terms
+        for term_id, freq in zip(doc_term_ids, freqs):
+            if freq > self.term_max_tfs[term_id]:
+                self.term_max_tfs[term_id] = freq
+            if doc_length < self.term_min_doc_lengths[term_id]:
+                self.term_min_doc_lengths[term_id] = doc_length
+            self.term_doc_freqs[term_id] += 1
+            self.term_collection_freqs[term_id] += freq
+            self.index[terms[term_id]].append(internal_id, freq)
 
-        # Store document length
-        self.document_lengths[doc_id] = len(tokens)
+        # Store the term frequencies as the document's forward index row
+        self.doc_term_freqs.append(doc_term_ids, freqs)
+
+        # Store document length and norm
+        self.document_lengths.values_array.append(doc_length)
+        self.document_norms.append(math.sqrt(sum(freq * freq for freq in freqs)))
+        self.total_token_count += doc_length
         self.total_documents += 1
 
         # Combine length with metadata
         metadata_with_length = metadata.copy()
-        metadata_with_length['length'] = len(tokens)
+        metadata_with_length['length'] = doc_length
         self.document_metadata[doc_id] = metadata_with_length
+        self.version = next(_INDEX_VERSIONS)
 
-    def get_postings(self, term: str) -> list[dict]:
+    def merge(self, other: 'InvertedIndex', excluded_doc_ids: set = frozenset()) -> None:
         """
-        Get the postings list for a term.
-        Each posting is a dictionary with keys 'doc_id' and 'tf'.
+        Append the documents of another index, e.g. a partial index built from a later part of the corpus.
+        They get the next int doc ids in the other index's order; documents that are already indexed are
+        skipped, as in add_document. The result is the same as adding the documents one by one.
+
+        Args:
+            other: The index to append.
+            excluded_doc_ids: Doc ids of the other index to leave out, e.g. deleted documents.
         """
-        return self.index.get(term, [])
+        self._ensure_writable()
+        if self.total_documents == 0 and self.normalizer_config is None:
+            self.normalizer_config = other.normalizer_config
+        if self.total_documents == 0 and self.tokenizer_config is None:
+            self.tokenizer_config = other.tokenizer_config
 
-    def get_statistics(self):
+        # Int doc ids of the other index's documents in this index (-1 for skipped documents)
+        id_map = np.full(len(other.external_ids), -1, dtype=np.int64)
+        for other_id, doc_id in enumerate(other.external_ids):
+            if doc_id in excluded_doc_ids:
+                continue
+            if doc_id in self.internal_ids:
+                print(f"Document with doc_id {doc_id} is already indexed.")
+                continue
+            id_map[other_id] = self._intern_doc_id(doc_id)
+            self.document_metadata[doc_id] = other.document_metadata[doc_id]
+        kept = id_map >= 0
+        all_kept = bool(kept.all())
+        other_lengths = other.get_document_length_array()
+
+        # Append the postings and update the term statistics, mapping the other index's term ids to ours
+        term_map = np.zeros(len(other.terms), dtype=np.int64)
+        for other_term_id, term in enumerate(other.terms):
+            doc_ids, tfs = other.index[term].arrays()
+            if not all_kept:
+                mask = kept[doc_ids]
+                doc_ids, tfs = doc_ids[mask], tfs[mask]
+            if len(doc_ids) == 0:
+                continue
+            max_tf = int(tfs.max())
+            min_doc_length = int(other_lengths[doc_ids].min())
+            term_id = self.vocabulary.add(term)
+            self._extend_term_statistics()
+            self.term_max_tfs[term_id] = max(self.term_max_tfs[term_id], max_tf)
+            self.term_min_doc_lengths[term_id] = min(self.term_min_doc_lengths[term_id], min_doc_length)
+            self.term_doc_freqs[term_id] += len(doc_ids)
+            self.term_collection_freqs[term_id] += int(tfs.sum(dtype=np.uint64))
+            self.index[term].extend(id_map[doc_ids], tfs)
+            term_map[other_term_id] = term_id
+
+        # Append the forward index rows, re-sorted by our term ids
+        forward_index = other.doc_term_freqs
+        indptr = np.asarray(forward_index.indptr, dtype=np.int64)
+        row_lengths = np.diff(indptr)
+        rows = np.repeat(np.arange(len(row_lengths)), row_lengths)
+        entries = kept[rows]
+        rows = rows[entries]
+        term_ids = term_map[_as_numpy(forward_index.doc_term_ids)[entries]]
+        tfs = _as_numpy(forward_index.tfs)[entries]
+        order = np.lexsort((term_ids, rows))
+        row_start = self.doc_term_freqs.indptr[-1]
+        self.doc_term_freqs.doc_term_ids.extend(term_ids[order].tolist())
+        self.doc_term_freqs.tfs.extend(tfs[order].tolist())
+        self.doc_term_freqs.indptr.extend((row_start + np.cumsum(row_lengths[kept])).tolist())
+
+        # Append the document lengths and norms
+        self.document_lengths.values_array.extend(other_lengths[kept].tolist())
+        self.document_norms.extend(other.get_document_norm_array()[kept].tolist())
+        self.total_token_count += int(other_lengths[kept].sum())
+        self.total_documents += int(kept.sum())
+        self.version = next(_INDEX_VERSIONS)
+
+    def _intern_doc_id(self, doc_id: str) -> int:
         """
-        Compute and return collection statistics.
+        Get the int doc id of an external doc id, assigning the next free one if it is new.
         """
-        total_token_count = sum(self.document_lengths.values())
-        mean_document_length = total_token_count / self.total_documents if self.total_documents > 0 else 0
-        return {
-            'total_token_count': total_token_count,
-            'mean_document_length': mean_document_length,
-            'number_of_documents': self.total_documents,
-        }
+        internal_id = self.internal_ids.get(doc_id)
+        if internal_id is None:
+            internal_id = self.internal_ids[doc_id] = len(self.external_ids)
+            self.external_ids.append(doc_id)
+        return internal_id
 
-    def get_term_metadata(self, term: str):
+    def _extend_term_statistics(self) -> None:
         """
-        Get metadata for a term, such as document frequency.
+        Add empty postings and term statistics for the vocabulary's terms that have none yet,
+        e.g. the new terms of a document interned by Tokenizer.tokenize_ids.
         """
-        postings = self.get_postings(term)
-        doc_frequency = len(postings)
-        return {'doc_frequency': doc_frequency}
+        for term in self.terms[len(self.term_doc_freqs):]:
+            self.index[term] = self._new_postings_list()
+            self.term_max_tfs.append(0)
+            self.term_min_doc_lengths.append(NO_DOC_LENGTH)
+            self.term_doc_freqs.append(0)
+            self.term_collection_freqs.append(0)
 
-    def save(self, index_directory: str) -> None:
+    def _new_postings_list(self) -> PostingsList:
         """
-        Save the index to disk.
+        Get an empty in-memory postings list, compressed in blocks unless the postings codec is RAW.
         """
-        os.makedirs(index_directory, exist_ok=True)
+        if self.postings_codec == PostingsCodec.RAW:
+            return PostingsList(array('I'), array('I'), self.external_ids)
+        return BlockPostingsList(self.postings_codec, self.external_ids)
 
-        # Save index
-        with open(os.path.join(index_directory, 'index.json'), 'w', encoding='utf-8') as f:
-            json.dump({term: postings for term, postings in self.index.items()}, f)
-
-        # Save document lengths
-        with open(os.path.join(index_directory, 'doc_lengths.json'), 'w', encoding='utf-8') as f:
-            json.dump(self.document_lengths, f)
+    def _sort_terms(self) -> None:
+        """
+        Renumber the terms so that term ids follow the lexicographic order of the terms,
+        as SpimiIndexWriter segments require for merging.
+        """
+        self._ensure_writable()
+        order = np.array(sorted(range(len(self.terms)), key=self.terms.__getitem__), dtype=np.int64)
+        new_term_ids = np.empty(len(order), dtype=np.int64)
+        new_term_ids[order] = np.arange(len(order))
 
-        # Save doc_term_freqs
-        with open(os.path.join(index_directory, 'doc_term_freqs.json'), 'w', encoding='utf-8') as f:
-            # Convert Counter objects to regular dicts for JSON serialization
-            doc_term_freqs_as_dict = {doc_id: dict(freqs) for doc_id, freqs in self.doc_term_freqs.items()}
-            json.dump(doc_term_freqs_as_dict, f)
+        self.vocabulary = Vocabulary([self.terms[term_id] for term_id in order])
+        self.term_max_tfs = _to_array(_as_numpy(self.term_max_tfs)[order])
+        self.term_min_doc_lengths = _to_array(_as_numpy(self.term_min_doc_lengths)[order])
+        self.term_doc_freqs = _to_array(_as_numpy(self.term_doc_freqs)[order])
+        self.term_collection_freqs = _to_array(np.asarray(self.term_collection_freqs, dtype=np.uint64)[order], 'Q')
 
-        # Save document metadata
-        with open(os.path.join(index_directory, 'document_metadata.json'), 'w', encoding='utf-8') as f:
-            json.dump(self.document_metadata, f)
+        # Map the forward index to the new term ids, keeping each row sorted
+        forward_index = self.doc_term_freqs
+        indptr = np.asarray(forward_index.indptr, dtype=np.int64)
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        term_ids = new_term_ids[_as_numpy(forward_index.doc_term_ids)]
+        order = np.lexsort((term_ids, rows))
+        self.doc_term_freqs = ForwardIndex(self.internal_ids, self.terms, self.term_ids, forward_index.indptr,
+                                           _to_array(term_ids[order]), _to_array(_as_numpy(forward_index.tfs)[order]))
 
-    def load(self, index_directory: str) -> None:
+    def _rebuild_forward_index(self) -> None:
         """
-        Load the index from disk.
+        Rebuild the forward index from the postings, e.g. after loading an index that was saved without it.
         """
-        # Load index
-        with open(os.path.join(index_directory, 'index.json'), 'r', encoding='utf-8') as f:
-            index_data = json.load(f)
-            self.index = defaultdict(list, {term: postings for term, postings in index_data.items()})
+        doc_columns = [np.zeros(0, dtype=np.int64)]
+        term_columns = [np.zeros(0, dtype=np.int64)]
+        tf_columns = [np.zeros(0, dtype=np.uint32)]
+        for term, postings in self.index.items():
+            doc_ids, tfs = postings.arrays()
+            doc_columns.append(doc_ids.astype(np.int64))
+            term_columns.append(np.full(len(doc_ids), self.term_ids[term], dtype=np.int64))
+            tf_columns.append(tfs)
+        doc_column = np.concatenate(doc_columns)
+        term_column = np.concatenate(term_columns)
+        tf_column = np.concatenate(tf_columns)
 
-        # Load document lengths
-        with open(os.path.join(index_directory, 'doc_lengths.json'), 'r', encoding='utf-8') as f:
-            self.document_lengths = json.load(f)
+        order = np.lexsort((term_column, doc_column))
+        row_lengths = np.bincount(doc_column, minlength=len(self.external_ids))
+        indptr = np.concatenate(([0], np.cumsum(row_lengths)))
+        self.doc_term_freqs = ForwardIndex(self.internal_ids, self.terms, self.term_ids,
+                                           _to_array(indptr, 'Q'), _to_array(term_column[order]),
+                                           _to_array(tf_column[order]))
 
-        # Load doc_term_freqs
-        with open(os.path.join(index_directory, 'doc_term_freqs.json'), 'r', encoding='utf-8') as f:
-            doc_term_freqs_data = json.load(f)
-            self.doc_term_freqs = {doc_id: Counter(freqs) for doc_id, freqs in doc_term_freqs_data.items()}
-
-        # Load document metadata
-        with open(os.path.join(index_directory, 'document_metadata.json'), 'r', encoding='utf-8') as f:
-            self.document_metadata = json.load(f)
+    def _compute_term_bounds(self) -> None:
+        """
+        Compute the per-term upper bound statistics from the postings, e.g. after loading an index
+        that was saved without them.
+        """
+        doc_lengths = self.get_document_length_array()
+        self.term_max_tfs = array('I')
+        self.term_min_doc_lengths = array('I')
+        for term in self.terms:
+            doc_ids, tfs = self.index[term].arrays()
+            self.term_max_tfs.append(int(tfs.max()) if len(tfs) > 0 else 0)
+            self.term_min_doc_lengths.append(int(doc_lengths[doc_ids].min()) if len(doc_ids) > 0 else NO_DOC_LENGTH)
 
-        self.total_documents = len(self.document_lengths)
+    def _compute_collection_statistics(self) -> None:
+        """
+        Compute the collection statistics from the postings and the forward index, e.g. after loading
+        an index that was saved without them.
+        """
+        term_offsets = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        collection_freqs = np.zeros(len(self.terms), dtype=np.uint64)
+        for term_id, term in enumerate(self.terms):
+            _, tfs = self.index[term].arrays()
+            term_offsets[term_id + 1] = term_offsets[term_id] + len(tfs)
+            collection_freqs[term_id] = tfs.sum(dtype=np.uint64)
+        self.term_doc_freqs = _to_array(np.diff(term_offsets))
+        self.term_collection_freqs = _to_array(collection_freqs, 'Q')
+        self.document_norms = array('d', self.doc_term_freqs.document_norms().tolist())
+        self.total_token_count = int(self.get_document_length_array().sum())
 
+    def get_postings(self, term: str) -> PostingsList:
+        """
+        Get the postings list for a term.
+        The postings list holds paired columns of int doc ids and term frequencies;
+        use PostingsList.as_dicts() for the {'doc_id', 'tf'} dictionary form.
+        """
+        postings = self.index.get(term)
+        if postings is None:
+            return PostingsList(array('I'), array('I'), self.external_ids)
+        return postings
 
-class Indexer:
-    @staticmethod
-    def create_index(index_type: IndexType, dataset_path: str,
-                    tokenizer: Tokenizer, text_keys: list[str] = ["text"],
-                    id_key: str = "id", max_docs: int = -1) -> InvertedIndex:
-        if index_type != IndexType.BASIC:
-            raise ValueError("Unsupported index type.")
+    def get_postings_dicts(self, term: str) -> list[dict]:
+        """
+        Get the postings list for a term as dictionaries with keys 'doc_id' and 'tf'.
+        """
+        return self.get_postings(term).as_dicts()
 
-        index = InvertedIndex()
+    def get_document_length_array(self) -> np.ndarray:
+        """
+        Get the document lengths as a NumPy array indexed by int doc id.
+        """
+        return _as_numpy(self.document_lengths.values_array)
 
-        # Detect encoding
-        with open(dataset_path, 'rb') as ef:
-            raw_data = ef.read(100000)
-            result = chardet.detect(raw_data)
-            encoding = result['encoding']
-            confidence = result['confidence']
-            print(f"Detected encoding: {encoding} with confidence {confidence}")
+    def get_document_frequencies(self) -> np.ndarray:
+        """
+        Get the document frequency of every term as a NumPy array indexed by term id.
+        """
+        return np.asarray(self.term_doc_freqs, dtype=np.int64)
 
-        # Read and index documents
-        with open(dataset_path, 'r', encoding=encoding, errors='replace') as f:
-            for line_num, line in enumerate(f):
-                if 0 < max_docs <= line_num:
-                    break
+    def get_collection_term_frequencies(self) -> np.ndarray:
+        """
+        Get the total frequency of every term in the collection as a NumPy array indexed by term id.
+        """
+        return np.asarray(self.term_collection_freqs, dtype=np.int64)
 
-                try:
-                    doc = json.loads(line)
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON on line {line_num}: {e}")
-                    continue
+    def get_document_norm_array(self) -> np.ndarray:
+        """
+        Get the L2 norm of each document's term frequency vector as a NumPy array indexed by int doc id.
+        """
+        return np.asarray(self.document_norms, dtype=np.float64)
 
-                # Combine text from specified keys
-                text_parts = [str(doc.get(key, "")) for key in text_keys]
-                text = ' '.join(text_parts)
+    def get_document_term_matrix(self) -> csr_matrix:
+        """
+        Get the forward index as a SciPy CSR matrix of term frequencies,
+        with a row per int doc id and a column per term id.
+        """
+        forward_index = self.doc_term_freqs
+        return csr_matrix((_as_numpy(forward_index.tfs).astype(np.float64),
+                           _as_numpy(forward_index.doc_term_ids), _as_numpy(forward_index.indptr).astype(np.int64)),
+                          shape=(len(self.external_ids), len(self.terms)))
 
-                doc_id = doc.get(id_key)
+    def get_document_term_rows(self, internal_ids: np.ndarray) -> csr_matrix:
+        """
+        Get the rows of the document-term matrix for some documents, as a SciPy CSR matrix with a row
+        per given int doc id (in the given order) and a column per term id. Only the documents' rows
+        of the forward index are read, so this is cheap for a few candidates of a large index.
 
-                # Collect metadata
-                doc_metadata = {
-                    'title': doc.get('title', 'No Title'),
-                    'text': text,
-                    'url': doc.get('link', '#')
-                }
+        Args:
+            internal_ids: The int doc ids of the documents.
 
-                if doc_id is None:
-                    print(f"Document missing '{id_key}' on line {line_num}. Skipping.")
-                    continue
+        Returns:
+            The documents' term frequency matrix.
+        """
+        forward_index = self.doc_term_freqs
+        indptr = _as_numpy(forward_index.indptr)
+        internal_ids = np.asarray(internal_ids, dtype=np.int64)
+        starts = indptr[internal_ids].astype(np.int64)
+        row_lengths = indptr[internal_ids + 1].astype(np.int64) - starts
+        row_indptr = np.zeros(len(internal_ids) + 1, dtype=np.int64)
+        np.cumsum(row_lengths, out=row_indptr[1:])
+        # Position of every entry of the selected rows in the forward index's columns
+        positions = np.repeat(starts - row_indptr[:-1], row_lengths) + np.arange(row_indptr[-1])
+        return csr_matrix((_as_numpy(forward_index.tfs)[positions].astype(np.float64),
+                           _as_numpy(forward_index.doc_term_ids)[positions].astype(np.int64), row_indptr),
+                          shape=(len(internal_ids), len(self.terms)))
 
-                tokens = tokenizer.tokenize(text)
+    def get_query_matrix(self, query_word_counts_list: list[Counter]) -> csr_matrix:
+        """
+        Build a SciPy CSR matrix of query term frequencies with a row per query, for batch scoring.
+        The first len(self.terms) columns are the index's term ids; terms that are not in the index
+        get extra columns after those, so that query norms still account for them.
 
-                if line_num % 1000 == 0:
-                    print(f"Processing document {line_num}...")
+        Args:
+            query_word_counts_list: A Counter of term frequencies for each query.
 
-                index.add_document(doc_id, tokens, metadata=doc_metadata)
+        Returns:
+            The query matrix.
+        """
+        unknown_term_columns = {}
+        rows, columns, values = [], [], []
+        for row, query_word_counts in enumerate(query_word_counts_list):
+            for term, query_tf in query_word_counts.items():
+                column = self.term_ids.get(term)
+                if column is None:
+                    column = unknown_term_columns.setdefault(term, len(self.terms) + len(unknown_term_columns))
+                rows.append(row)
+                columns.append(column)
+                values.append(query_tf)
+        return csr_matrix((np.array(values, dtype=np.float64), (rows, columns)),
+                          shape=(len(query_word_counts_list), len(self.terms) + len(unknown_term_columns)))
 
-        return index
-    
-    @classmethod
-    def load_index(cls, index_directory: str) -> InvertedIndex:
+    def get_statistics(self):
         """
-        Load an existing index from the specified directory.
+        Return collection statistics.
         """
-        index = InvertedIndex()
-        index.load(index_directory)
+        mean_document_length = self.total_token_count / self.total_documents if self.total_documents > 0 else 0
+        return {
+            'total_token_count': self.total_token_count,
+            'mean_document_length': mean_document_length,
+            'number_of_documents': self.total_documents,
+        }
+
+    def get_fingerprint(self) -> str:
+        """
+        Get a hash of the index's documents, vocabulary and statistics. Unlike version, it is the same in
+        every process that loads the same index, so it can key data derived from the index on disk.
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps([self.external_ids, self.terms, self.normalizer_config,
+                                  self.tokenizer_config]).encode('utf-8'))
+        for column in (self.document_lengths.values_array, self.term_doc_freqs, self.term_collection_freqs,
+                       self.doc_term_freqs.tfs):
+            digest.update(np.ascontiguousarray(_as_numpy(column)).tobytes())
+        return digest.hexdigest()
+
+    def get_term_metadata(self, term: str):
+        """
+        Get metadata for a term: its document and collection frequencies, and the largest tf and shortest
+        document length in its postings (used to bound the term's score contribution).
+        """
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return {'doc_frequency': 0, 'collection_frequency': 0, 'max_tf': 0, 'min_doc_length': 0}
+        return {
+            'doc_frequency': int(self.term_doc_freqs[term_id]),
+            'collection_frequency': int(self.term_collection_freqs[term_id]),
+            'max_tf': int(self.term_max_tfs[term_id]),
+            'min_doc_length': int(self.term_min_doc_lengths[term_id]),
+        }
+
+    def _ensure_writable(self) -> None:
+        """
+        Copy a memory-mapped index into regular dictionaries so that it can be modified.
+        """
+        if not self.is_memory_mapped:
+            return
+        index = {}
+        for term, postings in self.index.items():
+            index[term] = self._new_postings_list()
+            index[term].extend(*postings.arrays())
+        self.index = index
+        self.document_lengths = _DocumentArrayMapping(self.internal_ids,
+                                                      _to_array(self.document_lengths.values_array))
+        self.term_max_tfs = _to_array(self.term_max_tfs)
+        self.term_min_doc_lengths = _to_array(self.term_min_doc_lengths)
+        self.term_doc_freqs = _to_array(self.term_doc_freqs)
+        self.term_collection_freqs = _to_array(self.term_collection_freqs, 'Q')
+        self.document_norms = array('d', self.get_document_norm_array().tolist())
+        self.doc_term_freqs = ForwardIndex(self.internal_ids, self.terms, self.term_ids,
+                                           _to_array(self.doc_term_freqs.indptr, 'Q'),
+                                           _to_array(self.doc_term_freqs.doc_term_ids),
+                                           _to_array(self.doc_term_freqs.tfs))
+        self.document_metadata = dict(self.document_metadata)
+        self.is_memory_mapped = False
+
+    def save(self, index_directory: str, index_format: IndexFormat = IndexFormat.BINARY,
+             codec: PostingsCodec = None) -> None:
+        """
+        Save the index to disk in the given format (and, for the binary format, postings codec;
+        by default the index's).
+        """
+        if index_format == IndexFormat.BINARY:
+            self.save_binary(index_directory, codec)
+        elif index_format == IndexFormat.JSON:
+            self.save_json(index_directory)
+        else:
+            raise ValueError("Unsupported index format.")
+
+    def load(self, index_directory: str) -> None:
+        """
+        Load the index from disk, detecting the format it was saved in.
+        """
+        if os.path.exists(os.path.join(index_directory, BINARY_META_FILE)):
+            self.load_binary(index_directory)
+        else:
+            self.load_json(index_directory)
+
+    def save_json(self, index_directory: str) -> None:
+        """
+        Save the index to disk as JSON files.
+        The forward index and collection statistics are not saved; they are rebuilt from the postings on load.
+        """
+        os.makedirs(index_directory, exist_ok=True)
+
+        # Save index
+        with open(os.path.join(index_directory, 'index.json'), 'w', encoding='utf-8') as f:
+            json.dump({term: postings.as_dicts() for term, postings in self.index.items()}, f)
+
+        # Save document lengths
+        with open(os.path.join(index_directory, 'doc_lengths.json'), 'w', encoding='utf-8') as f:
+            json.dump(dict(self.document_lengths), f)
+
+        # Save document metadata
+        with open(os.path.join(index_directory, 'document_metadata.json'), 'w', encoding='utf-8') as f:
+            json.dump(dict(self.document_metadata), f)
+
+        # Save the vocabulary, so that term ids stay the same when the index is loaded
+        self.vocabulary.save(os.path.join(index_directory, VOCABULARY_FILE))
+        self._save_tokenizer_configs(index_directory)
+
+    def load_json(self, index_directory: str) -> None:
+        """
+        Load the index from JSON files.
+        """
+        # Load document lengths
+        with open(os.path.join(index_directory, 'doc_lengths.json'), 'r', encoding='utf-8') as f:
+            doc_lengths = json.load(f)
+        self.external_ids = []
+        self.internal_ids = {}
+        for doc_id in doc_lengths:
+            self._intern_doc_id(doc_id)
+
+        # Load index, converting the posting dictionaries into sorted int columns
+        with open(os.path.join(index_directory, 'index.json'), 'r', encoding='utf-8') as f:
+            index_data = json.load(f)
+        self.index = {}
+        vocabulary_path = os.path.join(index_directory, VOCABULARY_FILE)
+        self.vocabulary = Vocabulary.load(vocabulary_path) if os.path.exists(vocabulary_path) else Vocabulary()
+        for term, postings in index_data.items():
+            self.vocabulary.add(term)
+            pairs = sorted((self._intern_doc_id(posting['doc_id']), posting['tf']) for posting in postings)
+            self.index[term] = self._new_postings_list()
+            self.index[term].extend(np.array([doc_id for doc_id, _ in pairs], dtype=np.uint32),
+                                    np.array([tf for _, tf in pairs], dtype=np.uint32))
+
+        # Rebuild the forward index from the postings (older JSON indexes also carry a
+        # doc_term_freqs.json file; it is redundant and no longer read)
+        self._rebuild_forward_index()
+
+        # Load document metadata
+        with open(os.path.join(index_directory, 'document_metadata.json'), 'r', encoding='utf-8') as f:
+            self.document_metadata = json.load(f)
+
+        self.document_lengths = _DocumentArrayMapping(
+            self.internal_ids, array('I', [doc_lengths.get(doc_id, 0) for doc_id in self.external_ids]))
+        self.total_documents = len(doc_lengths)
+        self._compute_term_bounds()
+        self._compute_collection_statistics()
+        self._load_tokenizer_configs(index_directory)
+        self.is_memory_mapped = False
+        self.version = next(_INDEX_VERSIONS)
+
+    def save_binary(self, index_directory: str, codec: PostingsCodec = None) -> None:
+        """
+        Save the index to disk in the binary format, with the given postings codec (by default the index's).
+
+        Layout:
+            terms.json: the vocabulary; a term's position is its term id
+            term_offsets.npy: start of each term's postings (num_terms + 1 entries)
+            term_max_tf.npy / term_min_doc_length.npy: per-term score upper bound statistics
+            term_doc_freq.npy / term_collection_freq.npy: per-term document and collection frequencies
+            postings_doc_gaps.npy / postings_tfs.npy: with the RAW codec, delta-encoded int doc ids and term frequencies
+            postings.npy / block_offsets.npy / block_last_doc_ids.npy / term_block_offsets.npy: with other codecs,
+                the postings encoded in blocks of BLOCK_SIZE, the start and skip pointer of each block,
+                and the first block of each term
+            block_max_tf.npy / block_min_doc_length.npy: with other codecs, per-block score upper bound statistics
+            docids.json / doc_lengths.npy / doc_norms.npy: external doc id, length and L2 norm of each int doc id
+            normalizer.json / tokenizer.json: the configuration of the token normalizer and the settings of
+                the tokenizer the index was built with
+            forward_indptr.npy / forward_term_ids.npy / forward_tfs.npy: CSR forward index (see ForwardIndex)
+            document_metadata.jsonl / document_metadata_offsets.npy: metadata store, one JSON record per line
+            index_meta.json: format version, counts and total token count, written last
+        """
+        os.makedirs(index_directory, exist_ok=True)
+        if codec is None:
+            codec = self.postings_codec
+
+        doc_ids = self.external_ids
+        terms = self.terms
+
+        # Postings: int doc ids sorted per term and stored as gaps. They are the forward index entries
+        # ordered by term id, and the stable sort keeps each term's entries in int doc id order
+        forward_indptr = np.asarray(self.doc_term_freqs.indptr, dtype=np.int64)
+        forward_term_ids = _as_numpy(self.doc_term_freqs.doc_term_ids)
+        order = np.argsort(forward_term_ids, kind='stable')
+        postings_doc_ids = np.repeat(np.arange(len(doc_ids), dtype=np.int64), np.diff(forward_indptr))[order]
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(forward_term_ids, minlength=len(terms)), out=term_offsets[1:])
+        doc_gaps = np.diff(postings_doc_ids, prepend=0)
+        term_starts = term_offsets[:-1][term_offsets[:-1] < term_offsets[1:]]
+        doc_gaps[term_starts] = postings_doc_ids[term_starts]
+
+        np.save(os.path.join(index_directory, 'term_offsets.npy'), term_offsets)
+        np.save(os.path.join(index_directory, 'term_max_tf.npy'), np.asarray(self.term_max_tfs, dtype=np.uint32))
+        np.save(os.path.join(index_directory, 'term_min_doc_length.npy'),
+                np.asarray(self.term_min_doc_lengths, dtype=np.uint32))
+        np.save(os.path.join(index_directory, 'term_doc_freq.npy'), np.asarray(self.term_doc_freqs, dtype=np.uint32))
+        np.save(os.path.join(index_directory, 'term_collection_freq.npy'),
+                np.asarray(self.term_collection_freqs, dtype=np.uint64))
+        postings_tfs = _as_numpy(self.doc_term_freqs.tfs)[order].astype(np.uint32)
+        if codec == PostingsCodec.RAW:
+            np.save(os.path.join(index_directory, 'postings_doc_gaps.npy'), doc_gaps.astype(np.uint32))
+            np.save(os.path.join(index_directory, 'postings_tfs.npy'), postings_tfs)
+        else:
+            term_postings = ((postings_doc_ids[start:end], postings_tfs[start:end])
+                             for start, end in zip(term_offsets[:-1], term_offsets[1:]))
+            _save_postings_blocks(index_directory, codec, term_postings, len(terms), self.get_document_length_array())
+        np.save(os.path.join(index_directory, 'doc_lengths.npy'),
+                np.asarray(self.document_lengths.values_array, dtype=np.uint32))
+        np.save(os.path.join(index_directory, 'doc_norms.npy'), self.get_document_norm_array())
+        np.save(os.path.join(index_directory, 'forward_indptr.npy'),
+                np.asarray(self.doc_term_freqs.indptr, dtype=np.int64))
+        np.save(os.path.join(index_directory, 'forward_term_ids.npy'),
+                np.asarray(self.doc_term_freqs.doc_term_ids, dtype=np.uint32))
+        np.save(os.path.join(index_directory, 'forward_tfs.npy'), np.asarray(self.doc_term_freqs.tfs, dtype=np.uint32))
+
+        self.vocabulary.save(os.path.join(index_directory, VOCABULARY_FILE))
+        with open(os.path.join(index_directory, 'docids.json'), 'w', encoding='utf-8') as f:
+            json.dump(doc_ids, f)
+        self._save_tokenizer_configs(index_directory)
+
+        # Metadata store
+        metadata_offsets = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+        with open(os.path.join(index_directory, 'document_metadata.jsonl'), 'wb') as f:
+            for internal_id, doc_id in enumerate(doc_ids):
+                record = (json.dumps(self.document_metadata.get(doc_id, {})) + '\n').encode('utf-8')
+                f.write(record)
+                metadata_offsets[internal_id + 1] = metadata_offsets[internal_id] + len(record)
+        np.save(os.path.join(index_directory, 'document_metadata_offsets.npy'), metadata_offsets)
+
+        self._save_binary_meta(index_directory, len(doc_ids), len(terms), int(term_offsets[-1]),
+                               self.total_token_count, codec)
+
+    def _save_tokenizer_configs(self, index_directory: str) -> None:
+        """
+        Save the normalizer configuration and tokenizer settings the index was built with (both formats).
+        """
+        _save_config(index_directory, NORMALIZER_FILE, self.normalizer_config)
+        _save_config(index_directory, TOKENIZER_FILE, self.tokenizer_config)
+
+    def _load_tokenizer_configs(self, index_directory: str) -> None:
+        """
+        Load the normalizer configuration and tokenizer settings the index was built with (both formats).
+        """
+        self.normalizer_config = _load_config(index_directory, NORMALIZER_FILE)
+        self.tokenizer_config = _load_config(index_directory, TOKENIZER_FILE)
+
+    @staticmethod
+    def _save_binary_meta(index_directory: str, number_of_documents: int, number_of_terms: int,
+                          number_of_postings: int, total_token_count: int,
+                          codec: PostingsCodec = PostingsCodec.RAW) -> None:
+        """
+        Write the index_meta.json file of a binary index. It is written last, once all the arrays are on disk.
+        """
+        with open(os.path.join(index_directory, BINARY_META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({
+                'format': IndexFormat.BINARY.value,
+                'version': BINARY_FORMAT_VERSION,
+                'number_of_documents': number_of_documents,
+                'number_of_terms': number_of_terms,
+                'number_of_postings': number_of_postings,
+                'total_token_count': total_token_count,
+                'postings_codec': codec.value,
+            }, f)
+
+    def load_binary(self, index_directory: str) -> None:
+        """
+        Open an index saved in the binary format. The arrays and the metadata store are memory-mapped,
+        so loading is cheap and processes opening the same index share pages through the OS cache.
+        """
+        with open(os.path.join(index_directory, BINARY_META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') not in (1, 2, 3, 4, BINARY_FORMAT_VERSION):
+            raise ValueError(f"Unsupported binary index version: {meta.get('version')}")
+
+        self.vocabulary = Vocabulary.load(os.path.join(index_directory, VOCABULARY_FILE))
+        with open(os.path.join(index_directory, 'docids.json'), 'r', encoding='utf-8') as f:
+            doc_ids = json.load(f)
+        terms, term_ids = self.terms, self.term_ids
+        internal_ids = {doc_id: internal_id for internal_id, doc_id in enumerate(doc_ids)}
+        self.external_ids = doc_ids
+        self.internal_ids = internal_ids
+
+        codec = PostingsCodec(meta.get('postings_codec', PostingsCodec.RAW.value))
+        self.postings_codec = codec
+        if codec == PostingsCodec.RAW:
+            self.index = _BinaryPostings(term_ids, _load_array(index_directory, 'term_offsets'),
+                                         _load_array(index_directory, 'postings_doc_gaps'),
+                                         _load_array(index_directory, 'postings_tfs'), doc_ids)
+        else:
+            has_block_statistics = meta['version'] >= 5
+            self.index = _CompressedPostings(
+                term_ids, codec, _load_array(index_directory, 'postings'), _load_array(index_directory, 'term_offsets'),
+                _load_array(index_directory, 'term_block_offsets'), _load_array(index_directory, 'block_offsets'),
+                _load_array(index_directory, 'block_last_doc_ids'), doc_ids,
+                _load_array(index_directory, 'block_max_tf') if has_block_statistics else None,
+                _load_array(index_directory, 'block_min_doc_length') if has_block_statistics else None)
+        self.document_lengths = _DocumentArrayMapping(internal_ids, _load_array(index_directory, 'doc_lengths'))
+        self.doc_term_freqs = ForwardIndex(internal_ids, terms, term_ids,
+                                           _load_array(index_directory, 'forward_indptr'),
+                                           _load_array(index_directory, 'forward_term_ids'),
+                                           _load_array(index_directory, 'forward_tfs'))
+        self.document_metadata = MetadataStore(os.path.join(index_directory, 'document_metadata.jsonl'),
+                                               _load_array(index_directory, 'document_metadata_offsets'),
+                                               internal_ids)
+        self.total_documents = len(doc_ids)
+        if meta['version'] >= 2:
+            self.term_max_tfs = _load_array(index_directory, 'term_max_tf')
+            self.term_min_doc_lengths = _load_array(index_directory, 'term_min_doc_length')
+        else:
+            self._compute_term_bounds()
+        if meta['version'] >= 3:
+            self.term_doc_freqs = _load_array(index_directory, 'term_doc_freq')
+            self.term_collection_freqs = _load_array(index_directory, 'term_collection_freq')
+            self.document_norms = _load_array(index_directory, 'doc_norms')
+            self.total_token_count = meta['total_token_count']
+        else:
+            self._compute_collection_statistics()
+        self._load_tokenizer_configs(index_directory)
+        self.is_memory_mapped = True
+        self.version = next(_INDEX_VERSIONS)
+
+
+class SpimiIndexWriter:
+    """
+    Builds a binary index in external memory (single-pass in-memory indexing, SPIMI).
+    Documents are added to an in-memory block; when the block's estimated size reaches the memory budget,
+    it is flushed to disk as a segment with lexicographically sorted terms. Closing the writer k-way merges
+    the segments' sorted term lists into the final binary index, streaming the postings to memory-mapped
+    arrays, so peak memory is bounded by the budget plus a few arrays per term and per document.
+    Duplicate doc ids are skipped, keeping the first copy as InvertedIndex.add_document does: within the
+    block when they are added, and across segments when they are merged, so the writer holds no set of
+    every doc id while it indexes.
+    """
+    def __init__(self, index_directory: str, memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB,
+                 normalizer_config: dict = None, tokenizer_config: dict = None,
+                 postings_codec: PostingsCodec = PostingsCodec.RAW) -> None:
+        """
+        Args:
+            index_directory: Directory to write the index to. Segments are written to a subdirectory.
+            memory_budget_mb: Estimated memory of the in-memory block at which it is flushed.
+            normalizer_config: The configuration of the token normalizer the documents are tokenized with.
+            tokenizer_config: The settings of the tokenizer the documents are tokenized with.
+            postings_codec: The codec of the final index's postings, which also compresses them in the
+                in-memory block. Segments are written uncompressed, since they are only read by the merge.
+        """
+        self.index_directory = index_directory
+        self.normalizer_config = normalizer_config
+        self.tokenizer_config = tokenizer_config
+        self.postings_codec = postings_codec
+        self.bytes_per_posting = BYTES_PER_POSTING if postings_codec == PostingsCodec.RAW else BYTES_PER_COMPRESSED_POSTING
+        self.segments_directory = os.path.join(index_directory, SEGMENTS_DIRECTORY)
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.segment_directories = []
+        self.block = InvertedIndex(postings_codec)
+        self.block_size = 0
+
+    def add_document(self, doc_id: str, tokens: list[str], metadata: dict) -> None:
+        """
+        Add a document to the index, flushing the current block if it is over the memory budget.
+        """
+        if doc_id in self.block.internal_ids:
+            print(f"Document with doc_id {doc_id} is already indexed.")
+            return
+
+        number_of_terms = len(self.block.terms)
+        self.block.add_document(doc_id, tokens, metadata)
+        self.block_size += (self.bytes_per_posting * len(set(tokens)) + BYTES_PER_TERM * (len(self.block.terms) - number_of_terms)
+                            + sum(len(str(value)) for value in metadata.values()))
+        if self.block_size >= self.memory_budget:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the current block to disk as a segment and start a new one.
+        """
+        if self.block.total_documents == 0:
+            return
+        segment_directory = os.path.join(self.segments_directory, f'segment_{len(self.segment_directories):05d}')
+        print(f"Flushing segment {len(self.segment_directories)} with {self.block.total_documents} documents...")
+        self.block._sort_terms()
+        self.block.save_binary(segment_directory, PostingsCodec.RAW)
+        self.segment_directories.append(segment_directory)
+        self.block = InvertedIndex(self.postings_codec)
+        self.block_size = 0
+
+    def close(self) -> InvertedIndex:
+        """
+        Flush the last block, merge the segments into the final index and remove them.
+
+        Returns:
+            The final index, memory-mapped from disk.
+        """
+        self.flush()
+        if not self.segment_directories:
+            empty_index = InvertedIndex(self.postings_codec)
+            empty_index.normalizer_config = self.normalizer_config
+            empty_index.tokenizer_config = self.tokenizer_config
+            empty_index.save_binary(self.index_directory)
+        else:
+            self._merge_segments()
+        shutil.rmtree(self.segments_directory, ignore_errors=True)
+        index = InvertedIndex()
+        index.load_binary(self.index_directory)
+        return index
+
+    def _merge_segments(self) -> None:
+        """
+        K-way merge the segments into a binary index (see InvertedIndex.save_binary for the layout).
+        Segments hold consecutive ranges of int doc ids, so a term's postings are the concatenation of its
+        postings in each segment, and the documents are copied segment by segment, leaving out the documents
+        that an earlier segment already holds. The postings are merged uncompressed, then encoded term by
+        term if the writer has a postings codec.
+        """
+        index_directory = self.index_directory
+        segments = []
+        for segment_directory in self.segment_directories:
+            segment = InvertedIndex()
+            segment.load_binary(segment_directory)
+            segments.append(segment)
+
+        # Each segment only checked its own doc ids: skip the documents of earlier segments
+        seen_doc_ids = set()
+        segment_kept = []
+        for segment in segments:
+            kept = np.ones(len(segment.external_ids), dtype=bool)
+            for internal_id, doc_id in enumerate(segment.external_ids):
+                if doc_id in seen_doc_ids:
+                    print(f"Document with doc_id {doc_id} is already indexed.")
+                    kept[internal_id] = False
+                else:
+                    seen_doc_ids.add(doc_id)
+            segment_kept.append(kept)
+        del seen_doc_ids
+        # The merged int doc id of each segment's documents (-1 for skipped ones)
+        doc_bases = np.cumsum([0] + [int(kept.sum()) for kept in segment_kept])
+        segment_id_maps = [np.where(kept, doc_base + np.cumsum(kept) - 1, -1)
+                           for kept, doc_base in zip(segment_kept, doc_bases)]
+        segment_all_kept = [bool(kept.all()) for kept in segment_kept]
+        segment_entries = [np.repeat(kept, np.diff(np.asarray(segment.doc_term_freqs.indptr, dtype=np.int64)))
+                           for segment, kept in zip(segments, segment_kept)]
+        number_of_documents = int(doc_bases[-1])
+        number_of_postings = sum(int(entries.sum()) for entries in segment_entries)
+
+        # Per-term columns of each segment as lists, so that the merge loop only does cheap lookups
+        segment_term_offsets = [segment.index.term_offsets.tolist() for segment in segments]
+        segment_doc_gaps = [np.asarray(segment.index.doc_gaps) for segment in segments]
+        segment_tfs = [np.asarray(segment.index.tfs) for segment in segments]
+        segment_doc_lengths = [segment.get_document_length_array() for segment in segments]
+        segment_term_statistics = [list(zip(segment.term_max_tfs.tolist(), segment.term_min_doc_lengths.tolist(),
+                                            segment.term_doc_freqs.tolist(), segment.term_collection_freqs.tolist()))
+                                   for segment in segments]
+
+        def open_array(name, dtype, length):
+            return np.lib.format.open_memmap(os.path.join(index_directory, f'{name}.npy'), mode='w+',
+                                             dtype=dtype, shape=(length,))
+
+        # Postings: merge the sorted term lists, with the segment number breaking ties so that
+        # each term's postings are concatenated in int doc id order, and store them as gaps
+        doc_gaps_file = open_array('postings_doc_gaps', np.uint32, number_of_postings)
+        postings_tfs_file = open_array('postings_tfs', np.uint32, number_of_postings)
+        doc_gaps = np.asarray(doc_gaps_file)
+        postings_tfs = np.asarray(postings_tfs_file)
+        terms = []
+        term_offsets = array('Q', [0])
+        term_max_tfs = array('I')
+        term_min_doc_lengths = array('I')
+        term_doc_freqs = array('I')
+        term_collection_freqs = array('Q')
+        term_maps = [np.zeros(len(segment.terms), dtype=np.uint32) for segment in segments]
+        position = 0
+        def segment_terms(segment_number):
+            for term_id, term in enumerate(segments[segment_number].terms):
+                yield term, segment_number, term_id
+
+        merged_terms = heapq.merge(*[segment_terms(segment_number) for segment_number in range(len(segments))])
+        for term, entries in groupby(merged_terms, key=lambda entry: entry[0]):
+            global_term_id = len(terms)
+            max_tf, min_doc_length, doc_frequency, collection_frequency = 0, NO_DOC_LENGTH, 0, 0
+            previous_doc_id = 0
+            for _, segment_number, term_id in entries:
+                term_maps[segment_number][term_id] = global_term_id
+                start, end = segment_term_offsets[segment_number][term_id:term_id + 2]
+                segment_doc_ids = np.cumsum(segment_doc_gaps[segment_number][start:end], dtype=np.int64)
+                tfs = segment_tfs[segment_number][start:end]
+                if segment_all_kept[segment_number]:
+                    segment_max_tf, segment_min_doc_length, segment_doc_frequency, segment_collection_frequency = \
+                        segment_term_statistics[segment_number][term_id]
+                else:
+                    kept = segment_kept[segment_number][segment_doc_ids]
+                    segment_doc_ids, tfs = segment_doc_ids[kept], tfs[kept]
+                    if len(segment_doc_ids) == 0:
+                        continue
+                    segment_max_tf = int(tfs.max())
+                    segment_min_doc_length = int(segment_doc_lengths[segment_number][segment_doc_ids].min())
+                    segment_doc_frequency = len(segment_doc_ids)
+                    segment_collection_frequency = int(tfs.sum(dtype=np.uint64))
+                merged_doc_ids = segment_id_maps[segment_number][segment_doc_ids]
+                doc_gaps[position:position + len(merged_doc_ids)] = np.diff(merged_doc_ids, prepend=previous_doc_id)
+                postings_tfs[position:position + len(merged_doc_ids)] = tfs
+                position += len(merged_doc_ids)
+                previous_doc_id = int(merged_doc_ids[-1])
+
+                max_tf = max(max_tf, segment_max_tf)
+                min_doc_length = min(min_doc_length, segment_min_doc_length)
+                doc_frequency += segment_doc_frequency
+                collection_frequency += segment_collection_frequency
+            # Terms that only skipped documents contain are left out
+            if doc_frequency == 0:
+                continue
+            terms.append(term)
+            term_offsets.append(position)
+            term_max_tfs.append(max_tf)
+            term_min_doc_lengths.append(min_doc_length)
+            term_doc_freqs.append(doc_frequency)
+            term_collection_freqs.append(collection_frequency)
+        doc_gaps_file.flush()
+        postings_tfs_file.flush()
+        del doc_gaps, postings_tfs, doc_gaps_file, postings_tfs_file
+
+        np.save(os.path.join(index_directory, 'term_offsets.npy'), np.asarray(term_offsets, dtype=np.int64))
+        np.save(os.path.join(index_directory, 'term_max_tf.npy'), np.asarray(term_max_tfs, dtype=np.uint32))
+        np.save(os.path.join(index_directory, 'term_min_doc_length.npy'), np.asarray(term_min_doc_lengths, dtype=np.uint32))
+        np.save(os.path.join(index_directory, 'term_doc_freq.npy'), np.asarray(term_doc_freqs, dtype=np.uint32))
+        np.save(os.path.join(index_directory, 'term_collection_freq.npy'), np.asarray(term_collection_freqs, dtype=np.uint64))
+        with open(os.path.join(index_directory, VOCABULARY_FILE), 'w', encoding='utf-8') as f:
+            json.dump(terms, f)
+
+        # Documents: copy each segment's kept forward index rows (mapped to the merged term ids, which keeps
+        # them sorted since both term orders are lexicographic), lengths, norms, metadata and doc ids
+        forward_indptr = open_array('forward_indptr', np.int64, number_of_documents + 1)
+        forward_term_ids = open_array('forward_term_ids', np.uint32, number_of_postings)
+        forward_tfs = open_array('forward_tfs', np.uint32, number_of_postings)
+        doc_lengths = open_array('doc_lengths', np.uint32, number_of_documents)
+        doc_norms = open_array('doc_norms', np.float64, number_of_documents)
+        metadata_offsets = open_array('document_metadata_offsets', np.int64, number_of_documents + 1)
+        forward_indptr[0] = 0
+        metadata_offsets[0] = 0
+        total_token_count = 0
+        with open(os.path.join(index_directory, 'document_metadata.jsonl'), 'wb') as metadata_file, \
+                open(os.path.join(index_directory, 'docids.json'), 'w', encoding='utf-8') as docids_file:
+            docids_file.write('[')
+            for segment_number, segment in enumerate(segments):
+                kept, entries = segment_kept[segment_number], segment_entries[segment_number]
+                start, end = int(doc_bases[segment_number]), int(doc_bases[segment_number + 1])
+                row_lengths = np.diff(np.asarray(segment.doc_term_freqs.indptr, dtype=np.int64))[kept]
+                entries_start = int(forward_indptr[start])
+                entries_end = entries_start + int(row_lengths.sum())
+                forward_indptr[start + 1:end + 1] = entries_start + np.cumsum(row_lengths)
+                forward_term_ids[entries_start:entries_end] = \
+                    term_maps[segment_number][np.asarray(segment.doc_term_freqs.doc_term_ids)[entries]]
+                forward_tfs[entries_start:entries_end] = np.asarray(segment.doc_term_freqs.tfs)[entries]
+                doc_lengths[start:end] = segment_doc_lengths[segment_number][kept]
+                doc_norms[start:end] = segment.get_document_norm_array()[kept]
+                total_token_count += int(segment_doc_lengths[segment_number][kept].sum(dtype=np.uint64))
+
+                segment_metadata_offsets = np.asarray(segment.document_metadata.offsets, dtype=np.int64)
+                metadata_offsets[start + 1:end + 1] = metadata_offsets[start] + np.cumsum(np.diff(segment_metadata_offsets)[kept])
+                if segment_all_kept[segment_number]:
+                    with open(os.path.join(self.segment_directories[segment_number], 'document_metadata.jsonl'),
+                              'rb') as segment_metadata_file:
+                        shutil.copyfileobj(segment_metadata_file, metadata_file)
+                else:
+                    for internal_id in np.flatnonzero(kept).tolist():
+                        metadata_file.write(segment.document_metadata.buffer[
+                            segment_metadata_offsets[internal_id]:segment_metadata_offsets[internal_id + 1]])
+
+                for internal_id in np.flatnonzero(kept).tolist():
+                    docids_file.write((', ' if start > 0 or internal_id > 0 else '')
+                                      + json.dumps(segment.external_ids[internal_id]))
+            docids_file.write(']')
+        for mapped_array in (forward_indptr, forward_term_ids, forward_tfs, doc_lengths, doc_norms, metadata_offsets):
+            mapped_array.flush()
+        del forward_indptr, forward_term_ids, forward_tfs, doc_lengths, doc_norms, metadata_offsets
+        _save_config(index_directory, NORMALIZER_FILE, self.normalizer_config)
+        _save_config(index_directory, TOKENIZER_FILE, self.tokenizer_config)
+
+        if self.postings_codec != PostingsCodec.RAW:
+            doc_gaps = _load_array(index_directory, 'postings_doc_gaps')
+            postings_tfs = _load_array(index_directory, 'postings_tfs')
+            term_postings = ((np.cumsum(doc_gaps[start:end], dtype=np.uint32), np.asarray(postings_tfs[start:end]))
+                             for start, end in zip(term_offsets[:-1], term_offsets[1:]))
+            _save_postings_blocks(index_directory, self.postings_codec, term_postings, len(terms),
+                                  _load_array(index_directory, 'doc_lengths'))
+            del doc_gaps, postings_tfs
+            os.remove(os.path.join(index_directory, 'postings_doc_gaps.npy'))
+            os.remove(os.path.join(index_directory, 'postings_tfs.npy'))
+
+        InvertedIndex._save_binary_meta(index_directory, number_of_documents, len(terms), number_of_postings,
+                                        total_token_count, self.postings_codec)
+
+
+class _SegmentedPostings(Mapping):
+    """
+    Maps terms to their live postings in the segments of a MultiSegmentIndex, read from each segment
+    that has the term when they are accessed.
+    """
+    def __init__(self, term_ids: dict, segments: list, id_maps: list, external_ids: list) -> None:
+        """
+        Args:
+            term_ids: The view's mapping of terms to term ids.
+            segments: The segment indexes.
+            id_maps: For each segment, the view's int doc id of each of its documents (-1 if deleted),
+                or None if they are the same as the segment's.
+            external_ids: The view's list mapping int doc ids to external doc ids.
+        """
+        self.term_ids = term_ids
+        self.segments = segments
+        self.id_maps = id_maps
+        self.external_ids = external_ids
+
+    def __getitem__(self, term):
+        if term not in self.term_ids:
+            raise KeyError(term)
+        segment_postings = []
+        for segment, id_map in zip(self.segments, self.id_maps):
+            postings = segment.index.get(term)
+            if postings is not None:
+                segment_postings.append((postings, id_map))
+        # A term of the first segment only, without deletions, keeps its postings and their block bounds
+        if len(segment_postings) == 1 and segment_postings[0][1] is None:
+            return segment_postings[0][0]
+
+        doc_id_columns, tf_columns = [], []
+        for postings, id_map in segment_postings:
+            doc_ids, tfs = postings.arrays()
+            if id_map is not None:
+                doc_ids = id_map[doc_ids]
+                live = doc_ids >= 0
+                doc_ids, tfs = doc_ids[live], tfs[live]
+            doc_id_columns.append(doc_ids)
+            tf_columns.append(tfs)
+        return PostingsList(np.concatenate(doc_id_columns).astype(np.uint32),
+                            np.concatenate(tf_columns).astype(np.uint32), self.external_ids)
+
+    def __contains__(self, term):
+        return term in self.term_ids
+
+    def __iter__(self):
+        return iter(self.term_ids)
+
+    def __len__(self):
+        return len(self.term_ids)
+
+
+class _SegmentDocumentTermCounts(DocumentTermCounts):
+    """
+    A document's row of a segment's forward index, looked up with the term ids of a MultiSegmentIndex.
+    """
+    __slots__ = ('term_map', 'segment_term_ids')
+
+    def __init__(self, row: DocumentTermCounts, term_map: np.ndarray, segment_term_ids: np.ndarray) -> None:
+        """
+        Args:
+            row: The row of the segment's forward index.
+            term_map: The view's term id of each of the segment's term ids.
+            segment_term_ids: The segment's term id of each of the view's term ids (-1 if it lacks the term).
+        """
+        super().__init__(row.forward_index, row.start, row.end)
+        self.term_map = term_map
+        self.segment_term_ids = segment_term_ids
+
+    def get(self, term, default=None):
+        term_id = self.forward_index.term_ids.get(term)
+        if term_id is None:
+            return default
+        return DocumentTermCounts.get_by_id(self, term_id, default)
+
+    def get_by_id(self, term_id: int, default=None):
+        if term_id >= len(self.segment_term_ids) or self.segment_term_ids[term_id] < 0:
+            return default
+        return DocumentTermCounts.get_by_id(self, int(self.segment_term_ids[term_id]), default)
+
+    def term_ids(self) -> np.ndarray:
+        return np.sort(self.term_map[DocumentTermCounts.term_ids(self)])
+
+    def __iter__(self):
+        terms = self.forward_index.terms
+        return (terms[term_id] for term_id in DocumentTermCounts.term_ids(self).tolist())
+
+
+class _SegmentedForwardIndex(Mapping):
+    """
+    Maps the external doc ids of a MultiSegmentIndex to their rows in the forward indexes of its segments.
+    """
+    def __init__(self, index: 'MultiSegmentIndex') -> None:
+        self.index = index
+
+    def row(self, internal_id: int) -> DocumentTermCounts:
+        """
+        Get the term frequencies of a document by its int doc id.
+        """
+        index = self.index
+        segment_number = int(index.doc_segments[internal_id])
+        row = index.segments[segment_number].doc_term_freqs.row(int(index.doc_local_ids[internal_id]))
+        return _SegmentDocumentTermCounts(row, index.term_maps[segment_number],
+                                          index.segment_term_ids[segment_number])
+
+    def __getitem__(self, doc_id):
+        return self.row(self.index.internal_ids[doc_id])
+
+    def __contains__(self, doc_id):
+        return doc_id in self.index.internal_ids
+
+    def __iter__(self):
+        return iter(self.index.internal_ids)
+
+    def __len__(self):
+        return len(self.index.internal_ids)
+
+
+class _SegmentedMetadata(Mapping):
+    """
+    Maps the external doc ids of a MultiSegmentIndex to their metadata in the segment that holds them.
+    """
+    def __init__(self, index: 'MultiSegmentIndex') -> None:
+        self.index = index
+
+    def __getitem__(self, doc_id):
+        internal_id = self.index.internal_ids[doc_id]
+        return self.index.segments[int(self.index.doc_segments[internal_id])].document_metadata[doc_id]
+
+    def __contains__(self, doc_id):
+        return doc_id in self.index.internal_ids
+
+    def __iter__(self):
+        return iter(self.index.internal_ids)
+
+    def __len__(self):
+        return len(self.index.internal_ids)
+
+
+class MultiSegmentIndex(InvertedIndex):
+    """
+    Read-only view of the live documents of several segments (see SegmentedIndex), which are queried in place
+    rather than merged: binary segments stay memory-mapped and shared with the other processes that open them.
+
+    The live documents get consecutive int doc ids in segment order, and the terms get term ids in order of
+    first occurrence, as when the segments are merged (SegmentedIndex._merge_into_index), so queries rank
+    the documents the same way. A term's postings are read from every segment that has it, mapped to the
+    view's int doc ids and filtered of deleted documents. The document and collection frequencies are exact;
+    a term's max tf and min document length are those of the segments, deleted documents included, so they
+    remain valid (if looser) score upper bounds. The document-term matrix is built on first use.
+    """
+    def __init__(self, segments: list[InvertedIndex], deleted_doc_ids: list[set]) -> None:
+        """
+        Args:
+            segments: The segment indexes, oldest first.
+            deleted_doc_ids: For each segment, the doc ids deleted from it.
+        """
+        super().__init__(segments[0].postings_codec if segments else PostingsCodec.RAW)
+        self.segments = segments
+
+        # Live documents: the first copy of each doc id that is not deleted from its segment
+        segment_kept = []
+        for segment, deleted in zip(segments, deleted_doc_ids):
+            kept = np.zeros(len(segment.external_ids), dtype=bool)
+            for internal_id, doc_id in enumerate(segment.external_ids):
+                if doc_id not in deleted and doc_id not in self.internal_ids:
+                    kept[internal_id] = True
+                    self._intern_doc_id(doc_id)
+            segment_kept.append(kept)
+        doc_bases = np.cumsum([0] + [int(kept.sum()) for kept in segment_kept])
+        self.id_maps = [None if doc_base == 0 and kept.all() else np.where(kept, doc_base + np.cumsum(kept) - 1, -1)
+                        for kept, doc_base in zip(segment_kept, doc_bases)]
+        self.doc_segments = np.repeat(np.arange(len(segments), dtype=np.int64), np.diff(doc_bases))
+        self.doc_local_ids = np.concatenate([np.flatnonzero(kept) for kept in segment_kept] + [np.zeros(0, dtype=np.int64)])
+
+        # Term statistics of the live documents: the deleted documents' forward index rows are subtracted
+        segment_doc_freqs, segment_collection_freqs = [], []
+        for segment, kept in zip(segments, segment_kept):
+            doc_freqs = segment.get_document_frequencies()
+            collection_freqs = segment.get_collection_term_frequencies()
+            if not kept.all():
+                deleted_rows = segment.get_document_term_rows(np.flatnonzero(~kept))
+                doc_freqs = doc_freqs - np.bincount(deleted_rows.indices, minlength=len(doc_freqs))
+                collection_freqs = collection_freqs - np.bincount(
+                    deleted_rows.indices, weights=deleted_rows.data, minlength=len(doc_freqs)).astype(np.int64)
+            segment_doc_freqs.append(doc_freqs)
+            segment_collection_freqs.append(collection_freqs)
+
+        # Union of the segments' vocabularies, leaving out the terms of deleted documents only
+        self.term_maps = []
+        for segment, doc_freqs in zip(segments, segment_doc_freqs):
+            term_map = np.full(len(segment.terms), -1, dtype=np.int64)
+            live_terms = np.flatnonzero(doc_freqs > 0)
+            terms = segment.terms
+            term_map[live_terms] = [self.vocabulary.add(terms[term_id]) for term_id in live_terms.tolist()]
+            self.term_maps.append(term_map)
+        number_of_terms = len(self.terms)
+        self.segment_term_ids = []
+        term_doc_freqs = np.zeros(number_of_terms, dtype=np.int64)
+        term_collection_freqs = np.zeros(number_of_terms, dtype=np.int64)
+        term_max_tfs = np.zeros(number_of_terms, dtype=np.uint32)
+        term_min_doc_lengths = np.full(number_of_terms, NO_DOC_LENGTH, dtype=np.uint32)
+        for segment, term_map, doc_freqs, collection_freqs in zip(segments, self.term_maps, segment_doc_freqs,
+                                                                 segment_collection_freqs):
+            live_terms = np.flatnonzero(term_map >= 0)
+            view_term_ids = term_map[live_terms]
+            segment_term_ids = np.full(number_of_terms, -1, dtype=np.int64)
+            segment_term_ids[view_term_ids] = live_terms
+            self.segment_term_ids.append(segment_term_ids)
+            term_doc_freqs[view_term_ids] += doc_freqs[live_terms]
+            term_collection_freqs[view_term_ids] += collection_freqs[live_terms]
+            term_max_tfs[view_term_ids] = np.maximum(term_max_tfs[view_term_ids],
+                                                     np.asarray(segment.term_max_tfs, dtype=np.uint32)[live_terms])
+            term_min_doc_lengths[view_term_ids] = np.minimum(
+                term_min_doc_lengths[view_term_ids], np.asarray(segment.term_min_doc_lengths, dtype=np.uint32)[live_terms])
+        self.term_doc_freqs = term_doc_freqs.astype(np.uint32)
+        self.term_collection_freqs = term_collection_freqs.astype(np.uint64)
+        self.term_max_tfs = term_max_tfs
+        self.term_min_doc_lengths = term_min_doc_lengths
+
+        # The per-document columns are small, so the live documents' values are copied
+        document_lengths = np.concatenate([segment.get_document_length_array()[kept].astype(np.uint32)
+                                           for segment, kept in zip(segments, segment_kept)] + [np.zeros(0, dtype=np.uint32)])
+        self.document_lengths = _DocumentArrayMapping(self.internal_ids, document_lengths)
+        self.document_norms = np.concatenate([segment.get_document_norm_array()[kept]
+                                              for segment, kept in zip(segments, segment_kept)] + [np.zeros(0)])
+        self.total_token_count = int(document_lengths.sum(dtype=np.uint64))
+        self.total_documents = len(self.external_ids)
+
+        self.index = _SegmentedPostings(self.term_ids, segments, self.id_maps, self.external_ids)
+        self.doc_term_freqs = _SegmentedForwardIndex(self)
+        self.document_metadata = _SegmentedMetadata(self)
+        self.document_term_matrix = None
+        if segments:
+            self.normalizer_config = segments[0].normalizer_config
+            self.tokenizer_config = segments[0].tokenizer_config
+        self.is_memory_mapped = True
+
+    def get_document_term_matrix(self) -> csr_matrix:
+        """
+        Get the forward index as a SciPy CSR matrix (see InvertedIndex.get_document_term_matrix).
+        It is assembled from the segments' rows the first time, and kept.
+        """
+        if self.document_term_matrix is None:
+            self.document_term_matrix = self.get_document_term_rows(np.arange(self.total_documents))
+        return self.document_term_matrix
+
+    def get_document_term_rows(self, internal_ids: np.ndarray) -> csr_matrix:
+        """
+        Get the rows of the document-term matrix for some documents (see InvertedIndex.get_document_term_rows),
+        reading each document's row from its segment.
+        """
+        internal_ids = np.asarray(internal_ids, dtype=np.int64)
+        doc_segments = self.doc_segments[internal_ids]
+        parts, positions = [], []
+        for segment_number in np.unique(doc_segments).tolist():
+            selected = np.flatnonzero(doc_segments == segment_number)
+            rows = self.segments[segment_number].get_document_term_rows(self.doc_local_ids[internal_ids[selected]])
+            parts.append(csr_matrix((rows.data, self.term_maps[segment_number][rows.indices], rows.indptr),
+                                    shape=(len(selected), len(self.terms))))
+            positions.append(selected)
+        if not parts:
+            return csr_matrix((0, len(self.terms)))
+
+        # Put the rows back in the given order, with each row's term ids sorted
+        order = np.empty(len(internal_ids), dtype=np.int64)
+        order[np.concatenate(positions)] = np.arange(len(internal_ids))
+        matrix = vstack(parts, format='csr')[order]
+        matrix.sort_indices()
+        return matrix
+
+    def get_fingerprint(self) -> str:
+        """
+        Get a hash of the view's documents, vocabulary and statistics (see InvertedIndex.get_fingerprint).
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps([self.external_ids, self.terms, self.normalizer_config,
+                                  self.tokenizer_config]).encode('utf-8'))
+        for column in (self.document_lengths.values_array, self.term_doc_freqs, self.term_collection_freqs):
+            digest.update(np.ascontiguousarray(column).tobytes())
+        for segment, id_map in zip(self.segments, self.id_maps):
+            digest.update(np.ascontiguousarray(_as_numpy(segment.doc_term_freqs.tfs)).tobytes())
+            if id_map is not None:
+                digest.update(np.ascontiguousarray(id_map).tobytes())
+        return digest.hexdigest()
+
+    def save_binary(self, index_directory: str, codec: PostingsCodec = None) -> None:
+        self._ensure_writable()
+
+    def save_json(self, index_directory: str) -> None:
+        self._ensure_writable()
+
+    def _ensure_writable(self) -> None:
+        raise ValueError("A MultiSegmentIndex is read-only: add or delete documents with SegmentedIndex, "
+                         "and merge its segments into one with SegmentedIndex.force_merge.")
+
+
+class SegmentedIndex:
+    """
+    An index directory that is updated incrementally rather than rebuilt.
+
+    Documents are added as new immutable binary segments and deleted by recording tombstones, and each
+    change publishes a new generation: a manifest listing the segments and the doc ids deleted from each.
+    The current generation number is replaced atomically, so readers always load a complete generation.
+    A merge policy (maybe_merge) rewrites segments with many deleted documents and merges the newest segments
+    when there are too many; the writer applies it after each update (see Indexer.update_indexes), since
+    readers may only have read access to the directory. Writers in any process are serialized with a lock file.
+
+    Loading a generation of several segments (or with deletions) opens each segment as it is and queries
+    them in place through a MultiSegmentIndex, so a reload after a small update only opens the new segment's
+    files on top of the memory-mapped ones the other processes already share. Merging everything into one
+    segment (force_merge) makes the next load a plain one again.
+
+    A reader holds a shared lock on the manifest of the generation it loads (see _GenerationPin), and the
+    writer keeps the files of the generations that are locked. Every file of a segment is opened while it
+    is loaded, so once loaded, a generation stays readable after its files are removed.
+
+    Layout:
+        the index the directory was created with (JSON or binary), if any: the first segment, named '.'
+        segments/segment_<n>/: segments written by add_documents and by merges
+        generations/generation_<n>.json: the manifest of generation n
+        generations/CURRENT: the number of the current generation
+    """
+    def __init__(self, index_directory: str, max_segments: int = 8, max_deleted_ratio: float = 0.2,
+                 postings_codec: PostingsCodec = None) -> None:
+        """
+        Args:
+            index_directory: The index directory.
+            max_segments: The number of segments above which the newest segments are merged.
+            max_deleted_ratio: The fraction of deleted documents above which a segment is rewritten.
+            postings_codec: The postings codec of the segments written from now on; by default the codec of
+                the first segment (RAW without segments).
+        """
+        self.index_directory = index_directory
+        self.generations_directory = os.path.join(index_directory, GENERATIONS_DIRECTORY)
+        self.max_segments = max_segments
+        self.max_deleted_ratio = max_deleted_ratio
+        self.postings_codec = postings_codec
+
+    @staticmethod
+    def is_segmented(index_directory: str) -> bool:
+        """
+        Check whether an index directory has been updated incrementally.
+        """
+        return os.path.exists(os.path.join(index_directory, GENERATIONS_DIRECTORY, CURRENT_GENERATION_FILE))
+
+    def current_generation(self) -> int:
+        """
+        Get the number of the current generation; 0 is the index the directory was created with.
+        """
+        try:
+            with open(os.path.join(self.generations_directory, CURRENT_GENERATION_FILE), 'r', encoding='utf-8') as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return 0
+
+    def read_manifest(self, generation: int = None) -> dict:
+        """
+        Get the manifest of a generation (by default the current one): its segments, each with a path
+        relative to the index directory, a number of documents and a list of deleted doc ids.
+        """
+        if generation is None:
+            generation = self.current_generation()
+        if generation > 0:
+            with open(os.path.join(self.generations_directory, f'generation_{generation}.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        # Generation 0: the index the directory was created with, if there is one
+        segments = []
+        if os.path.exists(os.path.join(self.index_directory, BINARY_META_FILE)) or \
+                os.path.exists(os.path.join(self.index_directory, 'doc_lengths.json')):
+            segments.append({'path': '.', 'number_of_documents': len(self._segment_doc_ids('.')), 'deleted': []})
+        return {'generation': 0, 'next_segment': 0, 'segments': segments}
+
+    def load(self) -> InvertedIndex:
+        """
+        Load the current generation as one index without its deleted documents. A generation with a single
+        segment and no deletions is loaded as that segment; otherwise the segments are loaded (memory-mapped,
+        if binary) and queried in place through a MultiSegmentIndex, which leaves out the deleted documents.
+        """
+        manifest, pin = self._pin_current_generation()
+        try:
+            segments = manifest['segments']
+            if len(segments) == 1 and not segments[0]['deleted']:
+                index = InvertedIndex()
+                index.load(os.path.join(self.index_directory, segments[0]['path']))
+                return index
+            segment_indexes = []
+            for segment in segments:
+                segment_index = InvertedIndex()
+                segment_index.load(os.path.join(self.index_directory, segment['path']))
+                segment_indexes.append(segment_index)
+            return MultiSegmentIndex(segment_indexes, [set(segment['deleted']) for segment in segments])
+        finally:
+            if pin is not None:
+                pin.release()
+
+    def normalizer_config(self, generation: int = None) -> dict:
+        """
+        Get the configuration of the token normalizer the segments of a generation (by default the
+        current one) were built with, or None if they were built without one or there are no segments.
+        """
+        return self._segment_config(NORMALIZER_FILE, generation)
+
+    def tokenizer_config(self, generation: int = None) -> dict:
+        """
+        Get the settings of the tokenizer the segments of a generation (by default the current one) were
+        built with, or None if they were not recorded or there are no segments.
+        """
+        return self._segment_config(TOKENIZER_FILE, generation)
+
+    def segment_postings_codec(self, generation: int = None) -> PostingsCodec:
+        """
+        Get the postings codec of the first segment of a generation (by default the current one),
+        or None without segments.
+        """
+        segments = self.read_manifest(generation)['segments']
+        if not segments:
+            return None
+        meta_path = os.path.join(self.index_directory, segments[0]['path'], BINARY_META_FILE)
+        if not os.path.exists(meta_path):
+            return PostingsCodec.RAW
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return PostingsCodec(json.load(f).get('postings_codec', PostingsCodec.RAW.value))
+
+    def _segment_config(self, file_name: str, generation: int = None) -> dict:
+        """
+        Get a configuration recorded with the first segment of a generation, or None without segments.
+        """
+        segments = self.read_manifest(generation)['segments']
+        if not segments:
+            return None
+        return _load_config(os.path.join(self.index_directory, segments[0]['path']), file_name)
+
+    def add_documents(self, documents: list[tuple[str, list[str], dict]], normalizer_config: dict = None,
+                      tokenizer_config: dict = None) -> int:
+        """
+        Add documents as a new segment. Documents that are already indexed are replaced:
+        their older copies are deleted.
+
+        Args:
+            documents: A list of (doc id, tokens, metadata) tuples.
+            normalizer_config: The configuration of the token normalizer the tokens come from, which must be
+                the one the existing segments were built with.
+            tokenizer_config: The settings of the tokenizer the tokens come from, which must be the ones
+                the existing segments were built with, if they recorded them.
+
+        Returns:
+            The number of the new generation.
+        """
+        segment_index = InvertedIndex()
+        segment_index.normalizer_config = normalizer_config
+        segment_index.tokenizer_config = tokenizer_config
+        for doc_id, tokens, metadata in documents:
+            segment_index.add_document(doc_id, tokens, metadata)
+
+        with self._lock():
+            manifest = self.read_manifest()
+            if manifest['segments'] and self.normalizer_config(manifest['generation']) != normalizer_config:
+                raise ValueError(f"The documents were not normalized like the index in {self.index_directory}; "
+                                 f"tokenize them with the normalizer it records (see Indexer.load_normalizer_config).")
+            if manifest['segments'] and self.tokenizer_config(manifest['generation']) not in (None, tokenizer_config):
+                raise ValueError(f"The documents were not tokenized like the index in {self.index_directory}; "
+                                 f"tokenize them with the settings it records (see Indexer.load_tokenizer_config).")
+            self._delete_from_segments(manifest['segments'], set(segment_index.external_ids))
+            segment = self._write_segment(manifest, segment_index)
+            manifest['segments'].append(segment)
+            return self._publish(manifest)
+
+    def delete_documents(self, doc_ids: list[str]) -> int:
+        """
+        Delete documents by recording tombstones in the segments that hold them.
+
+        Returns:
+            The number of the new generation.
+        """
+        with self._lock():
+            manifest = self.read_manifest()
+            self._delete_from_segments(manifest['segments'], set(doc_ids))
+            return self._publish(manifest)
+
+    def maybe_merge(self) -> bool:
+        """
+        Apply the merge policy: rewrite each segment whose fraction of deleted documents is above
+        max_deleted_ratio, then merge the newest segments into one if there are more than max_segments.
+
+        Returns:
+            Whether a new generation was published.
+        """
+        with self._lock():
+            manifest = self.read_manifest()
+            segments = []
+            merged = False
+            for segment in manifest['segments']:
+                if len(segment['deleted']) > self.max_deleted_ratio * max(segment['number_of_documents'], 1):
+                    segments.extend(self._merged_segments(manifest, [segment]))
+                    merged = True
+                else:
+                    segments.append(segment)
+            if len(segments) > self.max_segments:
+                segments[self.max_segments - 1:] = self._merged_segments(manifest, segments[self.max_segments - 1:])
+                merged = True
+            if merged:
+                manifest['segments'] = segments
+                self._publish(manifest)
+            return merged
+
+    def force_merge(self) -> int:
+        """
+        Merge all the segments into one without the deleted documents.
+
+        Returns:
+            The number of the new generation.
+        """
+        with self._lock():
+            manifest = self.read_manifest()
+            manifest['segments'] = self._merged_segments(manifest, manifest['segments'])
+            return self._publish(manifest)
+
+    def _pin_current_generation(self) -> tuple[dict, '_GenerationPin']:
+        """
+        Get the manifest of the current generation, pinned so that the writer keeps its files until the pin
+        is released. The generation may be replaced between reading its number and pinning it, in which case
+        the new current generation is pinned instead.
+
+        Returns:
+            The manifest and its pin (None for generation 0, whose files are never removed).
+        """
+        while True:
+            generation = self.current_generation()
+            if generation == 0:
+                return self.read_manifest(0), None
+            manifest_path = os.path.join(self.generations_directory, f'generation_{generation}.json')
+            pin = _GenerationPin(manifest_path)
+            if pin.acquire():
+                return pin.read_manifest(), pin
+            if self.current_generation() == generation:
+                raise FileNotFoundError(f"The manifest of the current generation is missing: {manifest_path}")
+
+    def _lock(self):
+        """
+        Get a context manager holding the writer lock of the index directory.
+        """
+        os.makedirs(self.generations_directory, exist_ok=True)
+        return _FileLock(os.path.join(self.generations_directory, 'LOCK'))
+
+    def _segment_doc_ids(self, path: str) -> list[str]:
+        """
+        Get the doc ids of a segment, in int doc id order.
+        """
+        segment_directory = os.path.join(self.index_directory, path)
+        if os.path.exists(os.path.join(segment_directory, BINARY_META_FILE)):
+            with open(os.path.join(segment_directory, 'docids.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        with open(os.path.join(segment_directory, 'doc_lengths.json'), 'r', encoding='utf-8') as f:
+            return list(json.load(f))
+
+    def _delete_from_segments(self, segments: list[dict], doc_ids: set) -> None:
+        """
+        Record the given doc ids as deleted in the segments that hold them.
+        """
+        if not doc_ids:
+            return
+        for segment in segments:
+            deleted = set(segment['deleted'])
+            segment['deleted'] = segment['deleted'] + [doc_id for doc_id in self._segment_doc_ids(segment['path'])
+                                                       if doc_id in doc_ids and doc_id not in deleted]
+
+    def _write_segment(self, manifest: dict, segment_index: InvertedIndex) -> dict:
+        """
+        Save an index as the next segment, with the postings codec of the segmented index, and get its
+        manifest entry.
+        """
+        codec = self.postings_codec or self.segment_postings_codec(manifest['generation']) or PostingsCodec.RAW
+        path = os.path.join(SEGMENTS_DIRECTORY, f"segment_{manifest['next_segment']:06d}")
+        manifest['next_segment'] += 1
+        segment_index.save_binary(os.path.join(self.index_directory, path), codec)
+        return {'path': path, 'number_of_documents': segment_index.total_documents, 'deleted': []}
+
+    def _merge_into_index(self, segments: list[dict]) -> InvertedIndex:
+        """
+        Merge the live documents of segments into one in-memory index.
+        """
+        index = InvertedIndex()
+        for segment in segments:
+            segment_index = InvertedIndex()
+            segment_index.load(os.path.join(self.index_directory, segment['path']))
+            index.merge(segment_index, excluded_doc_ids=set(segment['deleted']))
+        return index
+
+    def _merged_segments(self, manifest: dict, segments: list[dict]) -> list[dict]:
+        """
+        Merge segments into a new segment without their deleted documents.
+
+        Returns:
+            The manifest entries replacing the segments: the new segment, or none if no document is left.
+        """
+        merged_index = self._merge_into_index(segments)
+        if merged_index.total_documents == 0:
+            return []
+        return [self._write_segment(manifest, merged_index)]
+
+    def _publish(self, manifest: dict) -> int:
+        """
+        Write a manifest as the next generation, make it current, and remove the older generations that no
+        reader has pinned, then the segments that neither the new generation nor a pinned one uses.
+        """
+        generation = self.current_generation() + 1
+        manifest['generation'] = generation
+        os.makedirs(self.generations_directory, exist_ok=True)
+        _write_atomically(os.path.join(self.generations_directory, f'generation_{generation}.json'),
+                          json.dumps(manifest))
+        _write_atomically(os.path.join(self.generations_directory, CURRENT_GENERATION_FILE), str(generation))
+
+        in_use = {segment['path'] for segment in manifest['segments']}
+        for old_generation in range(1, generation):
+            old_manifest = os.path.join(self.generations_directory, f'generation_{old_generation}.json')
+            if os.path.exists(old_manifest) and not _remove_unless_locked(old_manifest):
+                # A reader is loading this generation
+                in_use.update(segment['path'] for segment in self.read_manifest(old_generation)['segments'])
+        segments_directory = os.path.join(self.index_directory, SEGMENTS_DIRECTORY)
+        if os.path.isdir(segments_directory):
+            for name in os.listdir(segments_directory):
+                if os.path.join(SEGMENTS_DIRECTORY, name) not in in_use:
+                    shutil.rmtree(os.path.join(segments_directory, name), ignore_errors=True)
+        return generation
+
+
+class _FileLock:
+    """
+    Exclusive advisory lock on a file, held for the duration of a with block.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class _GenerationPin:
+    """
+    Shared lock on the manifest of a generation, held by a reader while it loads the generation so that
+    the writer keeps its files (see SegmentedIndex._publish). The manifest is only opened for reading,
+    so readers can pin generations of an index directory they cannot write to.
+    """
+    def __init__(self, manifest_path: str) -> None:
+        self.manifest_path = manifest_path
+        self.file = None
+
+    def acquire(self) -> bool:
+        """
+        Lock the manifest.
+
+        Returns:
+            Whether the generation is pinned: False if the writer removed its manifest, before or while
+            this was waiting for the lock.
+        """
+        try:
+            self.file = open(self.manifest_path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return False
+        fcntl.flock(self.file, fcntl.LOCK_SH)
+        if os.fstat(self.file.fileno()).st_nlink == 0:
+            self.release()
+            return False
+        return True
+
+    def read_manifest(self) -> dict:
+        """
+        Read the pinned manifest.
+        """
+        self.file.seek(0)
+        return json.load(self.file)
+
+    def release(self) -> None:
+        """
+        Unlock the manifest, letting the writer remove the generation once it is no longer current.
+        """
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+
+def _write_atomically(path: str, content: str) -> None:
+    """
+    Write a file through a temporary file and an atomic rename, so that readers never see a partial file.
+    """
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def _remove_unless_locked(path: str) -> bool:
+    """
+    Remove a file unless a lock is held on it, e.g. a generation's manifest pinned by a reader.
+    The file is removed while holding an exclusive lock, so a reader waiting to pin it sees it removed.
+    Returns whether the file is gone.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            os.remove(path)
+            return True
+    except FileNotFoundError:
+        return True
+
+
+def _detect_encoding(dataset_path: str) -> str:
+    """
+    Detect the encoding of a dataset file from its first bytes.
+    """
+    with open(dataset_path, 'rb') as ef:
+        raw_data = ef.read(100000)
+        result = chardet.detect(raw_data)
+        encoding = result['encoding']
+        confidence = result['confidence']
+        print(f"Detected encoding: {encoding} with confidence {confidence}")
+    return encoding
+
+
+def _read_chunks(dataset_path: str, encoding: str, chunk_size: int, max_docs: int):
+    """
+    Stream a JSONL dataset as chunks of lines of about chunk_size characters.
+
+    Yields:
+        Tuples of (line number of the first line, list of lines).
+    """
+    with open(dataset_path, 'r', encoding=encoding, errors='replace') as f:
+        first_line_num, lines, size = 0, [], 0
+        for line_num, line in enumerate(f):
+            if 0 < max_docs <= line_num:
+                break
+            lines.append(line)
+            size += len(line)
+            if size >= chunk_size:
+                yield first_line_num, lines
+                first_line_num, lines, size = line_num + 1, [], 0
+        if lines:
+            yield first_line_num, lines
+
+
+def _index_lines(indexes: dict, fields: dict, lines: list[str], first_line_num: int,
+                 tokenizer: Tokenizer, id_key: str) -> None:
+    """
+    Parse JSONL lines and add each document to the index of every field.
+
+    Args:
+        indexes: A dictionary mapping each field name to the InvertedIndex to add the documents to.
+        fields: A dictionary mapping each field name to the document keys whose text it indexes.
+        lines: The lines to index.
+        first_line_num: The line number of the first line, for messages.
+        tokenizer: The tokenizer to use.
+        id_key: The document key holding the doc id.
+    """
+    docs = []
+    for line_num, line in enumerate(lines, first_line_num):
+        try:
+            doc = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON on line {line_num}: {e}")
+            continue
+
+        doc_id = doc.get(id_key)
+        if doc_id is None:
+            print(f"Document missing '{id_key}' on line {line_num}. Skipping.")
+            continue
+
+        if line_num % 1000 == 0:
+            print(f"Processing document {line_num}...")
+        docs.append((doc_id, doc))
+
+    for field, text_keys in fields.items():
+        # Combine text from specified keys, and tokenize the texts of the chunk as a batch
+        texts = [' '.join(str(doc.get(key, "")) for key in text_keys) for _, doc in docs]
+        for (doc_id, doc), text, tokens in zip(docs, texts, tokenizer.tokenize_many(texts)):
+            # Collect metadata
+            doc_metadata = {
+                'title': doc.get('title', 'No Title'),
+                'text': text,
+                'url': doc.get('link', '#')
+            }
+
+            indexes[field].add_document(doc_id, tokens, metadata=doc_metadata)
+
+
+class _DocumentBatch(list):
+    """
+    Collects the (doc id, tokens, metadata) tuples passed to add_document, e.g. for SegmentedIndex.add_documents.
+    """
+    def add_document(self, doc_id: str, tokens: list[str], metadata: dict) -> None:
+        self.append((doc_id, tokens, metadata))
+
+
+def _index_chunk(fields: dict, lines: list[str], first_line_num: int,
+                 tokenizer: Tokenizer, id_key: str) -> dict:
+    """
+    Build partial indexes of a chunk of lines in a worker process (see _index_lines).
+    """
+    indexes = {field: InvertedIndex() for field in fields}
+    _index_lines(indexes, fields, lines, first_line_num, tokenizer, id_key)
+    return indexes
+
+
+class Indexer:
+    @classmethod
+    def create_index(cls, index_type: IndexType, dataset_path: str,
+                     tokenizer: Tokenizer, text_keys: list[str] = ["text"],
+                     id_key: str = "id", max_docs: int = -1, num_workers: int = 1,
+                     memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB,
+                     postings_codec: PostingsCodec = PostingsCodec.RAW) -> InvertedIndex:
+        """
+        Build an index of the given keys of a JSONL dataset (see create_indexes).
+        """
+        return cls.create_indexes(index_type, dataset_path, tokenizer, {'index': text_keys}, id_key,
+                                  max_docs, num_workers, memory_budget_mb, postings_codec)['index']
+
+    @classmethod
+    def create_indexes(cls, index_type: IndexType, dataset_path: str, tokenizer: Tokenizer,
+                       fields: dict[str, list[str]], id_key: str = "id", max_docs: int = -1,
+                       num_workers: int = 1, memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB,
+                       postings_codec: PostingsCodec = PostingsCodec.RAW) -> dict[str, InvertedIndex]:
+        """
+        Build an index for each of several fields (e.g. text and title) in one streaming pass over a JSONL dataset.
+
+        With more than one worker, a process pool tokenizes chunks of lines into partial indexes, which are
+        merged in input order, so the indexes are the same as with a single process. The memory budget
+        bounds the size of the chunks and the number of chunks in flight.
+
+        Args:
+            index_type: The type of index to build.
+            dataset_path: Path to the JSONL dataset.
+            tokenizer: The tokenizer to use.
+            fields: A dictionary mapping each index name to the document keys whose text it indexes,
+                e.g. {'text': ['text'], 'title': ['title']}.
+            id_key: The document key holding the doc id.
+            max_docs: The number of lines to read, or -1 for all of them.
+            num_workers: The number of worker processes; 1 builds in this process.
+            memory_budget_mb: Approximate memory to use for the text and partial indexes in flight.
+            postings_codec: The codec of the indexes' postings: they are compressed in memory as they are
+                built, and saved with it (the partial indexes of the workers are not compressed).
+
+        Returns:
+            A dictionary mapping each index name to its InvertedIndex.
+        """
+        if index_type != IndexType.BASIC:
+            raise ValueError("Unsupported index type.")
+
+        encoding = _detect_encoding(dataset_path)
+        indexes = {field: InvertedIndex(postings_codec) for field in fields}
+        for index in indexes.values():
+            index.normalizer_config = tokenizer.normalizer_config
+            index.tokenizer_config = tokenizer.tokenizer_config
+
+        # Keep at most two chunks per worker in flight, each with its partial indexes
+        max_in_flight = 2 * max(num_workers, 1)
+        chunk_size = max(1, memory_budget_mb * 1024 * 1024 // (max_in_flight * PARTIAL_INDEX_SIZE_FACTOR))
+        chunks = _read_chunks(dataset_path, encoding, chunk_size, max_docs)
+
+        if num_workers <= 1:
+            for first_line_num, lines in chunks:
+                _index_lines(indexes, fields, lines, first_line_num, tokenizer, id_key)
+            return indexes
+
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            pending = deque()
+            for first_line_num, lines in chunks:
+                pending.append(executor.submit(_index_chunk, fields, lines, first_line_num, tokenizer, id_key))
+                while len(pending) >= max_in_flight or (pending and pending[0].done()):
+                    for field, partial_index in pending.popleft().result().items():
+                        indexes[field].merge(partial_index)
+            while pending:
+                for field, partial_index in pending.popleft().result().items():
+                    indexes[field].merge(partial_index)
+        return indexes
+
+    @classmethod
+    def create_index_on_disk(cls, index_type: IndexType, dataset_path: str, tokenizer: Tokenizer,
+                             index_directory: str, text_keys: list[str] = ["text"], id_key: str = "id",
+                             max_docs: int = -1, memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB,
+                             postings_codec: PostingsCodec = PostingsCodec.RAW) -> InvertedIndex:
+        """
+        Build a binary index of the given keys of a JSONL dataset in external memory (see create_indexes_on_disk).
+        """
+        return cls.create_indexes_on_disk(index_type, dataset_path, tokenizer, {'index': text_keys},
+                                          {'index': index_directory}, id_key, max_docs, memory_budget_mb,
+                                          postings_codec)['index']
+
+    @classmethod
+    def create_indexes_on_disk(cls, index_type: IndexType, dataset_path: str, tokenizer: Tokenizer,
+                               fields: dict[str, list[str]], index_directories: dict[str, str], id_key: str = "id",
+                               max_docs: int = -1, memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB,
+                               postings_codec: PostingsCodec = PostingsCodec.RAW) -> dict[str, InvertedIndex]:
+        """
+        Build a binary index for each of several fields in one streaming pass over a JSONL dataset, with
+        SpimiIndexWriter, so that corpora larger than memory can be indexed within a bounded memory budget.
+
+        Args:
+            index_type: The type of index to build.
+            dataset_path: Path to the JSONL dataset.
+            tokenizer: The tokenizer to use.
+            fields: A dictionary mapping each index name to the document keys whose text it indexes.
+            index_directories: A dictionary mapping each index name to the directory to write it to.
+            id_key: The document key holding the doc id.
+            max_docs: The number of lines to read, or -1 for all of them.
+            memory_budget_mb: Approximate memory to use; the text being read gets an eighth of it
+                and the index writers share the rest.
+            postings_codec: The codec of the indexes' postings (see SpimiIndexWriter).
+
+        Returns:
+            A dictionary mapping each index name to its InvertedIndex, memory-mapped from disk.
+        """
+        if index_type != IndexType.BASIC:
+            raise ValueError("Unsupported index type.")
+
+        encoding = _detect_encoding(dataset_path)
+        writer_budget_mb = max(1, memory_budget_mb * 7 // (8 * len(fields)))
+        writers = {field: SpimiIndexWriter(index_directories[field], writer_budget_mb, tokenizer.normalizer_config,
+                                           tokenizer.tokenizer_config, postings_codec)
+                   for field in fields}
+        chunk_size = max(1, memory_budget_mb * 1024 * 1024 // 8)
+        for first_line_num, lines in _read_chunks(dataset_path, encoding, chunk_size, max_docs):
+            _index_lines(writers, fields, lines, first_line_num, tokenizer, id_key)
+        return {field: writer.close() for field, writer in writers.items()}
+
+    @classmethod
+    def update_indexes(cls, dataset_path: str, tokenizer: Tokenizer, fields: dict[str, list[str]],
+                       index_directories: dict[str, str], id_key: str = "id",
+                       deleted_doc_ids: list[str] = (), postings_codec: PostingsCodec = None) -> dict[str, int]:
+        """
+        Incrementally update indexes with the documents of a JSONL dataset, e.g. new or re-scraped pages,
+        and delete documents, publishing a new generation of each index (see SegmentedIndex). The merge policy
+        is applied afterwards, so segments and tombstones do not pile up.
+
+        Args:
+            dataset_path: Path to the JSONL dataset of documents to add or replace.
+            tokenizer: The tokenizer to use.
+            fields: A dictionary mapping each index name to the document keys whose text it indexes.
+            index_directories: A dictionary mapping each index name to its directory.
+            id_key: The document key holding the doc id.
+            deleted_doc_ids: Doc ids to delete.
+            postings_codec: The postings codec of the new segments; by default the codec each index was built with.
+
+        Returns:
+            A dictionary mapping each index name to its new generation number.
+        """
+        batches = {field: _DocumentBatch() for field in fields}
+        encoding = _detect_encoding(dataset_path)
+        for first_line_num, lines in _read_chunks(dataset_path, encoding, DEFAULT_MEMORY_BUDGET_MB * 1024 * 1024, -1):
+            _index_lines(batches, fields, lines, first_line_num, tokenizer, id_key)
+
+        generations = {}
+        for field, batch in batches.items():
+            segmented_index = SegmentedIndex(index_directories[field], postings_codec=postings_codec)
+            if deleted_doc_ids:
+                segmented_index.delete_documents(list(deleted_doc_ids))
+            generations[field] = segmented_index.add_documents(batch, tokenizer.normalizer_config,
+                                                                  tokenizer.tokenizer_config)
+            if segmented_index.maybe_merge():
+                generations[field] = segmented_index.current_generation()
+        return generations
+
+
+    @classmethod
+    def load_index(cls, index_directory: str) -> InvertedIndex:
+        """
+        Load an existing index from the specified directory, including incremental updates
+        (the current generation of a SegmentedIndex).
+        """
+        if SegmentedIndex.is_segmented(index_directory):
+            return SegmentedIndex(index_directory).load()
+        index = InvertedIndex()
+        index.load(index_directory)
         return index
+
+    @classmethod
+    def load_normalizer_config(cls, index_directory: str) -> dict:
+        """
+        Get the configuration of the token normalizer an index was built with, without loading it,
+        e.g. to build the query tokenizer with TokenNormalizer.from_config.
+        """
+        if SegmentedIndex.is_segmented(index_directory):
+            return SegmentedIndex(index_directory).normalizer_config()
+        return _load_config(index_directory, NORMALIZER_FILE)
+
+    @classmethod
+    def load_tokenizer_config(cls, index_directory: str) -> dict:
+        """
+        Get the settings of the tokenizer an index was built with, without loading it,
+        e.g. to build the query tokenizer with RegexTokenizer.from_config.
+        """
+        if SegmentedIndex.is_segmented(index_directory):
+            return SegmentedIndex(index_directory).tokenizer_config()
+        return _load_config(index_directory, TOKENIZER_FILE)
+
+    @classmethod
+    def convert_index(cls, source_directory: str, target_directory: str,
+                      index_format: IndexFormat = IndexFormat.BINARY, codec: PostingsCodec = PostingsCodec.RAW) -> None:
+        """
+        Convert an index saved in any format into the given format, e.g. JSON to binary or back,
+        or a binary index to another postings codec.
+        """
+        index = cls.load_index(source_directory)
+        index.save(target_directory, index_format=index_format, codec=codec)
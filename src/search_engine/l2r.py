@@ -1,8 +1,53 @@
+import hashlib
+import json
 import math
+import multiprocessing
+import os
 import pandas as pd
 import numpy as np
 import lightgbm
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from types import MappingProxyType
+from indexing import DocumentTermCounts
+from ranker import QueryResultCache
+
+# Source of L2RRanker.model_version numbers, unique within the process
+_MODEL_VERSIONS = count()
+
+# Batches of fewer documents than this are predicted on a single thread: for a query's candidates,
+# starting LightGBM's thread pool costs more than evaluating the trees
+SINGLE_THREAD_PREDICT_ROWS = 5000
+
+# Missing value handling of LightGBM's numerical splits (the missing_type of a dumped split node)
+_MISSING_TYPES = {'None': 0, 'Zero': 1, 'NaN': 2}
+# LightGBM treats feature values this close to zero as zero
+_ZERO_THRESHOLD = 1e-35
+
+# Columns of L2RFeatureExtractor.static_features: the features that do not depend on the query
+STATIC_FEATURE_NAMES = ['article_length', 'title_length', 'pagerank', 'hub_score', 'authority_score',
+                        'hierarchy_level1', 'hierarchy_level2', 'hierarchy_level3', 'hierarchy_level4',
+                        'sibling_count']
+
+# The hierarchy vocabulary of the features a model was trained with is saved next to the model file,
+# in the model file's path with this suffix
+HIERARCHY_VOCABULARY_SUFFIX = '.hierarchy.json'
+
+# Number of features generated for each query-document pair (see L2RFeatureExtractor.generate_features)
+NUM_FEATURES = len(STATIC_FEATURE_NAMES) + 9
+
+# Bump whenever the features L2RFeatureExtractor generates change, so that featurized training sets
+# cached on disk are computed again
+FEATURE_EXTRACTOR_VERSION = 1
+
+# Fraction of the training queries held out to stop training early, and the number of boosting rounds
+# without improvement on them after which training stops
+DEFAULT_VALIDATION_FRACTION = 0.2
+DEFAULT_EARLY_STOPPING_ROUNDS = 10
+
+# Feature extractor of a training featurization worker process (see L2RRanker.prepare_training_data)
+_worker_feature_extractor = None
 
 class LambdaMART:
     def __init__(self, params=None) -> None:
@@ -29,8 +74,11 @@ class LambdaMART:
 
         # Initialize the LGBMRanker with the provided parameters
         self.model = lightgbm.LGBMRanker(**default_params)
+        # Optional NumPy evaluator of the trained trees (see use_tree_predictor)
+        self.tree_predictor = None
 
-    def fit(self, X_train, y_train, qgroups_train):
+    def fit(self, X_train, y_train, qgroups_train, X_validation=None, y_validation=None,
+            qgroups_validation=None, early_stopping_rounds=None):
         """
         Trains the LGBMRanker model.
 
@@ -38,11 +86,23 @@ class LambdaMART:
             X_train (array-like): Training input samples.
             y_train (array-like): Target values.
             qgroups_train (array-like): Query group sizes for training data.
+            X_validation (array-like, optional): Validation input samples, to stop training early.
+            y_validation (array-like, optional): Validation target values.
+            qgroups_validation (array-like, optional): Query group sizes for validation data.
+            early_stopping_rounds (int, optional): Stop when the validation NDCG has not improved
+                for this many rounds; the model then predicts with its best iteration.
 
         Returns:
             self: Returns the instance itself.
         """
-        self.model.fit(X_train, y_train, group=qgroups_train)
+        fit_params = {}
+        if X_validation is not None:
+            fit_params['eval_set'] = [(X_validation, y_validation)]
+            fit_params['eval_group'] = [qgroups_validation]
+            if early_stopping_rounds:
+                fit_params['callbacks'] = [lightgbm.early_stopping(early_stopping_rounds, verbose=False)]
+        self.model.fit(X_train, y_train, group=qgroups_train, **fit_params)
+        self.tree_predictor = None
         return self
 
     def predict(self, featurized_docs):
@@ -57,7 +117,121 @@ class LambdaMART:
         Returns:
             array-like: The estimated ranking for each document (unsorted)
         """
-        return self.model.predict(featurized_docs)
+        # LightGBM predicts from a contiguous float32 matrix without converting it
+        featurized_docs = np.ascontiguousarray(featurized_docs, dtype=np.float32)
+        if self.tree_predictor is not None:
+            return self.tree_predictor.predict(featurized_docs)
+        num_threads = 1 if len(featurized_docs) < SINGLE_THREAD_PREDICT_ROWS else 0
+        return self.model.predict(featurized_docs, num_threads=num_threads)
+
+    def get_booster(self):
+        """
+        Gets the trained lightgbm.Booster (the model is a Booster itself when it was loaded from a file).
+        """
+        if isinstance(self.model, lightgbm.Booster):
+            return self.model
+        return self.model.booster_
+
+    def use_tree_predictor(self, enabled=True):
+        """
+        Predicts with a NumPy evaluator of the trained trees instead of LightGBM, which is faster for
+        the small batches of a query's candidates. Call again after the model is retrained or reloaded.
+
+        Args:
+            enabled (bool): Whether to use the NumPy evaluator
+        """
+        self.tree_predictor = TreeEnsemblePredictor(self.get_booster()) if enabled else None
+
+class TreeEnsemblePredictor:
+    """
+    Evaluates the trees of a trained LightGBM model with NumPy. The trees are flattened into node arrays
+    and all documents descend all trees together, one level per step, so a prediction costs a few
+    vectorized operations per tree level instead of a call into LightGBM.
+    """
+    def __init__(self, booster) -> None:
+        """
+        Args:
+            booster: The trained lightgbm.Booster (numerical splits only)
+        """
+        model = booster.dump_model()
+        if model['num_tree_per_iteration'] != 1:
+            raise ValueError("Only models with one tree per iteration are supported.")
+        self.average_output = model.get('average_output', False)
+
+        # Flatten the trees breadth first into one list of nodes. The children of node i are at 2 * i
+        # (left) and 2 * i + 1 (right) of children; a leaf is its own left and right child, so documents
+        # that reached a leaf stay there while the others descend
+        nodes = [tree['tree_structure'] for tree in model['tree_info']]
+        depths = [0] * len(nodes)
+        children = []
+        for node_id, node in enumerate(nodes):
+            if 'leaf_value' in node:
+                children.extend([node_id, node_id])
+                continue
+            if node['decision_type'] != '<=':
+                raise ValueError("Categorical splits are not supported.")
+            children.extend([len(nodes), len(nodes) + 1])
+            nodes.extend([node['left_child'], node['right_child']])
+            depths.extend([depths[node_id] + 1] * 2)
+
+        is_leaf = ['leaf_value' in node for node in nodes]
+        self.roots = np.arange(len(model['tree_info']), dtype=np.int64)
+        self.max_depth = max(depths)
+        self.children = np.array(children, dtype=np.int64)
+        # Leaves test feature 0 against an arbitrary threshold: both outcomes lead back to the leaf
+        self.split_features = np.array([0 if leaf else node['split_feature'] for node, leaf in zip(nodes, is_leaf)],
+                                       dtype=np.int64)
+        self.thresholds = np.array([0.0 if leaf else node['threshold'] for node, leaf in zip(nodes, is_leaf)],
+                                   dtype=np.float64)
+        self.default_lefts = np.array([not leaf and node['default_left'] for node, leaf in zip(nodes, is_leaf)],
+                                      dtype=bool)
+        self.missing_types = np.array([0 if leaf else _MISSING_TYPES[node['missing_type']]
+                                       for node, leaf in zip(nodes, is_leaf)], dtype=np.int8)
+        # Without splits that send missing values a default way, NaN can be replaced by zero up front
+        self.has_missing_value_splits = bool(np.any(self.missing_types != _MISSING_TYPES['None']))
+        self.leaf_values = np.array([node['leaf_value'] if leaf else 0.0 for node, leaf in zip(nodes, is_leaf)],
+                                    dtype=np.float64)
+
+    def predict(self, X):
+        """
+        Predicts the raw scores (the sum of the trees' outputs) the way LightGBM does.
+
+        Args:
+            X (np.ndarray): The featurized documents, one row per document
+
+        Returns:
+            np.ndarray: The score of each document
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if not self.has_missing_value_splits:
+            X = np.where(np.isnan(X), 0.0, X)
+        # Position of each document's row in the flattened feature matrix
+        row_offsets = (np.arange(len(X)) * X.shape[1])[:, None]
+        X = X.ravel()
+        nodes = np.repeat(self.roots[None, :], len(row_offsets), axis=0)
+        for _ in range(self.max_depth):
+            values = X[row_offsets + self.split_features[nodes]]
+            if self.has_missing_value_splits:
+                go_right = self._go_right_with_missing_values(nodes, values)
+            else:
+                go_right = ~(values <= self.thresholds[nodes])
+            nodes = self.children[2 * nodes + go_right]
+        scores = self.leaf_values[nodes].sum(axis=1)
+        if self.average_output:
+            scores /= len(self.roots)
+        return scores
+
+    def _go_right_with_missing_values(self, nodes, values):
+        """
+        Whether the documents go right at their current nodes, handling missing values like LightGBM:
+        NaN is zero unless the split's missing values are NaN, and missing values go the default way.
+        """
+        missing_types = self.missing_types[nodes]
+        is_nan = np.isnan(values)
+        values = np.where(is_nan & (missing_types != _MISSING_TYPES['NaN']), 0.0, values)
+        is_missing = np.where(missing_types == _MISSING_TYPES['NaN'], is_nan,
+                              (missing_types == _MISSING_TYPES['Zero']) & (np.abs(values) <= _ZERO_THRESHOLD))
+        return np.where(is_missing, ~self.default_lefts[nodes], ~(values <= self.thresholds[nodes]))
 
 class L2RFeatureExtractor:
     def __init__(self, document_index, title_index,
@@ -68,11 +242,47 @@ class L2RFeatureExtractor:
         self.document_preprocessor = document_preprocessor
         self.stopwords = stopwords
         self.docid_to_network_features = docid_to_network_features or {}
-        self.hierarchy_mapping = {}
-        self.current_mapping = 0
         self.hierarchy_levels = ['level1', 'level2', 'level3', 'level4']
+        # Frozen (read-only) mapping of (hierarchy level, value) to integer codes, so that the encoding
+        # does not depend on the order documents are seen in and can be read from many threads without locks
+        self.hierarchy_mapping = self.build_hierarchy_mapping()
         self.sibling_counts = defaultdict(int)
         self.compute_sibling_counts()
+        # Query-independent features of every document, one row per int doc id of the document index
+        # (see STATIC_FEATURE_NAMES), and the index versions they were computed for. They are built on first
+        # use, so that loading a model's hierarchy vocabulary (load_hierarchy_mapping) does not build them twice
+        self.static_features = None
+        self.static_features_version = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # MappingProxyType cannot be pickled
+        state['hierarchy_mapping'] = dict(self.hierarchy_mapping)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.hierarchy_mapping = MappingProxyType(self.hierarchy_mapping)
+
+    def get_fingerprint(self):
+        """
+        Gets a hash of everything the features depend on besides the query: the feature extractor version,
+        the indexes, the stopwords, the hierarchy vocabulary and the network features.
+
+        Returns:
+            str: The hex digest of the hash
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps([
+            FEATURE_EXTRACTOR_VERSION,
+            self.document_index.get_fingerprint(),
+            self.title_index.get_fingerprint(),
+            sorted(self.stopwords or []),
+            sorted(self.hierarchy_mapping, key=self.hierarchy_mapping.get),
+            sorted(((str(docid), features) for docid, features in self.docid_to_network_features.items()),
+                   key=lambda item: item[0]),
+        ], sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
 
     def process_term(self, term):
         token = term.lower()
@@ -106,29 +316,70 @@ class L2RFeatureExtractor:
     def get_title_length(self, docid: int) -> int:
         return self.title_index.document_metadata[docid]['length']
 
-    def get_tf(self, index, docid, word_counts, query_parts):
-        tf = 0.0
+    def get_query_term_frequencies(self, index, word_counts, query_parts):
+        """
+        Looks up the processed query terms in an index's vocabulary and their frequencies in a document,
+        so that the term features work on int term ids instead of looking up every term for every feature.
+
+        Args:
+            index: The index the word counts come from
+            word_counts: The document's word counts in the index (a forward index row or a dict)
+            query_parts: A list of tokenized query terms
+
+        Returns:
+            tuple: The term id of each query term (None for stopwords and terms that are not in the index)
+                and its frequency in the document, in query order
+        """
+        vocabulary = index.vocabulary
+        is_forward_index_row = isinstance(word_counts, DocumentTermCounts)
+        term_ids, tfs = [], []
         for term in query_parts:
             processed_term = self.process_term(term)
-            if not processed_term:
-                continue
-            tf += math.log(word_counts.get(processed_term, 0) + 1)
-        return tf
+            term_id = vocabulary.get(processed_term) if processed_term else None
+            term_ids.append(term_id)
+            if term_id is None:
+                tfs.append(0)
+            elif is_forward_index_row:
+                tfs.append(word_counts.get_by_id(term_id, 0))
+            else:
+                tfs.append(word_counts.get(processed_term, 0))
+        return term_ids, tfs
+
+    def get_tf(self, index, docid, word_counts, query_parts):
+        _, tfs = self.get_query_term_frequencies(index, word_counts, query_parts)
+        return self._tf(tfs)
 
     def get_tf_idf(self, index, docid, word_counts, query_parts):
+        term_ids, tfs = self.get_query_term_frequencies(index, word_counts, query_parts)
+        return self._tf_idf(index, term_ids, tfs)
+
+    def get_BM25_score(self, docid, doc_word_counts, query_parts):
+        term_ids, tfs = self.get_query_term_frequencies(self.document_index, doc_word_counts, query_parts)
+        return self._BM25_score(docid, term_ids, tfs)
+
+    def get_pivoted_normalization_score(self, docid, doc_word_counts, query_parts):
+        term_ids, tfs = self.get_query_term_frequencies(self.document_index, doc_word_counts, query_parts)
+        return self._pivoted_normalization_score(docid, term_ids, tfs)
+
+    def _tf(self, tfs):
+        tf = 0.0
+        for f_td in tfs:
+            tf += math.log(f_td + 1)
+        return tf
+
+    def _tf_idf(self, index, term_ids, tfs):
         tf_idf = 0.0
         N = index.get_statistics()['number_of_documents']
-        for term in query_parts:
-            processed_term = self.process_term(term)
-            if not processed_term:
+        for term_id, f_td in zip(term_ids, tfs):
+            if term_id is None:
                 continue
-            tf = math.log(word_counts.get(processed_term, 0) + 1)
-            df = index.get_term_metadata(processed_term)['doc_frequency']
+            tf = math.log(f_td + 1)
+            df = int(index.term_doc_freqs[term_id])
             idf = math.log(N / (df + 1))
             tf_idf += tf * idf
         return tf_idf
 
-    def get_BM25_score(self, docid, doc_word_counts, query_parts):
+    def _BM25_score(self, docid, term_ids, tfs):
         bm25 = 0.0
         stats = self.document_index.get_statistics()
         N = stats['number_of_documents']
@@ -136,35 +387,31 @@ class L2RFeatureExtractor:
         doc_length = self.document_index.document_metadata[docid]['length']
         k1 = 1.2
         b = 0.75
-        for term in query_parts:
-            processed_term = self.process_term(term)
-            if not processed_term:
+        for term_id, f_td in zip(term_ids, tfs):
+            if term_id is None:
                 continue
-            df = self.document_index.get_term_metadata(processed_term)['doc_frequency']
+            df = int(self.document_index.term_doc_freqs[term_id])
             if df == 0:
                 continue
             idf = math.log((N - df + 0.5) / (df + 0.5))
-            f_td = doc_word_counts.get(processed_term, 0)
             tf = ((k1 + 1) * f_td) / (k1 * (1 - b + b * (doc_length / avgdl)) + f_td)
             bm25 += idf * tf
         return bm25
 
-    def get_pivoted_normalization_score(self, docid, doc_word_counts, query_parts):
+    def _pivoted_normalization_score(self, docid, term_ids, tfs):
         pn = 0.0
         stats = self.document_index.get_statistics()
         avgdl = stats['mean_document_length']
         N = stats['number_of_documents']
         doc_length = self.document_index.document_metadata[docid]['length']
 
-        for term in query_parts:
-            processed_term = self.process_term(term)
-            if not processed_term:
+        for term_id, f_td in zip(term_ids, tfs):
+            if term_id is None:
                 continue
-            df = self.document_index.get_term_metadata(processed_term)['doc_frequency']
+            df = int(self.document_index.term_doc_freqs[term_id])
             if df == 0:
                 continue
             qf = 1
-            f_td = doc_word_counts.get(processed_term, 0)
             if f_td <= 0:
                 continue
             norm_tf = (1 + math.log(1 + math.log(f_td))) / (1 - 0.2 + 0.2 * (doc_length / avgdl))
@@ -237,11 +484,8 @@ class L2RFeatureExtractor:
         for i, level in enumerate(levels):
             if i >= len(self.hierarchy_levels):
                 break
-            key = (self.hierarchy_levels[i], level)
-            if key not in self.hierarchy_mapping:
-                self.hierarchy_mapping[key] = self.current_mapping
-                self.current_mapping += 1
-            encoded_value = self.hierarchy_mapping[key]
+            # Levels that are not in the vocabulary (e.g. of documents added after it was built) are -1
+            encoded_value = self.hierarchy_mapping.get((self.hierarchy_levels[i], level), -1)
             encoded_hierarchy.append(encoded_value)
         
         # If some hierarchy levels are missing, pad with -1 
@@ -251,6 +495,48 @@ class L2RFeatureExtractor:
         return encoded_hierarchy
     
 
+    def build_hierarchy_mapping(self):
+        """
+        Builds the hierarchy vocabulary from the URLs of all the documents in the document index.
+        Codes are assigned in order of hierarchy level and then level value, so the same documents
+        always get the same codes.
+
+        Returns:
+            MappingProxyType: A read-only mapping of (hierarchy level, value) to its integer code
+        """
+        keys = set()
+        for doc_meta in self.document_index.document_metadata.values():
+            levels = self.parse_hierarchy_url(doc_meta['url'])
+            for i, level in enumerate(levels[:len(self.hierarchy_levels)]):
+                keys.add((i, level))
+        return MappingProxyType({(self.hierarchy_levels[i], level): code
+                                 for code, (i, level) in enumerate(sorted(keys))})
+
+    def save_hierarchy_mapping(self, file_path):
+        """
+        Saves the hierarchy vocabulary as a JSON list of [hierarchy level, value] pairs in code order.
+
+        Args:
+            file_path: The path of the file to write
+        """
+        keys = sorted(self.hierarchy_mapping, key=self.hierarchy_mapping.get)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump([list(key) for key in keys], f)
+
+    def load_hierarchy_mapping(self, file_path):
+        """
+        Replaces the hierarchy vocabulary with one saved by save_hierarchy_mapping (e.g. the one a model
+        was trained with); the static features are recomputed with it on next use.
+
+        Args:
+            file_path: The path of the file to read
+        """
+        with open(file_path, 'r', encoding='utf-8') as f:
+            keys = json.load(f)
+        self.hierarchy_mapping = MappingProxyType({tuple(key): code for code, key in enumerate(keys)})
+        self.static_features = None
+        self.static_features_version = None
+
     def compute_sibling_counts(self):
         """
         Computes the number of siblings for each hierarchy level.
@@ -274,6 +560,51 @@ class L2RFeatureExtractor:
         parent = '/'.join(levels[:-1]) if len(levels) > 1 else 'root'
         key = (parent, len(levels)-1)
         return self.sibling_counts.get(key, 0)
+
+    def build_static_features(self):
+        """
+        Computes the query-independent features of every document in the document index
+        (lengths, network features, hierarchy encoding and sibling count) into a matrix,
+        so that they are not recomputed for every query.
+
+        Returns:
+            np.ndarray: The static features, one row per int doc id and one column per STATIC_FEATURE_NAMES entry
+                Documents that are not in the title index have a NaN title length.
+        """
+        external_ids = self.document_index.external_ids
+        static_features = np.empty((len(external_ids), len(STATIC_FEATURE_NAMES)), dtype=np.float64)
+        for internal_id, docid in enumerate(external_ids):
+            title_length = self.get_title_length(docid) if docid in self.title_index.document_metadata else np.nan
+            static_features[internal_id, :5] = (
+                self.get_article_length(docid), title_length, self.get_pagerank_score(docid),
+                self.get_hits_hub_score(docid), self.get_hits_authority_score(docid))
+            static_features[internal_id, 5:9] = self.get_hierarchy_encoded(docid)
+            static_features[internal_id, 9] = self.get_sibling_count(docid)
+
+        self.static_features = static_features
+        self.static_features_version = (self.document_index.version, self.title_index.version)
+        return static_features
+
+    def get_static_features(self, docid):
+        """
+        Gets the query-independent features of a document, rebuilding the static feature matrix
+        first if documents were added to the indexes since it was built.
+
+        Args:
+            docid: The id of the document
+
+        Returns:
+            np.ndarray: The document's row of the static feature matrix (see STATIC_FEATURE_NAMES)
+        """
+        return self._current_static_features()[self.document_index.internal_ids[docid]]
+
+    def _current_static_features(self):
+        """
+        The static feature matrix, built first if it is missing or older than the indexes.
+        """
+        if self.static_features_version != (self.document_index.version, self.title_index.version):
+            return self.build_static_features()
+        return self.static_features
     
     def get_query_term_coverage(self, doc_word_counts, query_parts):
         """
@@ -293,12 +624,8 @@ class L2RFeatureExtractor:
         if total_unique_query_terms == 0:
             return 0.0  # Avoid division by zero
         
-        # Extract unique document terms
-        document_terms = set(doc_word_counts.keys())
-        
-        # Calculate coverage
-        covered_terms = unique_query_terms.intersection(document_terms)
-        coverage_count = len(covered_terms)
+        # Calculate coverage (forward index rows look terms up by term id, without building a set of the document's terms)
+        coverage_count = sum(1 for term in unique_query_terms if term in doc_word_counts)
         
         # Normalize coverage
         normalized_coverage = coverage_count / total_unique_query_terms
@@ -316,20 +643,19 @@ class L2RFeatureExtractor:
         Returns:
             float: Jaccard Similarity score between 0 and 1.
         """
-        # Convert lists of words to sets of unique terms
+        # Convert the list of words to a set of unique terms
         query_terms = set(query_parts)
-        document_terms = set(doc_word_counts.keys())
 
-        # Calculate intersection and union
-        intersection = query_terms.intersection(document_terms)
-        union = query_terms.union(document_terms)
+        # Calculate the sizes of the intersection and union (the document's terms are already unique)
+        intersection_size = sum(1 for term in query_terms if term in doc_word_counts)
+        union_size = len(query_terms) + len(doc_word_counts) - intersection_size
 
         # Handle division by zero
-        if not union:
+        if union_size == 0:
             return 0.0
 
         # Compute Jaccard Similarity
-        jaccard_similarity = len(intersection) / len(union)
+        jaccard_similarity = intersection_size / union_size
 
         return jaccard_similarity
 
@@ -349,61 +675,47 @@ class L2RFeatureExtractor:
 
         feature_vector = []
 
-        # Document Length
-        article_length = self.get_article_length(docid)
-        feature_vector.append(article_length)
+        # Document length, title length, network features, hierarchy encoding and sibling count
+        # do not depend on the query and are read from the static feature matrix
+        static_features = self.get_static_features(docid).tolist()
 
-        # Title Length
-        title_length = self.get_title_length(docid)
-        feature_vector.append(title_length)
+        # Document Length and Title Length
+        feature_vector.extend(static_features[:2])
 
         # Query Length
         query_length = len(query_parts)
         feature_vector.append(query_length)
 
+        # Term ids of the query terms in each index, and their frequencies in the document and title
+        doc_term_ids, doc_tfs = self.get_query_term_frequencies(self.document_index, doc_word_counts, query_parts)
+        title_term_ids, title_tfs = self.get_query_term_frequencies(self.title_index, title_word_counts, query_parts)
+
         # TF (document)
-        tf_doc = self.get_tf(self.document_index, docid, doc_word_counts, query_parts)
+        tf_doc = self._tf(doc_tfs)
         feature_vector.append(tf_doc)
 
         # TF-IDF (document)
-        tf_idf_doc = self.get_tf_idf(self.document_index, docid, doc_word_counts, query_parts)
+        tf_idf_doc = self._tf_idf(self.document_index, doc_term_ids, doc_tfs)
         feature_vector.append(tf_idf_doc)
 
         # TF (title)
-        tf_title = self.get_tf(self.title_index, docid, title_word_counts, query_parts)
+        tf_title = self._tf(title_tfs)
         feature_vector.append(tf_title)
 
         # TF-IDF (title)
-        tf_idf_title = self.get_tf_idf(self.title_index, docid, title_word_counts, query_parts)
+        tf_idf_title = self._tf_idf(self.title_index, title_term_ids, title_tfs)
         feature_vector.append(tf_idf_title)
 
         # BM25
-        bm25_score = self.get_BM25_score(docid, doc_word_counts, query_parts)
+        bm25_score = self._BM25_score(docid, doc_term_ids, doc_tfs)
         feature_vector.append(bm25_score)
 
         # Pivoted normalization
-        pivoted_norm_score = self.get_pivoted_normalization_score(docid, doc_word_counts, query_parts)
+        pivoted_norm_score = self._pivoted_normalization_score(docid, doc_term_ids, doc_tfs)
         feature_vector.append(pivoted_norm_score)
 
-        # PageRank
-        pagerank_score = self.get_pagerank_score(docid)
-        feature_vector.append(pagerank_score)
-
-        # HITS Hub Score
-        hits_hub_score = self.get_hits_hub_score(docid)
-        feature_vector.append(hits_hub_score)
-
-        # HITS Authority Score
-        hits_authority_score = self.get_hits_authority_score(docid)
-        feature_vector.append(hits_authority_score)
-
-        # Hierarchy Encoded Features
-        hierarchy_encoded = self.get_hierarchy_encoded(docid)
-        feature_vector.extend(hierarchy_encoded)
-
-        # Sibling Count
-        sibling_count = self.get_sibling_count(docid)
-        feature_vector.append(sibling_count)
+        # PageRank, HITS Hub Score, HITS Authority Score, Hierarchy Encoded Features and Sibling Count
+        feature_vector.extend(static_features[2:])
 
         # Query Term Coverage
         query_term_coverage = self.get_query_term_coverage(doc_word_counts, query_parts)
@@ -415,10 +727,147 @@ class L2RFeatureExtractor:
 
         return feature_vector
 
+    def generate_features_batch(self, docids, query_parts):
+        """
+        Generates the feature vectors of many documents for the same query at once. The features are the
+        same as those of generate_features, but the query terms' frequencies are read from sparse slices of
+        the documents' rows in the indexes and the features are computed for all documents with NumPy.
+
+        Args:
+            docids: The ids of the documents to generate features for (they must be in the document index)
+            query_parts: A list of tokenized query terms to generate features for
+
+        Returns:
+            np.ndarray: A float32 matrix with the feature vector of each document as a row, in docids order
+        """
+        static_features = self._current_static_features()
+        document_internal_ids = self.document_index.internal_ids
+        title_internal_ids = self.title_index.internal_ids
+        doc_rows = np.array([document_internal_ids[docid] for docid in docids], dtype=np.int64)
+        title_rows = np.array([title_internal_ids.get(docid, -1) for docid in docids], dtype=np.int64)
+        doc_static_features = static_features[doc_rows]
+
+        # Term ids of the processed query terms in each index, and of the unique raw query terms
+        # in the document index (for coverage and Jaccard similarity); -1 for terms that are not there
+        processed_terms = [self.process_term(term) for term in query_parts]
+        doc_term_ids = self._query_term_ids(self.document_index, processed_terms)
+        title_term_ids = self._query_term_ids(self.title_index, processed_terms)
+        unique_query_terms = set(query_parts)
+        unique_term_ids = self._query_term_ids(self.document_index, list(unique_query_terms))
+
+        # Frequencies of the query terms in each document and title, one column per query term
+        doc_term_rows = self.document_index.get_document_term_rows(doc_rows)
+        doc_tfs = self._query_term_frequency_columns(doc_term_rows, doc_term_ids)
+        title_tfs = np.zeros((len(docids), len(query_parts)))
+        has_title = title_rows >= 0
+        if has_title.any():
+            title_term_rows = self.title_index.get_document_term_rows(title_rows[has_title])
+            title_tfs[has_title] = self._query_term_frequency_columns(title_term_rows, title_term_ids)
+
+        # BM25 and pivoted normalization over the document lengths
+        stats = self.document_index.get_statistics()
+        N = stats['number_of_documents']
+        avgdl = stats['mean_document_length']
+        doc_dfs = self._query_term_doc_freqs(self.document_index, doc_term_ids)
+        doc_lengths = doc_static_features[:, 0:1]
+        scored = doc_dfs > 0
+        safe_dfs = np.where(scored, doc_dfs, 1)
+        k1 = 1.2
+        b = 0.75
+        bm25_idf = np.where(scored, np.log((N - safe_dfs + 0.5) / (safe_dfs + 0.5)), 0.0)
+        bm25 = (bm25_idf * ((k1 + 1) * doc_tfs) / (k1 * (1 - b + b * (doc_lengths / avgdl)) + doc_tfs)).sum(axis=1)
+        pn_idf = np.where(scored, np.log((N + 1) / safe_dfs), 0.0)
+        norm_tf = (1 + np.log(1 + np.log(np.maximum(doc_tfs, 1)))) / (1 - 0.2 + 0.2 * (doc_lengths / avgdl))
+        pivoted_norm = np.where(doc_tfs > 0, pn_idf * norm_tf, 0.0).sum(axis=1)
+
+        # Query term coverage and Jaccard similarity
+        matched = self._query_term_frequency_columns(doc_term_rows, unique_term_ids) > 0
+        intersection_sizes = matched.sum(axis=1)
+        union_sizes = len(unique_query_terms) + doc_term_rows.getnnz(axis=1) - intersection_sizes
+        coverage = intersection_sizes / len(unique_query_terms) if unique_query_terms else np.zeros(len(docids))
+        jaccard = np.divide(intersection_sizes, union_sizes, out=np.zeros(len(docids)), where=union_sizes > 0)
+
+        features = np.empty((len(docids), NUM_FEATURES), dtype=np.float32)
+        features[:, 0:2] = doc_static_features[:, 0:2]
+        features[:, 2] = len(query_parts)
+        features[:, 3] = np.log(doc_tfs + 1).sum(axis=1)
+        features[:, 4] = self._tf_idf_batch(self.document_index, doc_term_ids, doc_tfs)
+        features[:, 5] = np.log(title_tfs + 1).sum(axis=1)
+        features[:, 6] = self._tf_idf_batch(self.title_index, title_term_ids, title_tfs)
+        features[:, 7] = bm25
+        features[:, 8] = pivoted_norm
+        features[:, 9:-2] = doc_static_features[:, 2:]
+        features[:, -2] = coverage
+        features[:, -1] = jaccard
+        return features
+
+    def _query_term_ids(self, index, terms):
+        """
+        The term ids of terms in an index's vocabulary, -1 for empty (stopword) and unknown terms.
+        """
+        vocabulary = index.vocabulary
+        return np.array([vocabulary.get(term, -1) if term else -1 for term in terms], dtype=np.int64)
+
+    def _query_term_doc_freqs(self, index, term_ids):
+        """
+        The document frequencies of term ids in an index, 0 for unknown (-1) terms.
+        """
+        return np.array([int(index.term_doc_freqs[term_id]) if term_id >= 0 else 0 for term_id in term_ids],
+                        dtype=np.float64)
+
+    def _query_term_frequency_columns(self, document_term_rows, term_ids):
+        """
+        The columns of a documents' term frequency matrix for term ids, as a dense matrix with a column per
+        term id (zeros for unknown (-1) terms).
+        """
+        number_of_rows = document_term_rows.shape[0]
+        tfs = np.zeros((number_of_rows, len(term_ids)))
+        known = term_ids >= 0
+        if not known.any():
+            return tfs
+        # Find the matrix entries of the query terms by binary search (cheaper than SciPy's fancy
+        # column indexing for the few columns of a query)
+        unique_term_ids, columns = np.unique(term_ids[known], return_inverse=True)
+        entry_term_ids = document_term_rows.indices
+        entry_rows = np.repeat(np.arange(number_of_rows), np.diff(document_term_rows.indptr))
+        positions = np.minimum(np.searchsorted(unique_term_ids, entry_term_ids), len(unique_term_ids) - 1)
+        matches = unique_term_ids[positions] == entry_term_ids
+        unique_tfs = np.zeros((number_of_rows, len(unique_term_ids)))
+        unique_tfs[entry_rows[matches], positions[matches]] = document_term_rows.data[matches]
+        tfs[:, known] = unique_tfs[:, columns]
+        return tfs
+
+    def _tf_idf_batch(self, index, term_ids, tfs):
+        """
+        The TF-IDF feature (see _tf_idf) of every row of a matrix of query term frequencies.
+        """
+        N = index.get_statistics()['number_of_documents']
+        idf = np.where(term_ids >= 0, np.log(N / (self._query_term_doc_freqs(index, term_ids) + 1)), 0.0)
+        return (np.log(tfs + 1) * idf).sum(axis=1)
+
+def _featurize_training_query(feature_extractor, query_tokens, docid_relevance_list):
+    """
+    Featurize the documents of a tokenized training query.
+
+    Returns:
+        tuple: The float32 feature matrix of the documents and their relevance scores
+    """
+    if not docid_relevance_list:
+        return np.empty((0, NUM_FEATURES), dtype=np.float32), np.empty(0)
+    docids, relevance_scores = zip(*docid_relevance_list)
+    return feature_extractor.generate_features_batch(list(docids), query_tokens), np.array(relevance_scores)
+
+def _init_featurization_worker(feature_extractor):
+    global _worker_feature_extractor
+    _worker_feature_extractor = feature_extractor
+
+def _featurize_in_worker(query_tokens, docid_relevance_list):
+    return _featurize_training_query(_worker_feature_extractor, query_tokens, docid_relevance_list)
+
 class L2RRanker:
     def __init__(self, document_index, title_index,
                  document_preprocessor, stopwords, ranker,
-                 feature_extractor) -> None:
+                 feature_extractor, cache=None) -> None:
         """
         Initializes a L2RRanker model.
 
@@ -429,6 +878,7 @@ class L2RRanker:
             stopwords: The set of stopwords to use or None if no stopword filtering is to be done
             ranker: The base ranker to get initial candidate documents
             feature_extractor: The L2RFeatureExtractor object
+            cache: An optional QueryResultCache for the results of query
         """
         self.document_index = document_index
         self.title_index = title_index
@@ -437,89 +887,141 @@ class L2RRanker:
         self.ranker = ranker
         self.feature_extractor = feature_extractor
         self.model = LambdaMART()
+        # Changes whenever a model is trained or loaded, to invalidate cached results
+        self.model_version = next(_MODEL_VERSIONS)
+        self.cache = cache
 
-    def prepare_training_data(self, query_to_document_relevance_scores):
+    def prepare_training_data(self, query_to_document_relevance_scores, num_workers=1, cache_directory=None):
         """
         Prepares the training data for the learning-to-rank algorithm.
 
+        The queries are featurized in a pool of worker processes when num_workers is more than 1, and their
+        features are copied into one preallocated array as they arrive. With a cache directory, the featurized
+        training set is saved there, keyed by the training data and the feature extractor's fingerprint
+        (the indexes and feature version), and loaded instead of featurized again while neither changes.
+
         Args:
             query_to_document_relevance_scores (dict): A dictionary of queries mapped to a list of 
                 documents and their relevance scores for that query
                 The dictionary has the following structure:
                     query_1_text: [(docid_1, relevance_to_query_1), (docid_2, relevance_to_query_1), ...]
+            num_workers (int): The number of worker processes; 1 featurizes in this process
+            cache_directory (str, optional): Directory to cache featurized training sets in
 
         Returns:
-            tuple: A tuple containing the training data in the form of three lists: X, y, and qgroups
-                X (list): A list of feature vectors for each query-document pair
-                y (list): A list of relevance scores for each query-document pair
-                qgroups (list): A list of the number of documents retrieved for each query
+            tuple: A tuple containing the training data in the form of three arrays: X, y, and qgroups
+                X (np.ndarray): A float32 matrix of the feature vectors of the query-document pairs
+                y (np.ndarray): The relevance score of each query-document pair
+                qgroups (np.ndarray): The number of documents of each query that has any
         """
-        X = []
-        y = []
+        # Documents that are not in both indexes are skipped
+        queries = [(self._tokenize_query(query_text),
+                    [(docid, relevance_score) for docid, relevance_score in docid_relevance_list
+                     if docid in self.document_index.doc_term_freqs and docid in self.title_index.doc_term_freqs])
+                   for query_text, docid_relevance_list in query_to_document_relevance_scores.items()]
+
+        cache_path = None
+        if cache_directory:
+            digest = hashlib.sha256()
+            digest.update(json.dumps([self.feature_extractor.get_fingerprint(), queries]).encode('utf-8'))
+            cache_path = os.path.join(cache_directory, f'l2r_training_data_{digest.hexdigest()[:32]}.npz')
+            if os.path.exists(cache_path):
+                print(f"Loading featurized training data from {cache_path}...")
+                with np.load(cache_path) as cached:
+                    return cached['X'], cached['y'], cached['qgroups']
+
+        X = np.empty((sum(len(docid_relevance_list) for _, docid_relevance_list in queries), NUM_FEATURES),
+                     dtype=np.float32)
+        y = np.empty(len(X), dtype=np.float64)
         qgroups = []
-
-        for query_text, docid_relevance_list in query_to_document_relevance_scores.items():
-            # Tokenize
-            query_tokens = self.document_preprocessor.tokenize(query_text)
-            # Remove stopwords
-            if self.stopwords:
-                query_tokens = [token for token in query_tokens if token not in self.stopwords]
-
-            num_docs = 0
-
-            for docid, relevance_score in docid_relevance_list:
-                # Convert docid to integer
-                docid = docid
-
-                # Check if docid exists
-                if docid not in self.document_index.doc_term_freqs or docid not in self.title_index.doc_term_freqs:
-                    continue
-
-                # Word counts
-                doc_word_counts = self.document_index.doc_term_freqs[docid]
-                title_word_counts = self.title_index.doc_term_freqs[docid]
-
-                # Generate features
-                features = self.feature_extractor.generate_features(
-                    docid, doc_word_counts, title_word_counts, query_tokens, query_text)
-
-                # Add features and relevance score
-                X.append(features)
-                y.append(relevance_score)
-                num_docs += 1
-
-            if num_docs > 0:
-                qgroups.append(num_docs)
-        print(f"X:{X}")
-        print("\n")
-        print(f"y:{y}")
-        print("\n")
-        print(f"qgroups:{qgroups}")
-        print("\n")
+        num_rows = 0
+        for features, relevance_scores in self._featurize_queries(queries, num_workers):
+            if len(features) == 0:
+                continue
+            X[num_rows:num_rows + len(features)] = features
+            y[num_rows:num_rows + len(features)] = relevance_scores
+            num_rows += len(features)
+            qgroups.append(len(features))
+        qgroups = np.array(qgroups, dtype=np.int64)
+        print(f"Featurized {num_rows} query-document pairs of {len(qgroups)} queries.")
+
+        if cache_path is not None:
+            os.makedirs(cache_directory, exist_ok=True)
+            temporary_path = cache_path + '.tmp'
+            with open(temporary_path, 'wb') as f:
+                np.savez(f, X=X, y=y, qgroups=qgroups)
+            os.replace(temporary_path, cache_path)
 
         return X, y, qgroups
 
-    def train(self, query_to_document_relevance_scores):
+    def _featurize_queries(self, queries, num_workers):
+        """
+        Featurize the documents of tokenized training queries, in query order (see prepare_training_data).
+        """
+        # The workers are forked: they share the indexes copy-on-write, which could not be pickled for spawned
+        # workers anyway (their metadata stores are memory-mapped)
+        if num_workers > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            print("Featurizing in one process: worker processes need the fork start method.")
+            num_workers = 1
+        if num_workers <= 1 or len(queries) <= 1:
+            for query_tokens, docid_relevance_list in queries:
+                yield _featurize_training_query(self.feature_extractor, query_tokens, docid_relevance_list)
+            return
+
+        # Each worker gets the feature extractor once, inherited from the parent at fork (the start method is
+        # pinned, since the default is spawn on macOS and forkserver on Linux from Python 3.14), with the
+        # static features built beforehand so that the workers do not each build them
+        self.feature_extractor._current_static_features()
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_featurization_worker,
+                                 initargs=(self.feature_extractor,)) as executor:
+            yield from executor.map(_featurize_in_worker, *zip(*queries),
+                                    chunksize=max(1, len(queries) // (4 * num_workers)))
+
+    def train(self, query_to_document_relevance_scores, num_workers=1,
+              validation_fraction=DEFAULT_VALIDATION_FRACTION,
+              early_stopping_rounds=DEFAULT_EARLY_STOPPING_ROUNDS, cache_directory=None):
         """
         Trains a LambdaMART pair-wise learning to rank model using the documents and relevance scores provided 
-        in the training data.
+        in the training data. A random fraction of the queries is held out as a validation set, and training
+        stops once the validation NDCG stops improving.
 
         Args:
             query_to_document_relevance_scores (dict): A dictionary of queries mapped to a list of 
                 documents and their relevance scores for that query
+            num_workers (int): The number of worker processes to featurize the queries with
+            validation_fraction (float): The fraction of the queries to hold out; 0 trains on all of them
+            early_stopping_rounds (int): The number of rounds without improvement after which training stops
+            cache_directory (str, optional): Directory to cache featurized training sets in
         """
         # Prepare training data
-        X, y, qgroups = self.prepare_training_data(query_to_document_relevance_scores)
-        if not X:
+        X, y, qgroups = self.prepare_training_data(query_to_document_relevance_scores, num_workers, cache_directory)
+        if len(X) == 0:
             raise ValueError("No training data prepared. Check if documents exist in the index.")
-        
-        # Convert to numpy arrays
-        X = np.array(X)
-        y = np.array(y)
-        qgroups = np.array(qgroups)
 
-        # Train the model
-        self.model.fit(X, y, qgroups)
+        # Hold out whole queries (with a fixed seed, so that retraining is reproducible)
+        num_validation_queries = int(round(len(qgroups) * validation_fraction))
+        if num_validation_queries < 1 or num_validation_queries >= len(qgroups):
+            self.model.fit(X, y, qgroups)
+        else:
+            is_validation_query = np.zeros(len(qgroups), dtype=bool)
+            is_validation_query[np.random.default_rng(0).permutation(len(qgroups))[:num_validation_queries]] = True
+            is_validation_row = np.repeat(is_validation_query, qgroups)
+            self.model.fit(X[~is_validation_row], y[~is_validation_row], qgroups[~is_validation_query],
+                           X[is_validation_row], y[is_validation_row], qgroups[is_validation_query],
+                           early_stopping_rounds)
+            print(f"Validated on {num_validation_queries} held-out queries; "
+                  f"best iteration {self.model.model.best_iteration_}.")
+        self.model_version = next(_MODEL_VERSIONS)
+
+    def _tokenize_query(self, query):
+        """
+        Tokenize a query and remove its stopwords.
+        """
+        query_tokens = self.document_preprocessor.tokenize(query)
+        if self.stopwords:
+            query_tokens = [token for token in query_tokens if token not in self.stopwords]
+        return query_tokens
 
     def predict(self, X):
         """
@@ -551,42 +1053,77 @@ class L2RRanker:
             A list containing tuples of the ranked documents and their scores, sorted by score in descending order
                 The list has the following structure: [(doc_id_1, score_1), (doc_id_2, score_2), ...]
         """
-        query_tokens = self.document_preprocessor.tokenize(query)
-        if self.stopwords:
-            query_tokens = [token for token in query_tokens if token not in self.stopwords]
+        query_tokens = self._tokenize_query(query)
         if not query_tokens:
             return []
-
+        if self.cache is None:
+            return self._query(query, query_tokens, k)
+
+        # The results only depend on the query terms, k, the indexes and the model
+        key = QueryResultCache.make_key(query_tokens, k)
+        generation = (self.document_index.version, self.title_index.version, self.model_version)
+        results = self.cache.get(key, generation)
+        if results is None:
+            results = self._query(query, query_tokens, k)
+            self.cache.put(key, generation, results)
+        return results
+
+    def _query(self, query, query_tokens, k):
+        """
+        Rank the base ranker's top k documents for a tokenized query with the model (see query).
+        """
         # Get initial candidate documents using the base ranker
         initial_rankings = self.ranker.query(query, k=k)
         top_docids = [docid for docid, _ in initial_rankings]
+        if not top_docids:
+            return []
 
-        # Generate features for the top documents
-        X = []
-        docids = []
-        for docid in top_docids:
-            doc_word_counts = self.document_index.doc_term_freqs.get(docid, {})
-            title_word_counts = self.title_index.doc_term_freqs.get(docid, {})
-            features = self.feature_extractor.generate_features(
-                docid, doc_word_counts, title_word_counts, query_tokens, query)
-            X.append(features)
-            docids.append(docid)
-    
+        # Generate the features of all the top documents at once
+        X = self.feature_extractor.generate_features_batch(top_docids, query_tokens)
 
         # Predict scores using the model
         scores = self.predict(X)
 
         # Create a list and sort
-        ranked_docs = list(zip(docids, scores))
+        ranked_docs = list(zip(top_docids, scores))
         ranked_docs.sort(key=lambda x: x[1], reverse=True)
 
         return ranked_docs[:k]
 
     def save_model(self, filepath):
         self.model.model.booster_.save_model(filepath)
+        # The model's hierarchy features are only meaningful with the vocabulary they were encoded with
+        self.feature_extractor.save_hierarchy_mapping(filepath + HIERARCHY_VOCABULARY_SUFFIX)
+
+    def load_model(self, filepath, use_tree_predictor=False, allow_missing_hierarchy_vocabulary=False):
+        """
+        Loads a model saved with save_model and the hierarchy vocabulary its features were encoded with.
 
-    def load_model(self, filepath):
+        Args:
+            filepath: The path of the model file
+            use_tree_predictor: Whether to predict with the vectorized tree predictor instead of LightGBM
+            allow_missing_hierarchy_vocabulary: Whether to load a model saved without its hierarchy vocabulary
+                (e.g. one trained before it was saved), whose hierarchy features are then encoded with the
+                vocabulary built from the document index, which may not match the codes it was trained with
+
+        Raises:
+            FileNotFoundError: If the model has no hierarchy vocabulary and allow_missing_hierarchy_vocabulary
+                is not set; retrain the model to save one
+        """
+        hierarchy_vocabulary_path = filepath + HIERARCHY_VOCABULARY_SUFFIX
+        has_hierarchy_vocabulary = os.path.exists(hierarchy_vocabulary_path)
+        if not has_hierarchy_vocabulary and not allow_missing_hierarchy_vocabulary:
+            raise FileNotFoundError(f"No hierarchy vocabulary found at {hierarchy_vocabulary_path}: the model was "
+                                    "saved without the hierarchy codes it was trained with. Retrain it, or load it "
+                                    "with allow_missing_hierarchy_vocabulary=True.")
         self.model.model = lightgbm.Booster(model_file=filepath)
+        self.model.use_tree_predictor(use_tree_predictor)
+        if has_hierarchy_vocabulary:
+            self.feature_extractor.load_hierarchy_mapping(hierarchy_vocabulary_path)
+        else:
+            print(f"No hierarchy vocabulary found at {hierarchy_vocabulary_path}, "
+                  "using the one built from the document index.")
+        self.model_version = next(_MODEL_VERSIONS)
 
 class MiscFunctionsL2R():
     """
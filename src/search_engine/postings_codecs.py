@@ -0,0 +1,357 @@
+# postings_codecs.py
+
+from enum import Enum
+import numpy as np
+
+
+class PostingsCodec(Enum):
+    """
+    Compression codec of the postings of a binary index
+    """
+    RAW = 'raw'  # uncompressed uint32 doc id gaps and term frequencies
+    VARBYTE = 'varbyte'
+    PFOR = 'pfor'
+    ELIAS_FANO = 'elias_fano'
+
+
+# Number of postings per block. Each block is decoded on its own, starting from its skip pointer:
+# the last int doc id of the previous block of the same term (0 for a term's first block)
+BLOCK_SIZE = 128
+
+# Fraction of the values of a PFOR block that its bit width must fit; the others are stored as exceptions
+PFOR_COVERAGE = 0.9
+
+
+def _bit_lengths(values: np.ndarray) -> np.ndarray:
+    """
+    Get the number of bits needed to represent each value (0 for 0). Exact for values below 2 ** 53.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.zeros(len(values), dtype=np.int64)
+    nonzero = values > 0
+    lengths[nonzero] = np.floor(np.log2(values[nonzero].astype(np.float64))).astype(np.int64) + 1
+    return lengths
+
+
+def pack_bits(values: np.ndarray, width: int) -> np.ndarray:
+    """
+    Bit-pack values into width bits each, least significant bit first.
+    """
+    if width == 0:
+        return np.zeros(0, dtype=np.uint8)
+    bits = (np.asarray(values, dtype=np.uint64)[:, np.newaxis] >> np.arange(width, dtype=np.uint64)) & 1
+    return np.packbits(bits.astype(np.uint8).ravel(), bitorder='little')
+
+
+def read_bits(buffer: np.ndarray, bit_offsets: np.ndarray, widths: np.ndarray) -> np.ndarray:
+    """
+    Read values of up to 32 bits at the given bit offsets of a buffer, least significant bit first:
+    each value is cut out of the 8 bytes starting at its first byte.
+    """
+    padded = np.concatenate((np.asarray(buffer, dtype=np.uint8), np.zeros(8, dtype=np.uint8)))
+    bit_offsets = np.asarray(bit_offsets, dtype=np.int64)
+    words = padded[(bit_offsets >> 3)[:, np.newaxis] + np.arange(8)].view('<u8').ravel()
+    masks = (np.uint64(1) << np.asarray(widths, dtype=np.uint64)) - np.uint64(1)
+    return (words >> (bit_offsets & 7).astype(np.uint64)) & masks
+
+
+def unpack_bits(buffer: np.ndarray, count: int, width: int) -> np.ndarray:
+    """
+    Unpack count values of width bits each (see pack_bits).
+    """
+    return read_bits(buffer, np.arange(count, dtype=np.int64) * width, np.full(count, width))
+
+
+def varbyte_encode(values: np.ndarray) -> np.ndarray:
+    """
+    Encode non-negative integers in 7-bit groups, least significant group first,
+    with the high bit set on every byte of an integer but its last.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    byte_counts = (np.maximum(_bit_lengths(values), 1) + 6) // 7
+    owners = np.repeat(np.arange(len(values)), byte_counts)
+    positions = np.arange(len(owners)) - (np.cumsum(byte_counts) - byte_counts)[owners]
+    groups = (values[owners] >> (7 * positions).astype(np.uint64)) & np.uint64(0x7f)
+    continuation = (positions < byte_counts[owners] - 1).astype(np.uint64) << np.uint64(7)
+    return (groups | continuation).astype(np.uint8)
+
+
+def varbyte_decode(buffer: np.ndarray) -> np.ndarray:
+    """
+    Decode a buffer of varbyte encoded integers (see varbyte_encode).
+    """
+    data = np.asarray(buffer, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    last = (data & 0x80) == 0
+    starts = np.concatenate(([0], np.flatnonzero(last)[:-1] + 1))
+    owners = np.cumsum(last) - last
+    positions = np.arange(len(data)) - starts[owners]
+    groups = (data & 0x7f).astype(np.uint64) << (7 * positions).astype(np.uint64)
+    return np.add.reduceat(groups, starts)
+
+
+def pfor_encode(values: np.ndarray) -> np.ndarray:
+    """
+    Encode a block with frame of reference and patched exceptions (PForDelta). The values are bit-packed
+    with the smallest width that fits PFOR_COVERAGE of them, and the high bits of the others follow.
+
+    Layout: width (1 byte), number of exceptions (1 byte), packed values,
+    exception positions (1 byte each), exception high bits (little-endian uint32 each).
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    bit_lengths = _bit_lengths(values)
+    width = int(np.sort(bit_lengths)[max(int(np.ceil(PFOR_COVERAGE * len(values))) - 1, 0)]) if len(values) else 0
+    exceptions = np.flatnonzero(bit_lengths > width)
+    low_bits = values & np.uint64((1 << width) - 1)
+    return np.concatenate((np.array([width, len(exceptions)], dtype=np.uint8), pack_bits(low_bits, width),
+                           exceptions.astype(np.uint8),
+                           (values[exceptions] >> np.uint64(width)).astype('<u4').view(np.uint8)))
+
+
+def pfor_decode(buffer: np.ndarray, offset: int, count: int) -> tuple[np.ndarray, int]:
+    """
+    Decode a PForDelta block of count values starting at offset (see pfor_encode).
+
+    Returns:
+        The values and the offset of the end of the block.
+    """
+    width, exception_count = int(buffer[offset]), int(buffer[offset + 1])
+    position = offset + 2
+    packed_length = (count * width + 7) // 8
+    values = unpack_bits(buffer[position:position + packed_length], count, width)
+    position += packed_length
+    if exception_count:
+        exception_positions = buffer[position:position + exception_count].astype(np.int64)
+        position += exception_count
+        high_bits = buffer[position:position + 4 * exception_count].copy().view('<u4')
+        values[exception_positions] |= high_bits.astype(np.uint64) << np.uint64(width)
+        position += 4 * exception_count
+    return values, position
+
+
+def elias_fano_encode(values: np.ndarray) -> np.ndarray:
+    """
+    Encode a non-decreasing sequence with Elias-Fano: the low bits of each value are bit-packed, and the
+    high bits are unary coded as the set bits of a bit vector, at position (high bits + index).
+
+    Layout: number of low bits (1 byte), length of the high bit vector in bytes (little-endian uint16),
+    low bits, high bit vector.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    count = len(values)
+    universe = int(values[-1]) + 1
+    low_width = int(np.floor(np.log2(universe / count))) if universe > count else 0
+    high_positions = (values >> np.uint64(low_width)).astype(np.int64) + np.arange(count)
+    high_bits = np.zeros(int(high_positions[-1]) + 1, dtype=np.uint8)
+    high_bits[high_positions] = 1
+    high_bytes = np.packbits(high_bits, bitorder='little')
+    return np.concatenate((np.array([low_width], dtype=np.uint8), np.array([len(high_bytes)], dtype='<u2').view(np.uint8),
+                           pack_bits(values & np.uint64((1 << low_width) - 1), low_width), high_bytes))
+
+
+def elias_fano_decode(buffer: np.ndarray, offset: int, count: int) -> tuple[np.ndarray, int]:
+    """
+    Decode an Elias-Fano sequence of count values starting at offset (see elias_fano_encode).
+
+    Returns:
+        The values and the offset of the end of the sequence.
+    """
+    low_width = int(buffer[offset])
+    high_length = int(buffer[offset + 1]) | (int(buffer[offset + 2]) << 8)
+    position = offset + 3
+    low_length = (count * low_width + 7) // 8
+    low_bits = unpack_bits(buffer[position:position + low_length], count, low_width)
+    position += low_length
+    high_positions = np.flatnonzero(np.unpackbits(buffer[position:position + high_length], bitorder='little'))[:count]
+    high_bits = (high_positions - np.arange(count)).astype(np.uint64)
+    return (high_bits << np.uint64(low_width)) | low_bits, position + high_length
+
+
+def encode_block(codec: PostingsCodec, doc_ids: np.ndarray, tfs: np.ndarray, base: int) -> np.ndarray:
+    """
+    Encode a block of postings. Doc ids are coded relative to base, the block's skip pointer,
+    and term frequencies (all > 0) are coded minus one.
+
+    Args:
+        codec: The codec to use (not RAW).
+        doc_ids: Increasing int doc ids.
+        tfs: The matching term frequencies.
+        base: The last int doc id of the term's previous block, or 0.
+
+    Returns:
+        The encoded bytes.
+    """
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    tf_codes = np.asarray(tfs, dtype=np.uint64) - np.uint64(1)
+    if codec == PostingsCodec.VARBYTE:
+        return varbyte_encode(np.concatenate((np.diff(doc_ids, prepend=base).astype(np.uint64), tf_codes)))
+    if codec == PostingsCodec.PFOR:
+        return np.concatenate((pfor_encode(np.diff(doc_ids, prepend=base)), pfor_encode(tf_codes)))
+    if codec == PostingsCodec.ELIAS_FANO:
+        return np.concatenate((elias_fano_encode(doc_ids - base), pfor_encode(tf_codes)))
+    raise ValueError(f"Unsupported postings codec: {codec}")
+
+
+def decode_block(codec: PostingsCodec, buffer: np.ndarray, count: int, base: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decode a block of count postings (see encode_block).
+
+    Returns:
+        NumPy arrays of the int doc ids and term frequencies.
+    """
+    if codec == PostingsCodec.VARBYTE:
+        codes = varbyte_decode(buffer)
+        doc_ids = np.cumsum(codes[:count]) + np.uint64(base)
+        tfs = codes[count:] + np.uint64(1)
+    elif codec == PostingsCodec.PFOR:
+        gaps, position = pfor_decode(buffer, 0, count)
+        doc_ids = np.cumsum(gaps) + np.uint64(base)
+        tfs = pfor_decode(buffer, position, count)[0] + np.uint64(1)
+    elif codec == PostingsCodec.ELIAS_FANO:
+        offsets, position = elias_fano_decode(buffer, 0, count)
+        doc_ids = offsets + np.uint64(base)
+        tfs = pfor_decode(buffer, position, count)[0] + np.uint64(1)
+    else:
+        raise ValueError(f"Unsupported postings codec: {codec}")
+    return doc_ids.astype(np.uint32), tfs.astype(np.uint32)
+
+
+def encode_postings(codec: PostingsCodec, doc_ids: np.ndarray, tfs: np.ndarray) -> tuple[list, list, list]:
+    """
+    Encode a term's postings as blocks of BLOCK_SIZE postings.
+
+    Returns:
+        The encoded blocks, their lengths in bytes and the last int doc id of each block (its skip pointer).
+    """
+    blocks, block_lengths, last_doc_ids = [], [], []
+    base = 0
+    for start in range(0, len(doc_ids), BLOCK_SIZE):
+        block = encode_block(codec, doc_ids[start:start + BLOCK_SIZE], tfs[start:start + BLOCK_SIZE], base)
+        base = int(doc_ids[min(start + BLOCK_SIZE, len(doc_ids)) - 1])
+        blocks.append(block)
+        block_lengths.append(len(block))
+        last_doc_ids.append(base)
+    return blocks, block_lengths, last_doc_ids
+
+
+def decode_postings(codec: PostingsCodec, buffer: np.ndarray, block_offsets: np.ndarray, bases: list[int],
+                    count: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decode consecutive blocks of a term's postings.
+
+    Args:
+        codec: The codec the blocks were encoded with.
+        buffer: The encoded postings of the index.
+        block_offsets: Start of each block in the buffer, and end of the last one.
+        bases: The skip pointer of each block: the last int doc id of the block before it, or 0.
+        count: The number of postings in the blocks (all blocks are full but the term's last one).
+
+    Returns:
+        NumPy arrays of the int doc ids and term frequencies.
+    """
+    block_count = len(bases)
+    if block_count == 0:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+    if codec == PostingsCodec.VARBYTE:
+        # The blocks of a term are contiguous and their doc id gaps chain from one block to the next,
+        # so all of them are decoded at once
+        codes = varbyte_decode(buffer[int(block_offsets[0]):int(block_offsets[-1])])
+        block_sizes = np.full(block_count, BLOCK_SIZE, dtype=np.int64)
+        block_sizes[-1] = count - BLOCK_SIZE * (block_count - 1)
+        code_blocks = np.repeat(np.arange(block_count), 2 * block_sizes)
+        positions = np.arange(len(codes)) - (np.cumsum(2 * block_sizes) - 2 * block_sizes)[code_blocks]
+        is_gap = positions < block_sizes[code_blocks]
+        doc_ids = np.cumsum(codes[is_gap]) + np.uint64(bases[0])
+        return doc_ids.astype(np.uint32), (codes[~is_gap] + np.uint64(1)).astype(np.uint32)
+
+    if codec not in (PostingsCodec.PFOR, PostingsCodec.ELIAS_FANO):
+        raise ValueError(f"Unsupported postings codec: {codec}")
+
+    # Parse the block headers, then unpack the bit-packed values of all the blocks at once
+    data = np.asarray(buffer[int(block_offsets[0]):int(block_offsets[-1])])
+    header_bytes = data.tobytes()
+    block_sizes = [min(BLOCK_SIZE, count - BLOCK_SIZE * block_number) for block_number in range(block_count)]
+    doc_sections, tf_sections = _PackedSections(), _PackedSections()
+    high_bit_ranges = []
+    for position, block_size in zip((np.asarray(block_offsets[:-1], dtype=np.int64) - int(block_offsets[0])).tolist(),
+                                    block_sizes):
+        if codec == PostingsCodec.PFOR:
+            position = doc_sections.add_pfor(header_bytes, position, block_size)
+        else:
+            low_width = header_bytes[position]
+            high_length = header_bytes[position + 1] | (header_bytes[position + 2] << 8)
+            position = doc_sections.add(position + 3, low_width, block_size)
+            high_bit_ranges.append((position, high_length))
+            position += high_length
+        tf_sections.add_pfor(header_bytes, position, block_size)
+
+    values = doc_sections.unpack(data)
+    tfs = (tf_sections.unpack(data) + np.uint64(1)).astype(np.uint32)
+    if codec == PostingsCodec.PFOR:
+        # The doc id gaps chain from one block to the next
+        return (np.cumsum(values) + np.uint64(bases[0])).astype(np.uint32), tfs
+
+    # Elias-Fano: each block's high bit vector has one set bit per posting, at (high bits + index in the block)
+    high_bytes = np.concatenate([data[start:start + length] for start, length in high_bit_ranges])
+    high_bit_starts = 8 * (np.cumsum([length for _, length in high_bit_ranges]) - [length for _, length in high_bit_ranges])
+    block_of_posting = np.repeat(np.arange(block_count), block_sizes)
+    index_in_block = np.arange(count) - np.repeat(np.cumsum(block_sizes) - block_sizes, block_sizes)
+    high_bits = np.flatnonzero(np.unpackbits(high_bytes, bitorder='little')) - high_bit_starts[block_of_posting] - index_in_block
+    low_widths = np.repeat(np.array(doc_sections.widths, dtype=np.uint64), block_sizes)
+    doc_ids = np.array(bases, dtype=np.uint64)[block_of_posting] + ((high_bits.astype(np.uint64) << low_widths) | values)
+    return doc_ids.astype(np.uint32), tfs
+
+
+class _PackedSections:
+    """
+    Collects the bit-packed sections of a run of blocks, to unpack them together.
+    """
+    def __init__(self) -> None:
+        self.bit_starts, self.widths, self.counts = [], [], []
+        self.total = 0  # number of values in the sections so far
+        self.exceptions = []  # (index of the section's first value, positions, high bits, width)
+
+    def add(self, position: int, width: int, count: int) -> int:
+        """
+        Add a section of count values of width bits at a byte position.
+
+        Returns:
+            The position of the end of the section.
+        """
+        self.bit_starts.append(8 * position)
+        self.widths.append(width)
+        self.counts.append(count)
+        self.total += count
+        return position + (count * width + 7) // 8
+
+    def add_pfor(self, header_bytes: bytes, position: int, count: int) -> int:
+        """
+        Add a PForDelta block of count values at a byte position (see pfor_encode).
+
+        Returns:
+            The position of the end of the block.
+        """
+        width, exception_count = header_bytes[position], header_bytes[position + 1]
+        first_value = self.total
+        position = self.add(position + 2, width, count)
+        if exception_count:
+            exception_positions = np.frombuffer(header_bytes, dtype=np.uint8, count=exception_count, offset=position)
+            high_bits = np.frombuffer(header_bytes, dtype='<u4', count=exception_count, offset=position + exception_count)
+            self.exceptions.append((first_value, exception_positions.astype(np.int64), high_bits, width))
+        return position + 5 * exception_count
+
+    def unpack(self, data: np.ndarray) -> np.ndarray:
+        """
+        Unpack the values of all the sections, in order, and patch the exceptions.
+        """
+        counts = np.array(self.counts, dtype=np.int64)
+        total = self.total
+        section_starts = np.cumsum(counts) - counts
+        widths = np.repeat(np.array(self.widths, dtype=np.int64), counts)
+        bit_offsets = np.repeat(np.array(self.bit_starts, dtype=np.int64), counts) \
+            + (np.arange(total) - np.repeat(section_starts, counts)) * widths
+        values = read_bits(data, bit_offsets, widths)
+        for first_value, exception_positions, high_bits, width in self.exceptions:
+            values[first_value + exception_positions] |= high_bits.astype(np.uint64) << np.uint64(width)
+        return values
@@ -1,6 +1,171 @@
-from collections import Counter
+from collections import Counter, OrderedDict
 from indexing import InvertedIndex
+import heapq
 import math
+import threading
+import time
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+
+def _row_indices(matrix):
+    """
+    Get the row of every stored entry of a CSR matrix.
+    """
+    return np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+
+
+def _with_data(matrix, data):
+    """
+    Get a CSR matrix with the sparsity structure of the given one and new values.
+    """
+    return csr_matrix((data, matrix.indices, matrix.indptr), shape=matrix.shape)
+
+
+def _query_terms_matrix(query_matrix, num_terms, binary=False):
+    """
+    Get the columns of a query matrix that are index terms (see InvertedIndex.get_query_matrix),
+    with every query term counted once if binary is set.
+    """
+    query_terms = query_matrix[:, :num_terms].tocsr()
+    if binary:
+        query_terms = _with_data(query_terms, np.ones_like(query_terms.data))
+    return query_terms
+
+
+def _log_where_positive(values):
+    """
+    Get the log of every positive value and 0 for the others, e.g. for the vocabulary entries of terms
+    that no document contains (anymore).
+    """
+    logs = np.zeros(len(values))
+    positive = values > 0
+    logs[positive] = np.log(values[positive])
+    return logs
+
+
+class QueryResultCache:
+    """
+    Bounded LRU cache of query results with an optional time to live, for rankers that see the same queries
+    again and again (e.g. recurring symptom combinations). Results are keyed by the multiset of normalized
+    query terms and k (see make_key), and stored with the generation of what produced them, e.g. the index
+    and model versions: a lookup with another generation clears the cache, so loading a new index or model
+    invalidates it. A cache may be shared by the rankers of successive index generations, but not by rankers
+    with different scorers or models of the same generation.
+    """
+    def __init__(self, max_entries=1024, ttl_seconds=None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: The number of results to keep; the least recently used ones are evicted.
+            ttl_seconds: The number of seconds results stay valid, or None for no expiry.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # key -> (results, expiry time)
+        self.generation = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query_terms, k):
+        """
+        Get the cache key of a query: the multiset of its terms (in any order) and k.
+
+        Args:
+            query_terms: The normalized query terms, or a Counter of them.
+            k: The number of results.
+
+        Returns:
+            A hashable key.
+        """
+        term_counts = query_terms if isinstance(query_terms, Counter) else Counter(query_terms)
+        return tuple(sorted(term_counts.items())), k
+
+    def get(self, key, generation):
+        """
+        Look up the results of a query.
+
+        Args:
+            key: The key returned by make_key.
+            generation: The generation of the ranker's index and model.
+
+        Returns:
+            A copy of the cached results, or None.
+        """
+        with self.lock:
+            self._check_generation(generation)
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[0])
+
+    def put(self, key, generation, results):
+        """
+        Store the results of a query.
+
+        Args:
+            key: The key returned by make_key.
+            generation: The generation of the ranker's index and model that produced the results.
+            results: The list of results.
+        """
+        with self.lock:
+            self._check_generation(generation)
+            expiry = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+            self.entries[key] = (list(results), expiry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all the results.
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Get the cache metrics.
+
+        Returns:
+            A dictionary of the numbers of hits, misses, evictions, expirations and invalidations,
+            the hit rate and the number of cached results.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'size': len(self.entries),
+            }
+
+    def _check_generation(self, generation):
+        """
+        Clear the cache if the generation changed. Must be called with the lock held.
+        """
+        if generation != self.generation:
+            if self.entries:
+                self.entries.clear()
+                self.invalidations += 1
+            self.generation = generation
 
 
 class Ranker:
@@ -8,7 +173,7 @@ class Ranker:
     The Ranker class is responsible for generating a list of documents for a given query
     ordered by their scores.
     """
-    def __init__(self, index, document_preprocessor, stopwords, scorer):
+    def __init__(self, index, document_preprocessor, stopwords, scorer, dynamic_pruning=True, cache=None):
         """
         Initialize the Ranker.
 
@@ -17,11 +182,26 @@ class Ranker:
             document_preprocessor: An instance of your tokenizer/preprocessor.
             stopwords: A set of stopwords to filter out.
             scorer: An instance of a RelevanceScorer subclass.
+            dynamic_pruning: Whether to use safe top-k pruning when the scorer supports it.
+            cache: An optional QueryResultCache for the results of query.
         """
+        # Queries must be normalized like the documents (stemming, synonyms) for their terms to match
+        query_normalizer_config = getattr(document_preprocessor, 'normalizer_config', None)
+        if query_normalizer_config != getattr(index, 'normalizer_config', None):
+            raise ValueError("The tokenizer does not normalize tokens like the index was built with; "
+                             "make it with TokenNormalizer.from_config(index.normalizer_config).")
+        # and tokenized in the same mode, for indexes that record it
+        index_tokenizer_config = getattr(index, 'tokenizer_config', None)
+        if index_tokenizer_config is not None and \
+                getattr(document_preprocessor, 'tokenizer_config', None) != index_tokenizer_config:
+            raise ValueError("The tokenizer does not tokenize like the index was built with; "
+                             "make it with RegexTokenizer.from_config(index.tokenizer_config).")
         self.index = index
         self.tokenize = document_preprocessor.tokenize
         self.scorer = scorer
         self.stopwords = stopwords
+        self.dynamic_pruning = dynamic_pruning
+        self.cache = cache
 
     def query(self, query_text, k):
         """
@@ -39,43 +219,275 @@ class Ranker:
         if not isinstance(k, int) or k <= 0:
             raise ValueError("Parameter k must be a positive integer.")
 
-        # Tokenize the query
+        query_word_counts = self._get_query_word_counts(query_text)
+        if self.cache is None:
+            return self._query(query_word_counts, k)
+
+        # The results only depend on the query terms, k and the index
+        key = QueryResultCache.make_key(query_word_counts, k)
+        results = self.cache.get(key, self.index.version)
+        if results is None:
+            results = self._query(query_word_counts, k)
+            self.cache.put(key, self.index.version, results)
+        return results
+
+    def _query(self, query_word_counts, k):
+        """
+        Compute the top k documents for a query's term counts (see query).
+        """
+        use_pruning = self.dynamic_pruning and self.scorer.supports_pruning
+        query_terms = []
+        for term, query_tf in query_word_counts.items():
+            postings = self.index.get_postings(term)
+            if len(postings) == 0:
+                continue
+            term_weight = self.scorer.term_weight(term, query_tf, len(postings))
+            upper_bound = None
+            if use_pruning:
+                term_metadata = self.index.get_term_metadata(term)
+                upper_bound = self.scorer.term_upper_bound(
+                    term_weight, term_metadata['max_tf'], term_metadata['min_doc_length'])
+            query_terms.append((postings, term_weight, upper_bound))
+
+        doc_lengths = self.index.get_document_length_array()
+        if use_pruning:
+            candidates, scores = self._evaluate_with_pruning(query_terms, doc_lengths, k)
+        else:
+            candidates, scores = self._evaluate(query_terms, doc_lengths)
+        if len(candidates) == 0:
+            return []
+        scores = self.scorer.finalize_scores(scores, candidates, doc_lengths[candidates], query_word_counts)
+        return self._top_k(candidates, scores, k)
+
+    def query_batch(self, query_texts, k):
+        """
+        Searches the collection for many queries at once with the scorer's score_batch.
+        Returns the same results as calling query for each query.
+
+        Args:
+            query_texts: A list of query strings.
+            k: The number of top documents to return per query.
+
+        Returns:
+            A list with, for each query, a list of tuples containing (doc_id, score),
+            sorted by score in descending order.
+        """
+        if not isinstance(k, int) or k <= 0:
+            raise ValueError("Parameter k must be a positive integer.")
+
+        query_matrix = self.index.get_query_matrix([self._get_query_word_counts(text) for text in query_texts])
+        scores = self.scorer.score_batch(query_matrix)
+
+        # Candidates are the documents containing at least one query term
+        doc_term_matrix = self.index.get_document_term_matrix()
+        candidate_matrix = (_query_terms_matrix(query_matrix, doc_term_matrix.shape[1]) @ doc_term_matrix.T).tocsr()
+
+        results = []
+        for row in range(len(query_texts)):
+            candidates = np.sort(candidate_matrix.indices[candidate_matrix.indptr[row]:candidate_matrix.indptr[row + 1]])
+            if len(candidates) == 0:
+                results.append([])
+                continue
+            row_scores = scores[row].toarray().ravel() if issparse(scores) else scores[row]
+            results.append(self._top_k(candidates, row_scores[candidates], k))
+        return results
+
+    def _get_query_word_counts(self, query_text):
+        """
+        Tokenize a query and count its terms.
+        """
         query_tokens = self.tokenize(query_text)
         if self.stopwords:
             query_tokens = [token for token in query_tokens if token not in self.stopwords]
-        query_word_counts = Counter(query_tokens)
+        return Counter(query_tokens)
 
-        # Get list of documents containing the query terms
-        candidate_docs = set()
-        for term in query_word_counts.keys():
-            postings = self.index.get_postings(term)
-            for posting in postings:
-                candidate_docs.add(posting['doc_id'])
-
-        # Score each candidate document
-        scores = []
-        for doc_id in candidate_docs:
-            doc_word_counts = self.index.doc_term_freqs.get(doc_id, {})
-            if not doc_word_counts:
-                continue
+    def _top_k(self, candidates, scores, k):
+        """
+        Select the top k candidates with a heap instead of sorting all of them.
 
-            score = self.scorer.score(doc_id, doc_word_counts, query_word_counts)
-            scores.append((doc_id, score))
+        Args:
+            candidates: NumPy array of int doc ids, in increasing order.
+            scores: NumPy array of their scores.
+            k: The number of top documents to return.
 
-        if not scores:
-            return []
+        Returns:
+            A list of tuples containing (doc_id, score), sorted by score in descending order.
+        """
+        top_k_scores = heapq.nlargest(k, zip(candidates.tolist(), scores.tolist()), key=lambda x: x[1])
+        return [(self.index.external_ids[internal_id], score) for internal_id, score in top_k_scores]
+
+    def _evaluate(self, query_terms, doc_lengths):
+        """
+        Term-at-a-time evaluation: walk each query term's postings once and accumulate its
+        contribution into a score per int doc id.
+
+        Args:
+            query_terms: List of (postings, term_weight, upper_bound) per query term.
+            doc_lengths: Document lengths indexed by int doc id.
+
+        Returns:
+            The candidate int doc ids and their accumulated scores.
+        """
+        accumulators = np.zeros(len(doc_lengths))
+        is_candidate = np.zeros(len(doc_lengths), dtype=bool)
+        for postings, term_weight, _ in query_terms:
+            doc_ids, tfs = postings.arrays()
+            accumulators[doc_ids] += self.scorer.term_scores(term_weight, tfs, doc_lengths[doc_ids])
+            is_candidate[doc_ids] = True
+        candidates = np.flatnonzero(is_candidate)
+        return candidates, accumulators[candidates]
+
+    def _evaluate_with_pruning(self, query_terms, doc_lengths, k):
+        """
+        Term-at-a-time evaluation with MaxScore dynamic pruning. Query terms are processed in
+        decreasing order of their score upper bound. Once the bounds of the remaining terms add up
+        to less than the current k-th best score, no document outside the candidate set can enter
+        the top k: the remaining terms are only looked up for the candidates (see PostingsList.lookup;
+        compressed postings only decode the blocks that can hold them), and candidates that cannot reach
+        the k-th best score even with every remaining term are dropped. Where the postings record per-block
+        statistics, a term's bound for a candidate is that of the block that can hold it. The top k is
+        the same as with _evaluate.
+
+        The candidates are a sparse map (sorted int doc ids and their scores), so the work is proportional
+        to the postings read rather than to the collection, and the k-th best score is kept in a heap
+        (see _TopKThreshold).
+
+        Args:
+            query_terms: List of (postings, term_weight, upper_bound) per query term.
+            doc_lengths: Document lengths indexed by int doc id.
+            k: The number of top documents to return.
+
+        Returns:
+            The candidate int doc ids and their accumulated scores.
+        """
+        query_terms = sorted(query_terms, key=lambda query_term: query_term[2], reverse=True)
+        upper_bounds = np.array([upper_bound for *_, upper_bound in query_terms] + [0.0])
+        # remaining_bounds[i]: the most that the terms from position i on can add to a score
+        remaining_bounds = np.cumsum(upper_bounds[::-1])[::-1]
+
+        # Essential terms: every document in their postings is a candidate
+        candidates = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0)
+        top_k = _TopKThreshold(k)
+        position = 0
+        while position < len(query_terms) and remaining_bounds[position] >= top_k.threshold:
+            postings, term_weight, _ = query_terms[position]
+            doc_ids, tfs = postings.arrays()
+            candidates, scores, slots = _add_term_scores(
+                candidates, scores, doc_ids, self.scorer.term_scores(term_weight, tfs, doc_lengths[doc_ids]))
+            top_k.update(candidates[slots], scores[slots])
+            position += 1
+
+        # Non-essential terms: only score the remaining candidates
+        for position in range(position, len(query_terms)):
+            postings, term_weight, _ = query_terms[position]
+            threshold = top_k.threshold
+            keep = scores + remaining_bounds[position] >= threshold
+            candidates, scores = candidates[keep], scores[keep]
+            block_bounds = postings.block_bounds(candidates)
+            if block_bounds is not None:
+                max_tfs, min_doc_lengths = block_bounds
+                bounds = np.zeros(len(candidates))
+                in_blocks = max_tfs > 0
+                bounds[in_blocks] = self.scorer.term_scores(term_weight, max_tfs[in_blocks], min_doc_lengths[in_blocks])
+                keep = scores + bounds + remaining_bounds[position + 1] >= threshold
+                candidates, scores = candidates[keep], scores[keep]
+
+            tfs = postings.lookup(candidates)
+            found = tfs > 0
+            scores[found] += self.scorer.term_scores(term_weight, tfs[found], doc_lengths[candidates[found]])
+            top_k.update(candidates[found], scores[found])
+
+        # Candidates below the k-th best score cannot be in the top k
+        keep = scores >= top_k.threshold
+        return candidates[keep], scores[keep]
+
+
+def _add_term_scores(candidates, scores, doc_ids, term_scores):
+    """
+    Add a term's contributions to a sparse map of candidate scores, inserting the documents that are not
+    candidates yet. Both doc id arrays are sorted, so this is a linear merge.
 
-        # Sort the scores in descending order and slice the top k
-        sorted_scores = sorted(scores, key=lambda x: x[1], reverse=True)
-        top_k_scores = sorted_scores[:k]
+    Args:
+        candidates: NumPy array of the candidate int doc ids, in increasing order.
+        scores: NumPy array of their scores.
+        doc_ids: NumPy array of the int doc ids of the term's postings, in increasing order.
+        term_scores: NumPy array of the term's contribution to each of them.
 
-        return top_k_scores
+    Returns:
+        The new candidates and scores, and the position of each of doc_ids among the new candidates.
+    """
+    positions = np.searchsorted(candidates, doc_ids)
+    is_candidate = positions < len(candidates)
+    is_candidate[is_candidate] = candidates[positions[is_candidate]] == doc_ids[is_candidate]
+    is_new = ~is_candidate
+    scores = scores.copy()
+    scores[positions[is_candidate]] += term_scores[is_candidate]
+    candidates = np.insert(candidates, positions[is_new], doc_ids[is_new])
+    scores = np.insert(scores, positions[is_new], term_scores[is_new])
+    # Each document moves by the number of new documents inserted before it
+    new_before = np.cumsum(is_new) - is_new
+    return candidates, scores, positions + new_before
+
+
+class _TopKThreshold:
+    """
+    The k-th best score of documents whose scores only grow, for dynamic pruning. The current top k are kept
+    in a min-heap of (score, int doc id) entries; an entry goes stale when its document's score grows or the
+    document leaves the top k, and stale entries are dropped when they reach the top of the heap.
+    """
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.top_scores = {}  # int doc id -> score, of the current top k
+
+    @property
+    def threshold(self):
+        """
+        The k-th best score, or -inf while there are fewer than k documents.
+        """
+        if len(self.top_scores) < self.k:
+            return -math.inf
+        return self.heap[0][0]
+
+    def update(self, doc_ids, scores):
+        """
+        Record the new scores of documents.
+
+        Args:
+            doc_ids: NumPy array of int doc ids.
+            scores: NumPy array of their scores, which are at least their previous ones.
+        """
+        # Only documents above the threshold, and only the k best of them, can be in the top k
+        above = scores > self.threshold
+        doc_ids, scores = doc_ids[above], scores[above]
+        if len(scores) > self.k:
+            best = np.argpartition(scores, len(scores) - self.k)[len(scores) - self.k:]
+            doc_ids, scores = doc_ids[best], scores[best]
+        for doc_id, score in zip(doc_ids.tolist(), scores.tolist()):
+            if self.top_scores.get(doc_id) == score:
+                continue
+            if doc_id not in self.top_scores and len(self.top_scores) == self.k:
+                if score <= self.heap[0][0]:
+                    continue
+                del self.top_scores[heapq.heappop(self.heap)[1]]
+            self.top_scores[doc_id] = score
+            heapq.heappush(self.heap, (score, doc_id))
+            self._drop_stale_entries()
+
+    def _drop_stale_entries(self):
+        while self.heap and self.top_scores.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
 
 
 class RelevanceScorer:
     """
     Base class for all relevance scoring algorithms.
     """
+    # Whether Ranker may prune with term_upper_bound: true for scorers whose term contributions are
+    # non-negative, non-decreasing in tf, non-increasing in document length, and not changed by finalize_scores
+    supports_pruning = False
+
     def __init__(self, index, parameters={}):
         """
         Initialize the RelevanceScorer.
@@ -86,6 +498,8 @@ class RelevanceScorer:
         """
         self.index = index
         self.parameters = parameters
+        # Document weight matrix for score_batch, built on first use
+        self.batch_document_weights = None
 
     def score(self, doc_id, doc_word_counts, query_word_counts):
         """
@@ -101,6 +515,80 @@ class RelevanceScorer:
         """
         raise NotImplementedError("Subclasses should implement this method")
 
+    # Per-term contribution API used by Ranker.query. A document's score is
+    # finalize_scores(sum over the query terms it contains of term_scores(term_weight(...), ...)).
+
+    def term_weight(self, term, query_tf, doc_frequency):
+        """
+        Compute the document-independent part of a query term's contribution, once per query.
+
+        Args:
+            term: The query term.
+            query_tf: The frequency of the term in the query.
+            doc_frequency: The number of documents containing the term (> 0).
+
+        Returns:
+            The term weight passed to term_scores.
+        """
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def term_scores(self, term_weight, tfs, doc_lengths):
+        """
+        Compute a query term's contribution to each document of its postings list.
+
+        Args:
+            term_weight: The value returned by term_weight for the term.
+            tfs: NumPy array of the term's frequency in each document (all > 0).
+            doc_lengths: NumPy array of the length of each document.
+
+        Returns:
+            NumPy array of contributions.
+        """
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def finalize_scores(self, scores, doc_ids, doc_lengths, query_word_counts):
+        """
+        Turn the accumulated term contributions of the candidate documents into their final scores.
+
+        Args:
+            scores: NumPy array of accumulated contributions.
+            doc_ids: NumPy array of the candidates' int doc ids.
+            doc_lengths: NumPy array of the candidates' lengths.
+            query_word_counts: A Counter of term frequencies in the query.
+
+        Returns:
+            NumPy array of scores.
+        """
+        return scores
+
+    def term_upper_bound(self, term_weight, max_tf, min_doc_length):
+        """
+        Compute an upper bound of a query term's contribution to any document, for dynamic pruning.
+
+        Args:
+            term_weight: The value returned by term_weight for the term.
+            max_tf: The largest frequency of the term in a document.
+            min_doc_length: The length of the shortest document containing the term.
+
+        Returns:
+            The upper bound (float).
+        """
+        return float(self.term_scores(term_weight, np.array([max_tf]), np.array([min_doc_length]))[0])
+
+    def score_batch(self, query_matrix):
+        """
+        Score every document for many queries at once.
+
+        Args:
+            query_matrix: A SciPy CSR matrix of query term frequencies with a row per query,
+                as built by InvertedIndex.get_query_matrix.
+
+        Returns:
+            A (number of queries x number of documents) SciPy sparse or NumPy dense matrix whose entry
+            [i, j] is the score that score() gives the document with int doc id j for query i.
+        """
+        raise NotImplementedError("Subclasses should implement this method")
+
 
 class WordCountCosineSimilarity(RelevanceScorer):
     """
@@ -108,6 +596,8 @@ class WordCountCosineSimilarity(RelevanceScorer):
     """
     def __init__(self, index, parameters={}):
         super().__init__(index, parameters)
+        # Document vector magnitudes precomputed by the index, indexed by int doc id
+        self.doc_magnitudes = self.index.get_document_norm_array()
 
     def score(self, doc_id, doc_word_counts, query_word_counts):
         # Compute the dot product between the query and document term frequencies
@@ -116,8 +606,12 @@ class WordCountCosineSimilarity(RelevanceScorer):
             doc_tf = doc_word_counts.get(term, 0)
             dot_product += query_tf * doc_tf
 
-        # Compute the magnitude of the document vector
-        doc_magnitude = math.sqrt(sum(tf ** 2 for tf in doc_word_counts.values()))
+        # Get the magnitude of the document vector, computing it only for documents outside the index
+        internal_id = self.index.internal_ids.get(doc_id)
+        if internal_id is not None:
+            doc_magnitude = float(self.doc_magnitudes[internal_id])
+        else:
+            doc_magnitude = math.sqrt(sum(tf ** 2 for tf in doc_word_counts.values()))
         # Compute the magnitude of the query vector
         query_magnitude = math.sqrt(sum(tf ** 2 for tf in query_word_counts.values()))
 
@@ -128,11 +622,37 @@ class WordCountCosineSimilarity(RelevanceScorer):
         cosine_similarity = dot_product / (doc_magnitude * query_magnitude)
         return cosine_similarity
 
+    def term_weight(self, term, query_tf, doc_frequency):
+        return query_tf
+
+    def term_scores(self, term_weight, tfs, doc_lengths):
+        return term_weight * tfs.astype(np.float64)
+
+    def finalize_scores(self, scores, doc_ids, doc_lengths, query_word_counts):
+        query_magnitude = math.sqrt(sum(tf ** 2 for tf in query_word_counts.values()))
+        denominators = self.doc_magnitudes[doc_ids] * query_magnitude
+        return np.divide(scores, denominators, out=np.zeros_like(scores), where=denominators != 0)
+
+    def score_batch(self, query_matrix):
+        if self.batch_document_weights is None:
+            self.batch_document_weights = self.index.get_document_term_matrix()
+        doc_term_matrix = self.batch_document_weights
+        dot_products = (_query_terms_matrix(query_matrix, doc_term_matrix.shape[1]) @ doc_term_matrix.T).tocsr()
+
+        # Divide each dot product by the query and document magnitudes
+        query_magnitudes = np.sqrt(np.asarray(query_matrix.multiply(query_matrix).sum(axis=1)).ravel())
+        denominators = query_magnitudes[_row_indices(dot_products)] * self.doc_magnitudes[dot_products.indices]
+        similarities = np.divide(dot_products.data, denominators,
+                                 out=np.zeros_like(dot_products.data), where=denominators != 0)
+        return _with_data(dot_products, similarities)
+
 
 class TF_IDF(RelevanceScorer):
     """
     Implements the TF-IDF ranking function for relevance scoring.
     """
+    supports_pruning = True
+
     def __init__(self, index, parameters={}):
         super().__init__(index, parameters)
         self.N = index.total_documents
@@ -154,11 +674,28 @@ class TF_IDF(RelevanceScorer):
             score += tf * idf
         return score
 
+    def term_weight(self, term, query_tf, doc_frequency):
+        return math.log((self.N + 1) / (doc_frequency + 1))
+
+    def term_scores(self, term_weight, tfs, doc_lengths):
+        return (1 + np.log(tfs)) * term_weight
+
+    def score_batch(self, query_matrix):
+        if self.batch_document_weights is None:
+            doc_term_matrix = self.index.get_document_term_matrix()
+            idf = np.log((self.N + 1) / (self.index.get_document_frequencies() + 1))
+            self.batch_document_weights = _with_data(
+                doc_term_matrix, (1 + np.log(doc_term_matrix.data)) * idf[doc_term_matrix.indices])
+        weights = self.batch_document_weights
+        return (_query_terms_matrix(query_matrix, weights.shape[1], binary=True) @ weights.T).tocsr()
+
 
 class BM25(RelevanceScorer):
     """
     Implements the BM25 ranking function for relevance scoring.
     """
+    supports_pruning = True
+
     def __init__(self, index, parameters={'k1': 1.5, 'b': 0.75}):
         super().__init__(index, parameters)
         self.k1 = parameters.get('k1', 1.5)
@@ -188,7 +725,28 @@ class BM25(RelevanceScorer):
 
             score += idf * tf_weight
         return score
-    
+
+    def term_weight(self, term, query_tf, doc_frequency):
+        return math.log((self.N - doc_frequency + 0.5) / (doc_frequency + 0.5) + 1)
+
+    def term_scores(self, term_weight, tfs, doc_lengths):
+        numerator = tfs * (self.k1 + 1)
+        denominator = tfs + self.k1 * (1 - self.b + self.b * (doc_lengths / self.avgdl))
+        return term_weight * (numerator / denominator)
+
+    def score_batch(self, query_matrix):
+        if self.batch_document_weights is None:
+            doc_term_matrix = self.index.get_document_term_matrix()
+            df = self.index.get_document_frequencies()
+            idf = np.log((self.N - df + 0.5) / (df + 0.5) + 1)
+            # Length normalisation of every document, indexed by int doc id
+            length_norms = self.k1 * (1 - self.b + self.b * (self.index.get_document_length_array() / self.avgdl))
+            tfs = doc_term_matrix.data
+            self.batch_document_weights = _with_data(
+                doc_term_matrix,
+                idf[doc_term_matrix.indices] * (tfs * (self.k1 + 1)) / (tfs + length_norms[_row_indices(doc_term_matrix)]))
+        weights = self.batch_document_weights
+        return (_query_terms_matrix(query_matrix, weights.shape[1], binary=True) @ weights.T).tocsr()
 
 
 class DirichletLM(RelevanceScorer):
@@ -198,14 +756,9 @@ class DirichletLM(RelevanceScorer):
     def __init__(self, index, parameters={'mu': 2000}):
         super().__init__(index, parameters)
         self.mu = parameters.get('mu', 2000)
-        # Precompute collection statistics
+        # Collection statistics are precomputed by the index
         stats = self.index.get_statistics()
         self.collection_length = stats['total_token_count']
-        # Compute collection term frequencies
-        self.collection_term_freqs = {}
-        for term, postings in self.index.index.items():
-            collection_tf = sum(posting['tf'] for posting in postings)
-            self.collection_term_freqs[term] = collection_tf
 
     def score(self, doc_id, doc_word_counts, query_word_counts):
         doc_length = self.index.document_lengths.get(doc_id, 0)
@@ -214,7 +767,7 @@ class DirichletLM(RelevanceScorer):
 
         for term, query_tf in query_word_counts.items():
             doc_tf = doc_word_counts.get(term, 0)
-            collection_tf = self.collection_term_freqs.get(term, 0)
+            collection_tf = self.index.get_term_metadata(term)['collection_frequency']
 
             if collection_tf == 0:
                 continue
@@ -225,12 +778,55 @@ class DirichletLM(RelevanceScorer):
 
         return score
 
+    # With p = collection_tf / collection_length, each query term contributes
+    # query_tf * log((tf + mu * p) / (doc_length + mu)) to every candidate document. This splits into
+    # query_tf * log(1 + tf / (mu * p)) for the documents containing the term (accumulated from the
+    # postings) plus query_tf * log(mu * p / (doc_length + mu)) for every candidate (added when finalizing).
+
+    def term_weight(self, term, query_tf, doc_frequency):
+        return query_tf, self.mu * self.index.get_term_metadata(term)['collection_frequency'] / self.collection_length
+
+    def term_scores(self, term_weight, tfs, doc_lengths):
+        query_tf, smoothed_probability = term_weight
+        return query_tf * np.log1p(tfs / smoothed_probability)
+
+    def finalize_scores(self, scores, doc_ids, doc_lengths, query_word_counts):
+        for term, query_tf in query_word_counts.items():
+            collection_tf = self.index.get_term_metadata(term)['collection_frequency']
+            if collection_tf == 0:
+                continue
+            smoothed_probability = self.mu * collection_tf / self.collection_length
+            scores = scores + query_tf * np.log(smoothed_probability / (doc_lengths + self.mu))
+        return scores
+
+    def score_batch(self, query_matrix):
+        doc_lengths = self.index.get_document_length_array()
+        if self.batch_document_weights is None:
+            doc_term_matrix = self.index.get_document_term_matrix()
+            collection_tfs = self.index.get_collection_term_frequencies()
+            self.batch_smoothed_probabilities = self.mu * collection_tfs / self.collection_length
+            # As in finalize_scores, query terms that no document contains are skipped
+            self.batch_log_smoothed_probabilities = _log_where_positive(self.batch_smoothed_probabilities)
+            self.batch_in_collection = (collection_tfs > 0).astype(float)
+            self.batch_document_weights = _with_data(
+                doc_term_matrix, np.log1p(doc_term_matrix.data / self.batch_smoothed_probabilities[doc_term_matrix.indices]))
+        weights = self.batch_document_weights
+        query_terms = _query_terms_matrix(query_matrix, weights.shape[1])
+
+        # Same split as in the term-at-a-time path: the contributions of the query terms a document
+        # contains, plus query_tf * log(mu * p / (doc_length + mu)) for every query term
+        scores = (query_terms @ weights.T).toarray()
+        scores += (query_terms @ self.batch_log_smoothed_probabilities)[:, np.newaxis]
+        scores -= (query_terms @ self.batch_in_collection)[:, np.newaxis] * np.log(doc_lengths + self.mu)[np.newaxis, :]
+        return scores
 
 
 class PivotedNormalization(RelevanceScorer):
     """
     Implements Pivoted Normalization for relevance scoring.
     """
+    supports_pruning = True
+
     def __init__(self, index, parameters={'b': 0.2}):
         super().__init__(index, parameters)
         self.b = parameters.get('b', 0.2)
@@ -261,3 +857,25 @@ class PivotedNormalization(RelevanceScorer):
             score += qf * idf * tf
 
         return score
+
+    def term_weight(self, term, query_tf, doc_frequency):
+        return query_tf * math.log((self.N + 1) / doc_frequency)
+
+    def term_scores(self, term_weight, tfs, doc_lengths):
+        tf = (1 + np.log(1 + np.log(tfs))) / (1 - self.b + self.b * (doc_lengths / self.avgdl))
+        return term_weight * tf
+
+    def score_batch(self, query_matrix):
+        if self.batch_document_weights is None:
+            doc_term_matrix = self.index.get_document_term_matrix()
+            df = self.index.get_document_frequencies()
+            # Terms that no document contains have no postings to weight
+            idf = _log_where_positive(np.divide(self.N + 1, df, out=np.zeros(len(df)), where=df > 0))
+            # Length normalisation of every document, indexed by int doc id
+            length_norms = 1 - self.b + self.b * (self.index.get_document_length_array() / self.avgdl)
+            self.batch_document_weights = _with_data(
+                doc_term_matrix,
+                idf[doc_term_matrix.indices] * (1 + np.log(1 + np.log(doc_term_matrix.data)))
+                / length_norms[_row_indices(doc_term_matrix)])
+        weights = self.batch_document_weights
+        return (_query_terms_matrix(query_matrix, weights.shape[1]) @ weights.T).tocsr()
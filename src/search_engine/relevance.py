@@ -116,6 +116,10 @@ def run_relevance_tests(relevance_data_filename: str, rankers: dict, l2r_ranker,
     per_ranker_ndcg_scores = {name: [] for name in rankers.keys()}
     per_ranker_ndcg_scores['L2R'] = []
 
+    # Score all test queries at once with each base ranker
+    base_ranker_results = {name: dict(zip(test_queries, ranker.query_batch(test_queries, k=k)))
+                           for name, ranker in rankers.items()}
+
     # For each test query
     for test_query in test_queries:
         # Get the relevance judgments for this query
@@ -132,7 +136,7 @@ def run_relevance_tests(relevance_data_filename: str, rankers: dict, l2r_ranker,
                 # print(f"Results for query '{test_query}': {results}")
             else:
                 # Use base ranker
-                results = rankers[ranker_name].query(test_query, k=k)
+                results = base_ranker_results[ranker_name][test_query]
             
             # Get retrieved docids and their relevances
             retrieved_docids = [docid for docid, score in results]
@@ -0,0 +1,86 @@
+import argparse
+import csv
+import statistics
+import time
+import numpy as np
+from document_preprocessor import RegexTokenizer, TokenNormalizer
+from indexing import Indexer
+from ranker import Ranker, BM25
+from l2r import L2RFeatureExtractor, L2RRanker, MiscFunctionsL2R
+
+# Measure the per-query L2R rerank latency (featurizing and scoring the base ranker's top k documents)
+# for the per-document features, the batched features with LightGBM and the batched features with the
+# NumPy tree evaluator.
+# Example: python benchmark_l2r.py index_directory title_index_directory l2r_model.txt --queries train_data_edited.csv
+parser = argparse.ArgumentParser(description="Benchmark the L2R rerank latency per query.")
+parser.add_argument('index_directory', help="Directory of the main index")
+parser.add_argument('title_index_directory', help="Directory of the title index")
+parser.add_argument('model_path', help="Trained LightGBM model file (see L2RRanker.save_model)")
+parser.add_argument('--queries', default='train_data_edited.csv', help="CSV file with a 'Query' column")
+parser.add_argument('--stopwords', default='../data/stopwords.txt', help="Stopwords file, one per line")
+parser.add_argument('--network_features', default=None, help="Network statistics CSV (optional)")
+parser.add_argument('--k', type=int, nargs='+', default=[15, 100, 1000], help="Numbers of documents to rerank")
+parser.add_argument('--max_queries', type=int, default=50, help="Number of queries to time")
+args = parser.parse_args()
+
+with open(args.stopwords, 'r', encoding='utf-8') as f:
+    stop_words = set(f.read().splitlines())
+with open(args.queries, 'r', encoding='utf-8') as f:
+    queries = list(dict.fromkeys(row['Query'].strip() for row in csv.DictReader(f)))[:args.max_queries]
+
+index = Indexer.load_index(args.index_directory)
+title_index = Indexer.load_index(args.title_index_directory)
+tokenizer = RegexTokenizer.from_config(index.tokenizer_config, stopwords=stop_words,
+                                       normalizer=TokenNormalizer.from_config(index.normalizer_config))
+network_features = (MiscFunctionsL2R().load_network_features(args.network_features)
+                    if args.network_features else None)
+feature_extractor = L2RFeatureExtractor(index, title_index, tokenizer, stop_words, network_features)
+ranker = Ranker(index, tokenizer, stop_words, BM25(index))
+l2r_ranker = L2RRanker(index, title_index, tokenizer, stop_words, ranker, feature_extractor)
+l2r_ranker.load_model(args.model_path)
+model = l2r_ranker.model
+
+
+def rerank_per_document(docids, query_tokens):
+    X = [feature_extractor.generate_features(docid, index.doc_term_freqs.get(docid, {}),
+                                             title_index.doc_term_freqs.get(docid, {}), query_tokens, '')
+         for docid in docids]
+    return model.predict(X)
+
+
+def rerank_batch(docids, query_tokens):
+    return model.predict(feature_extractor.generate_features_batch(docids, query_tokens))
+
+
+print(f"{len(queries)} queries")
+print(f"{'k':>6}{'mode':>26}{'median (ms)':>14}{'p95 (ms)':>10}")
+for k in args.k:
+    # The base ranker's candidates are computed once; only the reranking is timed
+    candidates = []
+    for query in queries:
+        query_tokens = [token for token in tokenizer.tokenize(query) if token not in stop_words]
+        docids = [docid for docid, _ in ranker.query(query, k=k)]
+        if docids:
+            candidates.append((docids, query_tokens))
+
+    runs = [
+        ('per-document + lightgbm', False, rerank_per_document),
+        ('batch + lightgbm', False, rerank_batch),
+        ('batch + numpy trees', True, rerank_batch),
+    ]
+    scores = {}
+    for name, use_tree_predictor, rerank in runs:
+        model.use_tree_predictor(use_tree_predictor)
+        latencies, scores[name] = [], []
+        for docids, query_tokens in candidates:
+            start = time.perf_counter()
+            scores[name].append(rerank(docids, query_tokens))
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        print(f"{k:>6}{name:>26}{statistics.median(latencies):>14.3f}"
+              f"{latencies[int(0.95 * (len(latencies) - 1))]:>10.3f}")
+
+    largest_difference = max((np.abs(np.asarray(a) - np.asarray(b)).max()
+                              for a, b in zip(scores['per-document + lightgbm'], scores['batch + numpy trees'])),
+                             default=0.0)
+    print(f"{'':>6}largest score difference between the modes: {largest_difference:.2e}")
@@ -0,0 +1,58 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from indexing import Indexer
+from postings_codecs import PostingsCodec
+
+# Compare the size and decode speed of the postings codecs on an existing index.
+# Example: python benchmark_postings.py /app/icd_10_index_dir
+parser = argparse.ArgumentParser(description="Benchmark the postings codecs on an index.")
+parser.add_argument('index_directory', help="Directory of the index to benchmark (any format)")
+parser.add_argument('--repeat', type=int, default=3, help="Number of decode runs; the best one is reported")
+parser.add_argument('--long_postings', type=int, default=1024,
+                    help="Minimum document frequency of the terms in the long postings decode benchmark")
+args = parser.parse_args()
+
+POSTINGS_FILES = ['postings_doc_gaps.npy', 'postings_tfs.npy', 'postings.npy', 'block_offsets.npy',
+                  'block_last_doc_ids.npy', 'block_max_tf.npy', 'block_min_doc_length.npy', 'term_block_offsets.npy']
+
+index = Indexer.load_index(args.index_directory)
+doc_frequencies = index.get_document_frequencies()
+long_terms = [term for term, doc_frequency in zip(index.terms, doc_frequencies) if doc_frequency >= args.long_postings]
+number_of_postings = int(doc_frequencies.sum())
+number_of_long_postings = int(doc_frequencies[doc_frequencies >= args.long_postings].sum())
+print(f"{len(index.terms)} terms, {number_of_postings} postings, "
+      f"{len(long_terms)} terms with at least {args.long_postings} postings")
+
+
+def best_decode_time(codec_index, terms):
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for term in terms:
+            codec_index.index[term].arrays()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+print(f"{'codec':<12}{'size (MB)':>10}{'bits/posting':>14}{'save (s)':>10}"
+      f"{'decode all (s)':>16}{'decode long (M postings/s)':>28}")
+for codec in PostingsCodec:
+    directory = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        index.save_binary(directory, codec)
+        save_time = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in POSTINGS_FILES
+                   if os.path.exists(os.path.join(directory, name)))
+
+        codec_index = Indexer.load_index(directory)
+        decode_time = best_decode_time(codec_index, codec_index.terms)
+        long_decode_time = best_decode_time(codec_index, long_terms)
+        long_throughput = number_of_long_postings / long_decode_time / 1e6 if long_terms else float('nan')
+        print(f"{codec.value:<12}{size / 2 ** 20:>10.2f}{8 * size / max(number_of_postings, 1):>14.2f}"
+              f"{save_time:>10.2f}{decode_time:>16.2f}{long_throughput:>28.2f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
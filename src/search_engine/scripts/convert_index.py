@@ -0,0 +1,19 @@
+import argparse
+from indexing import Indexer, IndexFormat
+from postings_codecs import PostingsCodec
+
+# Convert an index directory between the JSON and the binary (memory-mapped) formats.
+# Example: python convert_index.py index_directory index_directory_binary --format binary --codec varbyte
+parser = argparse.ArgumentParser(description="Convert an index between the JSON and binary formats.")
+parser.add_argument('source_directory', help="Directory of the existing index (format is detected)")
+parser.add_argument('target_directory', help="Directory to write the converted index to")
+parser.add_argument('--format', choices=[index_format.value for index_format in IndexFormat],
+                    default=IndexFormat.BINARY.value, help="Format to convert to")
+parser.add_argument('--codec', choices=[codec.value for codec in PostingsCodec], default=PostingsCodec.RAW.value,
+                    help="Compression of the postings in the binary format")
+args = parser.parse_args()
+
+print(f"Converting {args.source_directory} to {args.format} format in {args.target_directory}...")
+Indexer.convert_index(args.source_directory, args.target_directory, IndexFormat(args.format),
+                      PostingsCodec(args.codec))
+print("Index converted.")
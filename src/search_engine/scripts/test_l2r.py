@@ -2,7 +2,7 @@ import os
 import pandas as pd
 import numpy as np
 import csv
-from document_preprocessor import RegexTokenizer
+from document_preprocessor import RegexTokenizer, TokenNormalizer
 from indexing import Indexer, IndexType
 from ranker import Ranker, BM25, TF_IDF, WordCountCosineSimilarity, DirichletLM, PivotedNormalization
 from l2r import L2RFeatureExtractor, L2RRanker, MiscFunctionsL2R
@@ -13,9 +13,6 @@ with open('stopwords.txt', 'r', encoding='utf-8') as f:
     stop_words = f.read().splitlines()
 stop_words = set(stop_words)
 
-# Initialize the tokenizer
-tokenizer = RegexTokenizer(stopwords=stop_words)
-
 # Paths to the index directories
 index_directory = 'index_directory'
 title_index_directory = 'title_index_directory'
@@ -23,6 +20,12 @@ title_index_directory = 'title_index_directory'
 # Path to the dataset
 dataset_path = 'output.jsonl'
 
+# Initialize the tokenizer, tokenizing and normalizing the way an existing index was built
+index_exists = os.path.exists(index_directory)
+tokenizer = RegexTokenizer.from_config(
+    Indexer.load_tokenizer_config(index_directory) if index_exists else None, stopwords=stop_words,
+    normalizer=TokenNormalizer.from_config(Indexer.load_normalizer_config(index_directory) if index_exists else None))
+
 # Load or create the main index
 if os.path.exists(index_directory):
     print("Loading existing main index...")
@@ -1,6 +1,6 @@
 import os
 import csv
-from document_preprocessor import RegexTokenizer
+from document_preprocessor import RegexTokenizer, TokenNormalizer
 from indexing import Indexer
 from ranker import Ranker, BM25
 from l2r import L2RFeatureExtractor, L2RRanker, MiscFunctionsL2R
@@ -9,9 +9,6 @@ from l2r import L2RFeatureExtractor, L2RRanker, MiscFunctionsL2R
 with open('stopwords.txt', 'r', encoding='utf-8') as f:
     stop_words = set(f.read().splitlines())
 
-# Initialize the tokenizer
-tokenizer = RegexTokenizer(stopwords=stop_words)
-
 # Paths to the index directories
 index_directory = 'index_directory'
 title_index_directory = 'title_index_directory'
@@ -25,6 +22,10 @@ print("Loading title index...")
 title_index = Indexer.load_index(title_index_directory)
 print("Title index loaded.")
 
+# Initialize the tokenizer, tokenizing and normalizing queries the way the index was built
+tokenizer = RegexTokenizer.from_config(index.tokenizer_config, stopwords=stop_words,
+                                       normalizer=TokenNormalizer.from_config(index.normalizer_config))
+
 # Initialize the scorer and ranker
 bm25_scorer = BM25(index)
 base_ranker = Ranker(
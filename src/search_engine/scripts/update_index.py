@@ -0,0 +1,46 @@
+import argparse
+from document_preprocessor import RegexTokenizer, TokenNormalizer
+from indexing import Indexer, SegmentedIndex
+from postings_codecs import PostingsCodec
+
+# Incrementally update the main and title indexes without rebuilding them: documents of a JSONL file
+# (e.g. new or re-scraped ICD-10 pages) are added or replaced, and documents can be deleted.
+# A running front_end picks up the new index generation on its own.
+# Example: python update_index.py --add new_pages.jsonl --delete A00.0 A00.1
+parser = argparse.ArgumentParser(description="Incrementally update the search indexes.")
+parser.add_argument('--add', help="JSONL file of documents to add or replace")
+parser.add_argument('--delete', nargs='*', default=[], help="Doc ids to delete")
+parser.add_argument('--merge', action='store_true', help="Merge all segments into one afterwards")
+parser.add_argument('--codec', choices=[codec.value for codec in PostingsCodec],
+                    help="Compression of the postings of the new segments (default: the codec the index was built with)")
+parser.add_argument('--index_directory', default='/app/icd_10_index_dir')
+parser.add_argument('--title_index_directory', default='/app/icd_10_title_index_dir')
+parser.add_argument('--stopwords', default='/app/front_end/stopwords.txt')
+args = parser.parse_args()
+
+with open(args.stopwords, 'r', encoding='utf-8') as f:
+    stop_words = set(f.read().splitlines())
+# Tokenize the documents with the tokenizer settings and normalizer the indexes were built with
+tokenizer = RegexTokenizer.from_config(
+    Indexer.load_tokenizer_config(args.index_directory), stopwords=stop_words,
+    normalizer=TokenNormalizer.from_config(Indexer.load_normalizer_config(args.index_directory)))
+
+index_directories = {'text': args.index_directory, 'title': args.title_index_directory}
+postings_codec = PostingsCodec(args.codec) if args.codec else None
+if args.add:
+    generations = Indexer.update_indexes(args.add, tokenizer, {'text': ['text'], 'title': ['title']},
+                                         index_directories, id_key='docid', deleted_doc_ids=args.delete,
+                                         postings_codec=postings_codec)
+    print(f"Published index generations: {generations}")
+elif args.delete:
+    for name, directory in index_directories.items():
+        segmented_index = SegmentedIndex(directory, postings_codec=postings_codec)
+        print(f"Published {name} index generation {segmented_index.delete_documents(args.delete)}")
+        # Rewrite the segments with many deleted documents (update_indexes does it when adding)
+        if segmented_index.maybe_merge():
+            print(f"Merged {name} index segments into generation {segmented_index.current_generation()}")
+
+if args.merge:
+    for name, directory in index_directories.items():
+        print(f"Merged {name} index into generation "
+              f"{SegmentedIndex(directory, postings_codec=postings_codec).force_merge()}")
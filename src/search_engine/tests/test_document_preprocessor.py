@@ -0,0 +1,57 @@
+# test_document_preprocessor.py
+
+import numpy as np
+import pytest
+
+from document_preprocessor import RegexTokenizer, Vocabulary
+
+
+def test_vocabulary_assigns_dense_term_ids():
+    vocabulary = Vocabulary(['b', 'a'])
+    assert vocabulary.add('a') == 1
+    assert vocabulary.add('c') == 2
+    assert np.array_equal(vocabulary.add_many(['d', 'a', 'd', 'e', 'c']), [3, 1, 3, 4, 2])
+    assert vocabulary.terms == ['b', 'a', 'c', 'd', 'e']
+    assert vocabulary.term_ids == {'b': 0, 'a': 1, 'c': 2, 'd': 3, 'e': 4}
+    assert len(vocabulary) == 5
+    assert 'e' in vocabulary and 'f' not in vocabulary
+    assert vocabulary.get('d') == 3
+    assert vocabulary.get('f') is None
+    assert vocabulary.get('f', -2) == -2
+
+
+def test_vocabulary_lookup_does_not_add_terms():
+    vocabulary = Vocabulary(['a', 'b'])
+    term_ids = vocabulary.lookup(['b', 'x', 'a'])
+    assert term_ids.dtype == np.int64
+    assert np.array_equal(term_ids, [1, Vocabulary.UNKNOWN_TERM_ID, 0])
+    assert vocabulary.terms == ['a', 'b']
+    assert np.array_equal(vocabulary.add_many([]), np.zeros(0, dtype=np.int64))
+
+
+def test_vocabulary_save_and_load(tmp_path):
+    vocabulary = Vocabulary()
+    vocabulary.add_many(['fever', 'cough', 'fever', 'rash'])
+    vocabulary.save(str(tmp_path / 'terms.json'))
+    loaded = Vocabulary.load(str(tmp_path / 'terms.json'))
+    assert loaded.terms == vocabulary.terms
+    assert loaded.term_ids == vocabulary.term_ids
+
+
+@pytest.mark.parametrize('fast', [True, False])
+def test_tokenize_ids(fast):
+    tokenizer = RegexTokenizer(fast=fast)
+    text = 'Fever and cough, then FEVER again.'
+    tokens = tokenizer.tokenize(text)
+    vocabulary = Vocabulary(['cough'])
+
+    # Querying maps unknown tokens to UNKNOWN_TERM_ID, leaving the vocabulary as it is
+    term_ids = tokenizer.tokenize_ids(text, vocabulary)
+    assert np.array_equal(term_ids, [0 if token == 'cough' else Vocabulary.UNKNOWN_TERM_ID for token in tokens])
+    assert vocabulary.terms == ['cough']
+
+    # Indexing adds the new terms in order of first occurrence
+    term_ids = tokenizer.tokenize_ids(text, vocabulary, add=True)
+    assert [vocabulary.terms[term_id] for term_id in term_ids] == tokens
+    assert vocabulary.terms == ['cough'] + [token for token in dict.fromkeys(tokens) if token != 'cough']
+    assert np.array_equal(tokenizer.tokenize_ids(text, vocabulary), term_ids)
@@ -0,0 +1,102 @@
+# test_postings_codecs.py
+
+import numpy as np
+import pytest
+
+from postings_codecs import (BLOCK_SIZE, PostingsCodec, decode_block, decode_postings, elias_fano_decode,
+                             elias_fano_encode, encode_postings, pfor_decode, pfor_encode, varbyte_decode,
+                             varbyte_encode)
+
+CODECS = [PostingsCodec.VARBYTE, PostingsCodec.PFOR, PostingsCodec.ELIAS_FANO]
+
+
+def random_postings(count, seed, max_gap=50):
+    """
+    Make increasing int doc ids with random gaps (and a few huge ones), and term frequencies.
+    """
+    rng = np.random.default_rng(seed)
+    gaps = np.where(rng.random(count) < 0.05, rng.integers(1, 1 << 20, size=count), rng.integers(1, max_gap, size=count))
+    doc_ids = np.cumsum(gaps) - 1
+    tfs = np.where(rng.random(count) < 0.05, 100000, rng.integers(1, 6, size=count))
+    return doc_ids.astype(np.uint32), tfs.astype(np.uint32)
+
+
+def encoded(codec, doc_ids, tfs):
+    """
+    Encode postings into one buffer, with the offsets of the blocks and their skip pointers.
+    """
+    blocks, block_lengths, last_doc_ids = encode_postings(codec, doc_ids, tfs)
+    buffer = np.concatenate(blocks + [np.zeros(0, dtype=np.uint8)]).astype(np.uint8)
+    block_offsets = np.concatenate(([0], np.cumsum(block_lengths))).astype(np.int64)
+    return buffer, block_offsets, [0] + last_doc_ids[:-1]
+
+
+@pytest.mark.parametrize('values', [
+    np.zeros(0, dtype=np.uint64),
+    np.array([0, 1, 127, 128, 16383, 16384, 2 ** 32 - 1], dtype=np.uint64),
+    np.arange(1000, dtype=np.uint64) * 7919,
+])
+def test_varbyte_round_trip(values):
+    assert np.array_equal(varbyte_decode(varbyte_encode(values)), values)
+
+
+@pytest.mark.parametrize('values', [
+    np.zeros(BLOCK_SIZE, dtype=np.uint64),
+    np.arange(BLOCK_SIZE, dtype=np.uint64),
+    # Mostly small values with a few exceptions that need the high bits
+    np.where(np.arange(BLOCK_SIZE) % 17 == 0, 2 ** 31 + 5, np.arange(BLOCK_SIZE) % 8).astype(np.uint64),
+    np.array([2 ** 32 - 1], dtype=np.uint64),
+])
+def test_pfor_round_trip(values):
+    buffer = np.concatenate((np.array([42], dtype=np.uint8), pfor_encode(values), np.array([7], dtype=np.uint8)))
+    decoded, end = pfor_decode(buffer, 1, len(values))
+    assert np.array_equal(decoded, values)
+    assert end == len(buffer) - 1
+
+
+@pytest.mark.parametrize('values', [
+    np.array([0], dtype=np.uint64),
+    np.array([5, 5, 5, 6], dtype=np.uint64),
+    np.cumsum(np.arange(1, BLOCK_SIZE + 1)).astype(np.uint64),
+    np.array([0, 1, 2 ** 31, 2 ** 32 - 2], dtype=np.uint64),
+])
+def test_elias_fano_round_trip(values):
+    buffer = elias_fano_encode(values)
+    decoded, end = elias_fano_decode(buffer, 0, len(values))
+    assert np.array_equal(decoded, values)
+    assert end == len(buffer)
+
+
+@pytest.mark.parametrize('codec', CODECS)
+@pytest.mark.parametrize('count', [1, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, 5 * BLOCK_SIZE + 17])
+def test_postings_round_trip(codec, count):
+    doc_ids, tfs = random_postings(count, seed=count)
+    buffer, block_offsets, bases = encoded(codec, doc_ids, tfs)
+
+    decoded_doc_ids, decoded_tfs = decode_postings(codec, buffer, block_offsets, bases, count)
+    assert decoded_doc_ids.dtype == decoded_tfs.dtype == np.uint32
+    assert np.array_equal(decoded_doc_ids, doc_ids)
+    assert np.array_equal(decoded_tfs, tfs)
+
+    # Each block, and each run of blocks, decodes on its own from its skip pointer
+    for first in range(len(bases)):
+        block_doc_ids, block_tfs = decode_block(codec, buffer[block_offsets[first]:block_offsets[first + 1]],
+                                                min(BLOCK_SIZE, count - first * BLOCK_SIZE), bases[first])
+        assert np.array_equal(block_doc_ids, doc_ids[first * BLOCK_SIZE:(first + 1) * BLOCK_SIZE])
+        assert np.array_equal(block_tfs, tfs[first * BLOCK_SIZE:(first + 1) * BLOCK_SIZE])
+        run_doc_ids, run_tfs = decode_postings(codec, buffer, block_offsets[first:], bases[first:],
+                                               count - first * BLOCK_SIZE)
+        assert np.array_equal(run_doc_ids, doc_ids[first * BLOCK_SIZE:])
+        assert np.array_equal(run_tfs, tfs[first * BLOCK_SIZE:])
+
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_no_blocks(codec):
+    doc_ids, tfs = decode_postings(codec, np.zeros(0, dtype=np.uint8), np.zeros(1, dtype=np.int64), [], 0)
+    assert len(doc_ids) == len(tfs) == 0
+
+
+def test_encode_postings_skip_pointers():
+    doc_ids, tfs = random_postings(3 * BLOCK_SIZE + 1, seed=1)
+    _, _, last_doc_ids = encode_postings(PostingsCodec.PFOR, doc_ids, tfs)
+    assert last_doc_ids == [int(doc_ids[end - 1]) for end in (BLOCK_SIZE, 2 * BLOCK_SIZE, 3 * BLOCK_SIZE, len(doc_ids))]
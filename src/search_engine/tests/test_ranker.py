@@ -0,0 +1,75 @@
+# test_ranker.py
+
+import random
+
+import numpy as np
+import pytest
+
+from document_preprocessor import RegexTokenizer
+from indexing import InvertedIndex
+from postings_codecs import PostingsCodec
+from ranker import BM25, TF_IDF, DirichletLM, PivotedNormalization, Ranker, WordCountCosineSimilarity
+
+TOKENIZER = RegexTokenizer(fast=True)
+
+SCORERS = [WordCountCosineSimilarity, TF_IDF, BM25, DirichletLM, PivotedNormalization]
+
+QUERIES = ['w1', 'w1 w2 w3', 'w0 w7 w7 w40 w300', 'w5 w150 w299 notaterm', 'w2 w2 w2 w11 w12 w13 w14 w15 w16']
+
+
+def build_index(postings_codec, number_of_documents=1500, seed=0):
+    """
+    Build an index of random documents with Zipfian term frequencies, so that the frequent terms have
+    postings of many blocks.
+    """
+    rng = random.Random(seed)
+    index = InvertedIndex(postings_codec)
+    for doc_number in range(number_of_documents):
+        tokens = [f'w{int(rng.paretovariate(0.8)) % 300}' for _ in range(rng.randint(1, 80))]
+        index.add_document(f'doc{doc_number}', tokens, {'title': f'doc{doc_number}'})
+    return index
+
+
+@pytest.fixture(scope='module', params=['raw', 'pfor', 'pfor_binary'])
+def index(request, tmp_path_factory):
+    if request.param == 'raw':
+        return build_index(PostingsCodec.RAW)
+    index = build_index(PostingsCodec.PFOR)
+    if request.param == 'pfor_binary':
+        index_directory = str(tmp_path_factory.mktemp('index'))
+        index.save(index_directory)
+        index = InvertedIndex()
+        index.load(index_directory)
+    return index
+
+
+def assert_same_results(results, expected_results):
+    assert [doc_id for doc_id, _ in results] == [doc_id for doc_id, _ in expected_results]
+    assert np.allclose([score for _, score in results], [score for _, score in expected_results])
+
+
+@pytest.mark.parametrize('scorer_class', SCORERS)
+@pytest.mark.parametrize('k', [1, 10, 100])
+def test_query_batch_matches_query(index, scorer_class, k):
+    ranker = Ranker(index, TOKENIZER, set(), scorer_class(index))
+    for results, query in zip(ranker.query_batch(QUERIES, k), QUERIES):
+        assert_same_results(results, ranker.query(query, k))
+
+
+@pytest.mark.parametrize('scorer_class', [scorer_class for scorer_class in SCORERS if scorer_class.supports_pruning])
+@pytest.mark.parametrize('k', [1, 10, 100])
+def test_pruned_top_k_matches_exhaustive(index, scorer_class, k):
+    pruned = Ranker(index, TOKENIZER, set(), scorer_class(index), dynamic_pruning=True)
+    exhaustive = Ranker(index, TOKENIZER, set(), scorer_class(index), dynamic_pruning=False)
+    for query in QUERIES:
+        results = pruned.query(query, k)
+        assert len(results) == min(k, len(exhaustive.query(query, len(index.external_ids))))
+        assert_same_results(results, exhaustive.query(query, k))
+
+
+def test_query_without_known_terms(index):
+    ranker = Ranker(index, TOKENIZER, set(), BM25(index))
+    assert ranker.query('notaterm another', 10) == []
+    assert ranker.query_batch(['notaterm', 'w1'], 10)[0] == []
+    with pytest.raises(ValueError):
+        ranker.query('w1', 0)
@@ -0,0 +1,192 @@
+# test_segmented_index.py
+
+import json
+import os
+import random
+
+import numpy as np
+import pytest
+
+from document_preprocessor import RegexTokenizer
+from indexing import (Indexer, IndexType, InvertedIndex, MultiSegmentIndex, SegmentedIndex, _GenerationPin,
+                      SEGMENTS_DIRECTORY)
+from postings_codecs import PostingsCodec
+from ranker import BM25, Ranker
+
+TOKENIZER = RegexTokenizer(fast=True)
+
+
+def random_documents(doc_ids, seed, vocabulary_size=300):
+    """
+    Make (doc id, tokens, metadata) tuples of random documents.
+    """
+    rng = random.Random(seed)
+    documents = []
+    for doc_id in doc_ids:
+        tokens = [f'w{int(rng.paretovariate(1.0)) % vocabulary_size}' for _ in range(rng.randint(1, 40))]
+        documents.append((doc_id, tokens, {'title': f'{doc_id} ({seed})', 'text': ' '.join(tokens), 'url': '#'}))
+    return documents
+
+
+def add_documents(segmented_index, documents):
+    return segmented_index.add_documents(documents, TOKENIZER.normalizer_config, TOKENIZER.tokenizer_config)
+
+
+@pytest.fixture(params=[PostingsCodec.RAW, PostingsCodec.PFOR])
+def index_directory(tmp_path, request):
+    """
+    A binary index of 300 documents to update incrementally.
+    """
+    dataset_path = tmp_path / 'corpus.jsonl'
+    with open(dataset_path, 'w', encoding='utf-8') as f:
+        for doc_id, tokens, metadata in random_documents([f'doc{number}' for number in range(300)], seed=0):
+            f.write(json.dumps({'id': doc_id, 'title': metadata['title'], 'text': ' '.join(tokens)}) + '\n')
+    index = Indexer.create_index(IndexType.BASIC, str(dataset_path), TOKENIZER, ['text'], 'id',
+                                 postings_codec=request.param)
+    index.save(str(tmp_path / 'index'))
+    return str(tmp_path / 'index')
+
+
+def update_across_generations(index_directory):
+    """
+    Add, replace and delete documents over several generations, including documents deleted from
+    the original index and from later segments, and a deleted document that is added again.
+    """
+    segmented_index = SegmentedIndex(index_directory)
+    add_documents(segmented_index, random_documents([f'new{number}' for number in range(40)], seed=1))
+    segmented_index.delete_documents(['doc3', 'doc50', 'new7', 'missing'])
+    add_documents(segmented_index, random_documents(['doc10', 'doc11', 'new8', 'new100'], seed=2))
+    segmented_index.delete_documents(['doc12', 'new100'])
+    add_documents(segmented_index, random_documents(['doc3', 'new101'], seed=3))
+    return segmented_index
+
+
+def assert_same_index(index, expected):
+    assert index.external_ids == expected.external_ids
+    assert index.terms == expected.terms
+    assert index.get_statistics() == expected.get_statistics()
+    assert np.array_equal(index.get_document_frequencies(), expected.get_document_frequencies())
+    assert np.array_equal(index.get_collection_term_frequencies(), expected.get_collection_term_frequencies())
+    assert np.array_equal(index.get_document_length_array(), expected.get_document_length_array())
+    assert np.allclose(index.get_document_norm_array(), expected.get_document_norm_array())
+    for term in expected.terms:
+        doc_ids, tfs = index.get_postings(term).arrays()
+        expected_doc_ids, expected_tfs = expected.get_postings(term).arrays()
+        assert np.array_equal(doc_ids, expected_doc_ids), term
+        assert np.array_equal(tfs, expected_tfs), term
+        # The term bounds of a view may be looser than the merged index's
+        metadata, expected_metadata = index.get_term_metadata(term), expected.get_term_metadata(term)
+        assert metadata['max_tf'] >= expected_metadata['max_tf']
+        assert metadata['min_doc_length'] <= expected_metadata['min_doc_length']
+    for doc_id in expected.external_ids:
+        assert index.document_metadata[doc_id] == expected.document_metadata[doc_id]
+        assert dict(index.doc_term_freqs[doc_id]) == dict(expected.doc_term_freqs[doc_id])
+    assert (index.get_document_term_matrix() != expected.get_document_term_matrix()).nnz == 0
+    rows = np.array([5, 0, len(expected.external_ids) - 1, 17, 5])
+    assert (index.get_document_term_rows(rows) != expected.get_document_term_rows(rows)).nnz == 0
+
+
+def test_segments_are_queried_in_place(index_directory):
+    segmented_index = update_across_generations(index_directory)
+    manifest = segmented_index.read_manifest()
+    assert len(manifest['segments']) == 4
+
+    index = segmented_index.load()
+    assert isinstance(index, MultiSegmentIndex)
+    assert all(segment.is_memory_mapped for segment in index.segments)
+    expected = segmented_index._merge_into_index(manifest['segments'])
+    assert_same_index(index, expected)
+
+    ranker = Ranker(index, TOKENIZER, set(), BM25(index))
+    expected_ranker = Ranker(expected, TOKENIZER, set(), BM25(expected))
+    queries = ['w1 w2 w3', 'w4 w17 w250', 'w0', 'w5 w5 w9 w30']
+    for query in queries:
+        results, expected_results = ranker.query(query, 10), expected_ranker.query(query, 10)
+        assert [doc_id for doc_id, _ in results] == [doc_id for doc_id, _ in expected_results]
+        assert np.allclose([score for _, score in results], [score for _, score in expected_results])
+    for results, query in zip(ranker.query_batch(queries, 10), queries):
+        assert [doc_id for doc_id, _ in results] == [doc_id for doc_id, _ in ranker.query(query, 10)]
+
+    # Merging the segments gives the same index, loaded as a single segment
+    segmented_index.force_merge()
+    merged = segmented_index.load()
+    assert not isinstance(merged, MultiSegmentIndex)
+    assert_same_index(merged, expected)
+
+
+def test_deletes_and_replacements_across_generations(index_directory):
+    segmented_index = update_across_generations(index_directory)
+    index = segmented_index.load()
+
+    for doc_id in ('doc50', 'doc12', 'new7', 'new100', 'missing'):
+        assert doc_id not in index.internal_ids
+        assert doc_id not in index.document_metadata
+        assert doc_id not in index.doc_term_freqs
+    # 300 + 40 new, 3 deleted, 1 new, 2 deleted, 1 re-added and 1 new
+    assert index.total_documents == 300 + 40 - 3 + 1 - 2 + 2
+    assert len(set(index.external_ids)) == index.total_documents
+
+    # Replaced and re-added documents have the contents of their latest copy
+    latest = {doc_id: metadata for doc_id, _, metadata in
+              random_documents(['doc10', 'doc11', 'new8', 'new100'], seed=2) + random_documents(['doc3', 'new101'], seed=3)}
+    for doc_id in ('doc3', 'doc10', 'doc11', 'new8', 'new101'):
+        assert index.document_metadata[doc_id]['title'] == latest[doc_id]['title']
+    for term in index.terms:
+        doc_ids, _ = index.get_postings(term).arrays()
+        assert not {'doc50', 'doc12', 'new7', 'new100'} & {index.external_ids[doc_id] for doc_id in doc_ids.tolist()}
+
+    # Deleting every copy of a term's documents leaves it out of the vocabulary
+    only_term = 'onlyhere'
+    add_documents(segmented_index, [('lonely', [only_term, 'w1'], {'title': 'lonely'})])
+    assert only_term in segmented_index.load().terms
+    segmented_index.delete_documents(['lonely'])
+    index = segmented_index.load()
+    assert only_term not in index.terms
+    assert index.get_postings(only_term).arrays()[0].size == 0
+
+    # The merge policy rewrites the segments with many deletions
+    assert SegmentedIndex(index_directory, max_segments=2).maybe_merge()
+    assert_same_index(segmented_index.load(), index)
+
+
+def test_pinned_generations_keep_their_files(index_directory):
+    segmented_index = update_across_generations(index_directory)
+    loaded = segmented_index.load()
+    pinned_generation = segmented_index.current_generation()
+    pinned_segments = [segment['path'] for segment in segmented_index.read_manifest()['segments']]
+    pin = _GenerationPin(os.path.join(segmented_index.generations_directory, f'generation_{pinned_generation}.json'))
+    assert pin.acquire()
+
+    # Merging replaces every segment, twice, while a reader still loads the pinned generation
+    segmented_index.force_merge()
+    add_documents(segmented_index, random_documents(['late'], seed=4))
+    segmented_index.force_merge()
+    for path in pinned_segments:
+        assert os.path.isdir(os.path.join(index_directory, path))
+    assert pin.read_manifest()['generation'] == pinned_generation
+
+    # Once released, the next generation removes the pinned generation and its segments
+    pin.release()
+    segmented_index.delete_documents(['late'])
+    assert not os.path.exists(pin.manifest_path)
+    for path in pinned_segments:
+        if path.startswith(SEGMENTS_DIRECTORY):
+            assert not os.path.exists(os.path.join(index_directory, path))
+    current_segments = [segment['path'] for segment in segmented_index.read_manifest()['segments']]
+    assert sorted(os.listdir(os.path.join(index_directory, SEGMENTS_DIRECTORY))) == \
+        sorted(os.path.basename(path) for path in current_segments if path.startswith(SEGMENTS_DIRECTORY))
+
+    # An index loaded before its files were removed can still be queried
+    assert Ranker(loaded, TOKENIZER, set(), BM25(loaded)).query('w1 w2', 5)
+    assert loaded.document_metadata['new101']['title'] == 'new101 (3)'
+
+
+def test_removed_generation_is_not_pinned(index_directory):
+    segmented_index = update_across_generations(index_directory)
+    old_manifest = os.path.join(segmented_index.generations_directory,
+                                f'generation_{segmented_index.current_generation()}.json')
+    add_documents(segmented_index, random_documents(['another'], seed=5))
+    segmented_index.delete_documents(['another'])
+    assert not os.path.exists(old_manifest)
+    assert not _GenerationPin(old_manifest).acquire()
+    assert isinstance(segmented_index.load(), InvertedIndex)
@@ -0,0 +1,86 @@
+# test_spimi.py
+
+import json
+import os
+import random
+
+import numpy as np
+import pytest
+
+from document_preprocessor import RegexTokenizer
+from indexing import Indexer, IndexType, SpimiIndexWriter, _index_lines, _read_chunks
+from postings_codecs import PostingsCodec
+
+
+def write_corpus(path, number_of_documents=600, vocabulary_size=400, seed=0):
+    """
+    Write a JSONL corpus of random documents, with a few doc ids repeated far apart, so that the copies
+    land in different segments.
+    """
+    rng = random.Random(seed)
+    doc_ids = [f'doc{doc_number}' for doc_number in range(number_of_documents)]
+    for doc_number in (7, 150, 420):
+        doc_ids[doc_number + 100] = doc_ids[doc_number]
+    with open(path, 'w', encoding='utf-8') as f:
+        for doc_id in doc_ids:
+            # Zipfian-ish term choices, so that some postings span several blocks
+            words = [f'w{int(rng.paretovariate(1.0)) % vocabulary_size}' for _ in range(rng.randint(1, 60))]
+            f.write(json.dumps({'id': doc_id, 'title': doc_id.upper(), 'text': ' '.join(words)}) + '\n')
+
+
+def build_spimi_index(dataset_path, index_directory, tokenizer, postings_codec):
+    """
+    Build an index with a SpimiIndexWriter whose tiny memory budget forces it to flush many segments.
+    """
+    writer = SpimiIndexWriter(index_directory, 0.01, tokenizer.normalizer_config, tokenizer.tokenizer_config,
+                              postings_codec)
+    for first_line_num, lines in _read_chunks(dataset_path, 'utf-8', 1024 * 1024, -1):
+        _index_lines({'index': writer}, {'index': ['text']}, lines, first_line_num, tokenizer, 'id')
+    index = writer.close()
+    return index, len(writer.segment_directories)
+
+
+@pytest.mark.parametrize('postings_codec', [PostingsCodec.RAW, PostingsCodec.PFOR])
+def test_multi_segment_build_matches_in_memory_build(tmp_path, postings_codec):
+    dataset_path = str(tmp_path / 'corpus.jsonl')
+    write_corpus(dataset_path)
+    tokenizer = RegexTokenizer(fast=True)
+
+    expected = Indexer.create_index(IndexType.BASIC, dataset_path, tokenizer, ['text'], 'id')
+    index, number_of_segments = build_spimi_index(dataset_path, str(tmp_path / 'index'), tokenizer, postings_codec)
+
+    assert number_of_segments > 1
+    assert not os.path.exists(tmp_path / 'index' / 'segments')
+    assert index.postings_codec == postings_codec
+    assert index.external_ids == expected.external_ids
+    assert sorted(index.terms) == sorted(expected.terms)
+    assert index.get_statistics() == expected.get_statistics()
+    for term in expected.terms:
+        doc_ids, tfs = index.get_postings(term).arrays()
+        expected_doc_ids, expected_tfs = expected.get_postings(term).arrays()
+        assert np.array_equal(doc_ids, expected_doc_ids), term
+        assert np.array_equal(tfs, expected_tfs), term
+        assert index.get_term_metadata(term) == expected.get_term_metadata(term), term
+    assert np.array_equal(index.get_document_length_array(), expected.get_document_length_array())
+    assert np.allclose(index.get_document_norm_array(), expected.get_document_norm_array())
+    for doc_id in expected.external_ids:
+        assert index.document_metadata[doc_id] == expected.document_metadata[doc_id]
+
+
+def test_duplicate_doc_ids_keep_first_copy(tmp_path):
+    dataset_path = str(tmp_path / 'corpus.jsonl')
+    write_corpus(dataset_path)
+    tokenizer = RegexTokenizer(fast=True)
+
+    index, _ = build_spimi_index(dataset_path, str(tmp_path / 'index'), tokenizer, PostingsCodec.RAW)
+
+    assert len(index.external_ids) == len(set(index.external_ids)) == 597
+    with open(dataset_path, encoding='utf-8') as f:
+        first_copies = {}
+        for line in f:
+            doc = json.loads(line)
+            first_copies.setdefault(doc['id'], doc['text'])
+    for doc_id in ('doc7', 'doc150', 'doc420'):
+        assert index.document_metadata[doc_id]['text'] == first_copies[doc_id]
+    with open(tmp_path / 'index' / 'docids.json', encoding='utf-8') as f:
+        assert json.load(f) == index.external_ids